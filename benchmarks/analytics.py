@@ -0,0 +1,57 @@
+import argparse
+import time
+from fastapi import Response
+from benchmarks.common import createDatabase, scratchDatabasePath
+from database import openConnection
+from migrations import runMigrations
+import index
+
+
+# Compares /analytics/spend, served from the daily rollups, with aggregating the expense rows for every request
+# Run from the repo root with: python -m benchmarks.analytics
+
+
+# The spend per month aggregated from the expense rows, what it takes without the rollups
+def spendByExpenses(connection):
+    return connection.execute("""SELECT strftime('%Y-%m', DATE + ?, 'unixepoch'), SUM(VALUE), COUNT(*) FROM AMOUNTTRACKER
+WHERE TYPE = 'EXP' GROUP BY 1 ORDER BY 1""", [index.utcOffsetSeconds]).fetchall()
+
+
+def spendByRollups(connection, granularity, top=None):
+    return index.getSpendAnalytics(Response(), dateFrom=None, dateTo=None, granularity=granularity, amountID=None, top=top, connection=connection)
+
+
+# Returns the best of a few runs, in seconds
+def bestOf(function, runs):
+    timings = []
+    for _ in range(runs):
+        startTime = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - startTime)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spend per period from the rollups vs from the expense rows")
+    parser.add_argument("--amounts", type=int, nargs="+", default=[10000, 100000], help="No of amounts, one run per size")
+    parser.add_argument("--expenses", type=int, default=10, help="Expenses per amount")
+    parser.add_argument("--runs", type=int, default=3)
+    arguments = parser.parse_args()
+
+    print("expenses   from rows ms   month ms    day ms   top 10 descriptions ms")
+    for size in arguments.amounts:
+        databasePath = scratchDatabasePath()
+        createDatabase(databasePath, size, arguments.expenses)
+        connection = openConnection(databasePath)
+        runMigrations(connection)
+
+        rowsTime = bestOf(lambda: spendByExpenses(connection), arguments.runs)
+        monthTime = bestOf(lambda: spendByRollups(connection, "month"), arguments.runs)
+        dayTime = bestOf(lambda: spendByRollups(connection, "day"), arguments.runs)
+        topTime = bestOf(lambda: spendByRollups(connection, "day", 10), arguments.runs)
+        connection.close()
+        print("%8d %14.1f %10.2f %9.2f %24.1f" % (size * arguments.expenses, rowsTime * 1000, monthTime * 1000, dayTime * 1000, topTime * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import random
+import time
+
+
+# Measures the throughput of adding expenses one request at a time with /addAnExpense and in batches with /addExpensesBatch
+# Run from the repo root with: python -m benchmarks.batch
+
+
+def main():
+    from benchmarks.common import createDatabase, scratchDatabasePath
+    from database import openConnection
+    from migrations import runMigrations
+
+    parser = argparse.ArgumentParser(description="Expense ingest throughput by batch size")
+    parser.add_argument("--amounts", type=int, default=100, help="Amounts the expenses are spread over")
+    parser.add_argument("--expenses", type=int, default=20000, help="Expenses sent per batch size")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 100, 10000])
+    arguments = parser.parse_args()
+
+    databasePath = scratchDatabasePath()
+    amountIDs, _ = createDatabase(databasePath, arguments.amounts, 0)
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    # Makes every amount large enough to take all the expenses sent
+    connection.execute("UPDATE AMOUNTTRACKER SET VALUE = 1e12 WHERE TYPE = 'AMT'")
+    connection.commit()
+    connection.close()
+
+    from fastapi.testclient import TestClient
+    from database import pool
+    import index
+
+    pool.configure(databasePath)
+
+    def randomExpense():
+        return {"amountID": random.choice(amountIDs), "expenseDescription": "Bench", "expense": 1.5, "date": "01-Jun-2024"}
+
+    print("endpoint             batch size   expenses/s")
+    with TestClient(index.app) as client:
+        startTime = time.perf_counter()
+        for _ in range(arguments.expenses):
+            client.post("/addAnExpense", json=randomExpense())
+        print("%-20s %10d %12.0f" % ("/addAnExpense", 1, arguments.expenses / (time.perf_counter() - startTime)))
+
+        for batchSize in arguments.batch_sizes:
+            noOfBatches = max(1, arguments.expenses // batchSize)
+            batches = [[randomExpense() for _ in range(batchSize)] for _ in range(noOfBatches)]
+            startTime = time.perf_counter()
+            for batch in batches:
+                client.post("/addExpensesBatch", json={"expenses": batch})
+            print("%-20s %10d %12.0f" % ("/addExpensesBatch", batchSize, noOfBatches * batchSize / (time.perf_counter() - startTime)))
+
+
+if __name__ == "__main__":
+    main()
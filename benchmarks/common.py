@@ -0,0 +1,83 @@
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from helpers import generateID
+
+
+# Same schema as the AMOUNTTRACKER table in AMOUNTTRACKER.db
+queryToCreateTable = """CREATE TABLE AMOUNTTRACKER(
+ID VARCHAR(50) NOT NULL COLLATE NOCASE,
+AMT_EXP_DESC TEXT NOT NULL COLLATE NOCASE,
+VALUE REAL NOT NULL COLLATE NOCASE,
+TYPE VARCHAR(10) NOT NULL COLLATE NOCASE,
+DATE INTEGER NOT NULL COLLATE NOCASE,
+AMT_ID VARCHAR(50) COLLATE NOCASE
+)"""
+
+expenseDescriptions = ["Rent", "Food Outside", "Groceries", "EMI", "Travel",
+                       "Electricity", "Internet", "Fuel", "Medicines", "Gifts"]
+
+firstDate = 1704067200
+oneDay = 86400
+
+
+# Creates a DB at the path with amounts x expensesPerAmount synthetic rows
+# Every amount is large enough to hold all its expenses, so the DB is consistent with what the endpoints allow
+# Returns the generated amount IDs and expense IDs
+def createDatabase(path, amounts, expensesPerAmount, seed=13):
+    randomizer = random.Random(seed)
+    connection = sqlite3.connect(path)
+    cur = connection.cursor()
+    cur.execute(queryToCreateTable)
+
+    amountIDs = []
+    expenseIDs = []
+    queryToAddRow = "INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) Values (?, ?, ?, ?, ?, ?)"
+    for index in range(amounts):
+        amountID = generateID()
+        amountDate = firstDate + randomizer.randrange(365) * oneDay
+        expenseRows = []
+        for _ in range(expensesPerAmount):
+            expenseID = generateID()
+            expenseRows.append((expenseID, randomizer.choice(expenseDescriptions), float(randomizer.randrange(1, 500)),
+                                'EXP', amountDate + randomizer.randrange(60) * oneDay, amountID))
+            expenseIDs.append(expenseID)
+        amountValue = sum(row[2] for row in expenseRows) + randomizer.randrange(0, 2) * 1000
+        cur.execute(queryToAddRow, (amountID, "Amount " + str(index),
+                    float(amountValue or 1000), 'AMT', amountDate, None))
+        cur.executemany(queryToAddRow, expenseRows)
+        amountIDs.append(amountID)
+
+    connection.commit()
+    connection.close()
+    return amountIDs, expenseIDs
+
+
+# Returns a path for a scratch DB in a fresh temp directory
+def scratchDatabasePath(name="AMOUNTTRACKER.db"):
+    return os.path.join(tempfile.mkdtemp(prefix="amounttracker-bench-"), name)
+
+
+# Runs worker(threadIndex) on the given number of threads until the duration, in seconds, has passed
+# worker returns True when an operation succeeds and False when it fails
+# Returns the number of successful and failed operations
+def runConcurrently(worker, threads, duration):
+    deadline = time.perf_counter() + duration
+    counts = [[0, 0] for _ in range(threads)]
+
+    def loop(threadIndex):
+        while time.perf_counter() < deadline:
+            if worker(threadIndex):
+                counts[threadIndex][0] += 1
+            else:
+                counts[threadIndex][1] += 1
+
+    runningThreads = [threading.Thread(target=loop, args=(index,)) for index in range(threads)]
+    for thread in runningThreads:
+        thread.start()
+    for thread in runningThreads:
+        thread.join()
+    return sum(count[0] for count in counts), sum(count[1] for count in counts)
@@ -0,0 +1,69 @@
+import argparse
+import datetime
+import random
+import timeit
+import datecodec
+import helpers
+
+
+# Compares the strptime/strftime date helpers with the date codec that replaced them
+# Run from the repo root with: python -m benchmarks.dates
+
+
+# The helpers as they used to be, on datetime and the server's local time
+def checkDateFormatByStrptime(inputDate):
+    try:
+        datetime.datetime.strptime(inputDate, "%d-%b-%Y")
+        return True
+    except:
+        return False
+
+
+def convertDateToEpochByStrptime(inputDate):
+    return int(datetime.datetime.strptime(inputDate, "%d-%b-%Y").timestamp())
+
+
+def convertEpochToDateByStrftime(inputDate):
+    return datetime.datetime.fromtimestamp(inputDate).strftime('%d-%b-%Y')
+
+
+# What a write handler used to do with its date, check it, then convert it twice
+def writeHandlerByStrptime(inputDate):
+    if checkDateFormatByStrptime(inputDate):
+        convertDateToEpochByStrptime(inputDate)
+        convertDateToEpochByStrptime(inputDate)
+
+
+def report(name, oldFunction, newFunction, number):
+    oldTime = min(timeit.repeat(oldFunction, number=number, repeat=3)) / number
+    newTime = min(timeit.repeat(newFunction, number=number, repeat=3)) / number
+    print("%-34s %10.2f %10.2f %8.1fx" % (name, oldTime * 1e6, newTime * 1e6, oldTime / newTime))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="strptime/strftime helpers vs the date codec")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows in the formatted column")
+    parser.add_argument("--distinct-dates", type=int, default=365, help="Distinct dates in the formatted column")
+    parser.add_argument("--number", type=int, default=20000, help="Calls per timing of the single date functions")
+    arguments = parser.parse_args()
+
+    inputDate = "05-Aug-2024"
+    invalidDate = "31-Feb-2024"
+    epoch = datecodec.parseDate(inputDate)
+    firstEpoch = epoch - arguments.distinct_dates * 86400
+    column = [firstEpoch + random.randrange(arguments.distinct_dates) * 86400 for _ in range(arguments.rows)]
+
+    print("function                              old us     new us   speedup")
+    report("check valid date", lambda: checkDateFormatByStrptime(inputDate), lambda: helpers.checkDateFormat(inputDate), arguments.number)
+    report("check invalid date", lambda: checkDateFormatByStrptime(invalidDate), lambda: helpers.checkDateFormat(invalidDate), arguments.number)
+    report("date to epoch", lambda: convertDateToEpochByStrptime(inputDate), lambda: datecodec.parseDate(inputDate), arguments.number)
+    report("write handler, check + 2 converts", lambda: writeHandlerByStrptime(inputDate), lambda: datecodec.parseDate(inputDate), arguments.number)
+    report("epoch to date", lambda: convertEpochToDateByStrftime(epoch), lambda: datecodec.formatEpoch(epoch), arguments.number)
+    report("epoch to date, memo cleared", lambda: convertEpochToDateByStrftime(epoch),
+           lambda: (datecodec.formatEpoch.cache_clear(), datecodec.formatEpoch(epoch)), arguments.number)
+    report("column of %d epochs" % arguments.rows, lambda: [convertEpochToDateByStrftime(date) for date in column],
+           lambda: datecodec.formatEpochs(column), 10)
+
+
+if __name__ == "__main__":
+    main()
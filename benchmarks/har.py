@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from urllib.parse import parse_qsl, urlsplit
+import httpx
+from benchmarks.common import createDatabase, scratchDatabasePath
+from database import openConnection, pool
+from cache import responseCache
+from maintenance import loadHarRequests
+from migrations import runMigrations
+import index
+import settings
+
+
+# Load test built from the requests in PythonAmountTracker.har
+# Replays a weighted mix of the HAR's endpoints against the app in-process, through the ASGI transport, on synthetic DBs of a given size
+# Reports the throughput and p50/p95/p99 latency of every endpoint and writes the results as JSON, to compare between commits
+# Run from the repo root with: python -m benchmarks.har
+
+
+# Share of the mix each endpoint gets, as "METHOD path", endpoints not listed are not sent
+# The deletes are left out by default, as they empty the DB while it is being measured
+defaultWeights = {
+    "GET /getAmountExpenses": 30,
+    "GET /getAllAmounts": 5,
+    "GET /getAmountStatus": 5,
+    "GET /getAmountExpensesChart": 5,
+    "POST /addAnAmount": 5,
+    "POST /addAnExpense": 25,
+    "PUT /updateAnAmount": 10,
+    "PUT /updateAnExpense": 15,
+}
+
+# Dates set in the request bodies so the date checks pass, the synthetic amounts are all in 2024 and their expenses at most 60 days later
+amountDate = "01-Jan-2023"
+expenseDate = "31-Dec-2025"
+
+
+# The first HAR request of every endpoint, with its query params and body parsed, keyed by "METHOD path"
+def loadTemplates(harPath):
+    templates = {}
+    for harRequest in loadHarRequests(harPath):
+        splitURL = urlsplit(harRequest["url"])
+        endpoint = harRequest["method"] + " " + splitURL.path
+        if endpoint not in templates:
+            templates[endpoint] = {"method": harRequest["method"], "path": splitURL.path, "params": dict(parse_qsl(splitURL.query)),
+                                   "body": json.loads(harRequest["body"]) if harRequest["body"] else None}
+    return templates
+
+
+# Makes a request of an endpoint from its template, pointed at random rows of the synthetic DB
+def buildRequest(template, randomizer, amountIDs, expenseIDs):
+    params = dict(template["params"])
+    body = dict(template["body"]) if template["body"] is not None else None
+    for fields in [params, body]:
+        if fields is None:
+            continue
+        if "amountID" in fields:
+            fields["amountID"] = randomizer.choice(amountIDs)
+        if "expenseID" in fields:
+            fields["expenseID"] = randomizer.choice(expenseIDs)
+        if "date" in fields:
+            fields["date"] = expenseDate if "expenseDescription" in fields else amountDate
+    return template["method"], template["path"], params, body
+
+
+# Returns the value at the given fraction of the sorted latencies
+def percentile(sortedLatencies, fraction):
+    return sortedLatencies[min(len(sortedLatencies) - 1, int(fraction * len(sortedLatencies)))]
+
+
+# Sends the requests from the given no of concurrent clients, over one ASGI transport
+# Returns the wall time, in seconds, and every request's endpoint, status code and latency
+async def sendRequests(requests, concurrency):
+    transport = httpx.ASGITransport(app=index.app)
+    pendingRequests = iter(requests)
+    samples = []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+        async def worker():
+            for endpoint, (method, path, params, body) in pendingRequests:
+                startTime = time.perf_counter()
+                response = await client.request(method, path, params=params, json=body)
+                samples.append((endpoint, response.status_code, time.perf_counter() - startTime))
+
+        startTime = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return time.perf_counter() - startTime, samples
+
+
+# Creates a synthetic DB of about the given no of rows and runs the mix against it
+# Returns the results of every endpoint, keyed by "METHOD path"
+async def runSize(rows, arguments, templates, weights):
+    noOfAmounts = max(1, rows // (1 + arguments.expenses_per_amount))
+    databasePath = scratchDatabasePath()
+    amountIDs, expenseIDs = createDatabase(databasePath, noOfAmounts, arguments.expenses_per_amount, arguments.seed)
+    # Makes every amount large enough to take all the expenses sent, so the adds and updates are not refused
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    connection.execute("UPDATE AMOUNTTRACKER SET VALUE = 1e12 WHERE TYPE = 'AMT'")
+    connection.commit()
+    connection.close()
+
+    randomizer = random.Random(arguments.seed)
+    endpoints = [endpoint for endpoint in weights if endpoint in templates]
+    chosenEndpoints = randomizer.choices(endpoints, weights=[weights[endpoint] for endpoint in endpoints], k=arguments.requests)
+    requests = [(endpoint, buildRequest(templates[endpoint], randomizer, amountIDs, expenseIDs or amountIDs)) for endpoint in chosenEndpoints]
+
+    pool.configure(databasePath)
+    responseCache.clear()
+    async with index.lifespan(index.app):
+        wallTime, samples = await sendRequests(requests, arguments.concurrency)
+
+    results = {}
+    for endpoint in endpoints:
+        latencies = sorted(latency for sampleEndpoint, _, latency in samples if sampleEndpoint == endpoint)
+        if not latencies:
+            continue
+        statusCodes = {}
+        for sampleEndpoint, statusCode, _ in samples:
+            if sampleEndpoint == endpoint:
+                statusCodes[str(statusCode)] = statusCodes.get(str(statusCode), 0) + 1
+        results[endpoint] = {"requests": len(latencies), "throughput": len(latencies) / wallTime,
+                             "p50Ms": percentile(latencies, 0.50) * 1000, "p95Ms": percentile(latencies, 0.95) * 1000,
+                             "p99Ms": percentile(latencies, 0.99) * 1000, "statusCodes": statusCodes}
+    return {"rows": rows, "amounts": noOfAmounts, "wallTimeS": wallTime, "throughput": len(samples) / wallTime, "endpoints": results}
+
+
+def currentCommit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def printSize(sizeResult, baselineSize):
+    print("\n%d rows, %d amounts, %.0f requests/s overall" % (sizeResult["rows"], sizeResult["amounts"], sizeResult["throughput"]))
+    print("endpoint                         requests   req/s    p50 ms    p95 ms    p99 ms" + ("   p50 vs base" if baselineSize else ""))
+    for endpoint, result in sizeResult["endpoints"].items():
+        line = "%-32s %8d %7.0f %9.2f %9.2f %9.2f" % (endpoint, result["requests"], result["throughput"], result["p50Ms"], result["p95Ms"], result["p99Ms"])
+        baselineResult = baselineSize["endpoints"].get(endpoint) if baselineSize else None
+        if baselineResult:
+            line += " %12.2fx" % (result["p50Ms"] / baselineResult["p50Ms"])
+        print(line)
+
+
+# With more than one size, shows how the p50 of every endpoint grows against the no of rows
+# An endpoint which scales with the page it returns stays flat, one which reads the whole DB grows with the rows
+def printScaling(sizeResults):
+    firstSize = sizeResults[0]
+    print("\np50 growth from %d rows" % firstSize["rows"])
+    print("endpoint                         " + "".join("%12d" % sizeResult["rows"] for sizeResult in sizeResults))
+    for endpoint, firstResult in firstSize["endpoints"].items():
+        growths = [sizeResult["endpoints"][endpoint]["p50Ms"] / firstResult["p50Ms"] if endpoint in sizeResult["endpoints"] else float("nan")
+                   for sizeResult in sizeResults]
+        print("%-32s" % endpoint + "".join("%11.1fx" % growth for growth in growths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Weighted replay of the HAR endpoints against synthetic DBs")
+    parser.add_argument("--har", default="PythonAmountTracker.har")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000], help="Rows in the synthetic DB, amounts and expenses, one run per size")
+    parser.add_argument("--sweep", action="store_true", help="Run at 1k, 10k, 100k and 1M rows")
+    parser.add_argument("--expenses-per-amount", type=int, default=9)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests sent per size")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once")
+    parser.add_argument("--weight", action="append", default=[], metavar="'METHOD /path=WEIGHT'", help="Overrides the weight of an endpoint, 0 leaves it out")
+    parser.add_argument("--seed", type=int, default=13)
+    parser.add_argument("--output", help="Writes the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare the p50s with")
+    parser.add_argument("--repository", choices=["sqlite", "memory"], default=settings.REPOSITORY, help="Repository the endpoints read and write through")
+    arguments = parser.parse_args()
+    settings.REPOSITORY = arguments.repository
+
+    weights = dict(defaultWeights)
+    for weight in arguments.weight:
+        endpoint, _, value = weight.rpartition("=")
+        weights[endpoint] = float(value)
+    weights = {endpoint: weight for endpoint, weight in weights.items() if weight > 0}
+    templates = loadTemplates(arguments.har)
+    sizes = [1000, 10000, 100000, 1000000] if arguments.sweep else arguments.rows
+
+    baselineSizes = {}
+    if arguments.compare:
+        with open(arguments.compare, encoding="utf-8") as baselineFile:
+            baselineSizes = {sizeResult["rows"]: sizeResult for sizeResult in json.load(baselineFile)["sizes"]}
+
+    sizeResults = []
+    for rows in sizes:
+        sizeResult = asyncio.run(runSize(rows, arguments, templates, weights))
+        sizeResults.append(sizeResult)
+        printSize(sizeResult, baselineSizes.get(rows))
+    if len(sizeResults) > 1:
+        printScaling(sizeResults)
+
+    if arguments.output:
+        with open(arguments.output, "w", encoding="utf-8") as outputFile:
+            json.dump({"commit": currentCommit(), "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                       "settings": {"expensesPerAmount": arguments.expenses_per_amount, "requests": arguments.requests,
+                                    "concurrency": arguments.concurrency, "seed": arguments.seed, "weights": weights,
+                                    "repository": arguments.repository},
+                       "sizes": sizeResults}, outputFile, indent=2)
+        print("\nResults written to " + arguments.output)
+
+
+if __name__ == "__main__":
+    main()
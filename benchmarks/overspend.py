@@ -0,0 +1,79 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+
+
+# Stress test for the overspend check of /addAnExpense
+# Several processes, standing in for uvicorn workers sharing the DB file, fire expenses at one amount from many threads
+# Fails if the expenses added to the amount ever total more than the amount
+# Run from the repo root with: python -m benchmarks.overspend
+
+amountValue = 1000.0
+expenseValue = 1.0
+
+
+# Runs in a worker process, sends its share of expenses from the given number of threads
+# Returns the number of expenses which were accepted
+def fireExpenses(databasePath, amountID, threads, expensesPerThread):
+    os.environ["AMOUNTTRACKER_DB"] = databasePath
+    from fastapi.testclient import TestClient
+    import index
+
+    accepted = [0] * threads
+
+    def sendExpenses(threadIndex):
+        client = TestClient(index.app)
+        for _ in range(expensesPerThread):
+            response = client.post("/addAnExpense", json={"amountID": amountID, "expenseDescription": "Stress",
+                                                          "expense": expenseValue, "date": "01-Jan-2024"})
+            if response.status_code == 200:
+                accepted[threadIndex] += 1
+
+    runningThreads = [threading.Thread(target=sendExpenses, args=(index,)) for index in range(threads)]
+    for thread in runningThreads:
+        thread.start()
+    for thread in runningThreads:
+        thread.join()
+    return sum(accepted)
+
+
+def main():
+    from benchmarks.common import createDatabase, scratchDatabasePath
+    from database import openConnection
+    from datecodec import parseDate
+    from helpers import convertValueToCents, convertCentsToValue
+    from migrations import runMigrations
+
+    parser = argparse.ArgumentParser(description="Parallel expenses against one amount must never overspend it")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8, help="Threads per process")
+    parser.add_argument("--expenses", type=int, default=100, help="Expenses sent per thread")
+    arguments = parser.parse_args()
+
+    databasePath = scratchDatabasePath()
+    createDatabase(databasePath, 0, 0)
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    amountID = "StressAmount"
+    connection.execute("INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE) Values (?, ?, ?, ?, ?)",
+                       (amountID, "Stress", convertValueToCents(amountValue), 'AMT', parseDate("01-Jan-2024")))
+    connection.commit()
+
+    with multiprocessing.get_context("spawn").Pool(arguments.processes) as processes:
+        acceptedPerProcess = processes.starmap(fireExpenses, [(databasePath, amountID, arguments.threads, arguments.expenses)] * arguments.processes)
+
+    totalSpent = convertCentsToValue(connection.execute("SELECT COALESCE(SUM(VALUE), 0) FROM AMOUNTTRACKER WHERE AMT_ID = ?", [amountID]).fetchone()[0])
+    connection.close()
+
+    sent = arguments.processes * arguments.threads * arguments.expenses
+    print("sent " + str(sent) + " expenses, accepted " + str(sum(acceptedPerProcess)) +
+          ", spent " + str(totalSpent) + " of " + str(amountValue))
+    if totalSpent > amountValue or sum(acceptedPerProcess) * expenseValue != totalSpent:
+        print("FAILED, the amount was overspent")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import random
+import shutil
+import sqlite3
+from benchmarks.common import createDatabase, scratchDatabasePath, runConcurrently
+from database import ConnectionPool
+from helpers import generateID
+
+
+# Compares requests/sec of concurrent mixed read/write traffic
+# "connect" opens a new connection per request with the default rollback journal, like the handlers used to
+# "pool" checks out a long lived WAL connection from database.ConnectionPool
+# Run from the repo root with: python -m benchmarks.pool
+
+queryToGetAmount = "SELECT VALUE FROM AMOUNTTRACKER WHERE ID = ?"
+queryToGetExpenses = "SELECT ID, AMT_EXP_DESC, VALUE, DATE FROM AMOUNTTRACKER WHERE AMT_ID = ?"
+queryToAddAnExpense = "INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) Values (?, ?, ?, ?, ?, ?)"
+
+
+# One request, either a read of an amount's expenses or the insert of an expense
+def request(connection, amountID, isWrite):
+    cur = connection.cursor()
+    if isWrite:
+        cur.execute(queryToAddAnExpense, (generateID(), "Bench", 1.0, 'EXP', 1704067200, amountID))
+        connection.commit()
+    else:
+        cur.execute(queryToGetAmount, [amountID]).fetchone()
+        cur.execute(queryToGetExpenses, [amountID]).fetchall()
+
+
+def benchmark(mode, path, amountIDs, threads, duration, writeRatio):
+    connectionPool = ConnectionPool(path, threads)
+
+    def worker(threadIndex):
+        amountID = random.choice(amountIDs)
+        isWrite = random.random() < writeRatio
+        try:
+            if mode == "connect":
+                connection = sqlite3.connect(path)
+                request(connection, amountID, isWrite)
+                connection.close()
+            else:
+                connection = connectionPool.checkOut()
+                try:
+                    request(connection, amountID, isWrite)
+                finally:
+                    connectionPool.checkIn(connection)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    succeeded, failed = runConcurrently(worker, threads, duration)
+    connectionPool.closeAll()
+    return succeeded, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connect per request vs pooled WAL connections")
+    parser.add_argument("--amounts", type=int, default=1000)
+    parser.add_argument("--expenses", type=int, default=20, help="Expenses per amount")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    arguments = parser.parse_args()
+
+    templatePath = scratchDatabasePath()
+    amountIDs, _ = createDatabase(templatePath, arguments.amounts, arguments.expenses)
+
+    print("mode      req/s      failed")
+    for mode in ["connect", "pool"]:
+        path = scratchDatabasePath()
+        shutil.copy(templatePath, path)
+        succeeded, failed = benchmark(mode, path, amountIDs, arguments.threads,
+                                      arguments.duration, arguments.write_ratio)
+        print("%-8s %8.0f %10d" % (mode, succeeded / arguments.duration, failed))
+
+
+if __name__ == "__main__":
+    main()
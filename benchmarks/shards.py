@@ -0,0 +1,70 @@
+import argparse
+import random
+from benchmarks.common import createDatabase, scratchDatabasePath
+from benchmarks.writer import addExpense, measure, report
+from database import ConnectionPool, openConnection, writeTransaction
+from maintenance import reshard
+from migrations import runMigrations
+from shards import shardOf, shardPaths
+from writer import WritePipeline
+
+
+# Compares write throughput of the DB hash sharded over more and more files, each shard with its own write lock
+# Every shard count is run with direct commits and with a write pipeline per shard
+# Run from the repo root with: python -m benchmarks.shards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write throughput by no of shards")
+    parser.add_argument("--amounts", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="Shard counts to compare")
+    parser.add_argument("--batch-size", type=int, default=64, help="Largest batch of the write pipelines")
+    parser.add_argument("--linger-ms", type=float, default=1.0, help="Linger time of the write pipelines")
+    arguments = parser.parse_args()
+
+    print("mode                    writes/s    p50 ms     p99 ms")
+
+    for noOfShards in arguments.shards:
+        databasePath = scratchDatabasePath()
+        amountIDs, _ = createDatabase(databasePath, arguments.amounts, 0)
+        connection = openConnection(databasePath)
+        runMigrations(connection)
+        connection.execute("UPDATE AMOUNTTRACKER SET VALUE = 1e12 WHERE TYPE = 'AMT'")
+        connection.commit()
+        connection.close()
+        reshard(databasePath, noOfShards)
+        paths = shardPaths(databasePath, noOfShards)
+
+        connectionPools = [ConnectionPool(path, arguments.threads) for path in paths]
+
+        def directWrite(threadIndex):
+            amountID = random.choice(amountIDs)
+            connectionPool = connectionPools[shardOf(amountID, noOfShards)]
+            connection = connectionPool.checkOut()
+            try:
+                with writeTransaction(connection):
+                    addExpense(connection, amountID)
+            finally:
+                connectionPool.checkIn(connection)
+
+        report("direct, %d shards" % noOfShards, measure(directWrite, arguments.threads, arguments.duration), arguments.duration)
+        for connectionPool in connectionPools:
+            connectionPool.closeAll()
+
+        pipelines = [WritePipeline(path, arguments.batch_size, arguments.linger_ms / 1000) for path in paths]
+        for pipeline in pipelines:
+            pipeline.start()
+
+        def pipelineWrite(threadIndex):
+            amountID = random.choice(amountIDs)
+            pipelines[shardOf(amountID, noOfShards)].submit(lambda connection: addExpense(connection, amountID)).result()
+
+        report("pipeline, %d shards" % noOfShards, measure(pipelineWrite, arguments.threads, arguments.duration), arguments.duration)
+        for pipeline in pipelines:
+            pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
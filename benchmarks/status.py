@@ -0,0 +1,69 @@
+import argparse
+import time
+from fastapi import Response
+from benchmarks.common import createDatabase, scratchDatabasePath
+from database import openConnection
+from migrations import runMigrations
+import index
+
+
+# Compares the old per amount loop of /getAmountStatus with the single aggregate query it was replaced by
+# Run from the repo root with: python -m benchmarks.status
+
+
+# The loop /getAmountStatus used to run, three queries per amount and the expenses summed in Python
+def statusByLoop(cur):
+    amtCheck = cur.execute("SELECT ID FROM AMOUNTTRACKER WHERE TYPE = 'AMT'").fetchall()
+    formattedAmount = []
+    index = 0
+    while index < len(amtCheck):
+        amountValue = cur.execute("SELECT VALUE FROM AMOUNTTRACKER WHERE ID = ?", amtCheck[index]).fetchone()
+        expenseValue = cur.execute("SELECT VALUE FROM AMOUNTTRACKER WHERE AMT_ID = ?", amtCheck[index]).fetchall()
+        summedUpExpenses = sum(item[0] for item in expenseValue)
+        returnData = cur.execute("SELECT ID, AMT_EXP_DESC, VALUE FROM AMOUNTTRACKER WHERE ID = ?", amtCheck[index]).fetchone()
+        if amountValue[0] == summedUpExpenses:
+            formattedAmount.append({"amountID": returnData[0], "amountDescription": returnData[1], "amountValue": returnData[2], "amountStatus": "finished"})
+        else:
+            formattedAmount.append({"amountID": returnData[0], "amountDescription": returnData[1], "amountValue": returnData[2], "amountStatus": "remaining", "remainingAmount": amountValue[0] - summedUpExpenses})
+        index += 1
+    return formattedAmount
+
+
+# The endpoint as it is now, called directly with every query param left out
+def statusByQuery(connection):
+    return index.getAmountByStatus(Response(), amountStatus=None, limit=None, cursor=None, sort="asc",
+                                   dateFrom=None, dateTo=None, connection=connection)["amountDetails"]
+
+
+# Returns the best of a few runs, in seconds
+def bestOf(function, runs):
+    timings = []
+    for _ in range(runs):
+        startTime = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - startTime)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per amount loop vs single aggregate query for /getAmountStatus")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="No of amounts")
+    parser.add_argument("--expenses", type=int, default=5, help="Expenses per amount")
+    parser.add_argument("--runs", type=int, default=3)
+    arguments = parser.parse_args()
+
+    print("amounts       loop ms      query ms   speedup")
+    for size in arguments.sizes:
+        databasePath = scratchDatabasePath()
+        createDatabase(databasePath, size, arguments.expenses)
+        connection = openConnection(databasePath)
+        runMigrations(connection)
+
+        loopTime = bestOf(lambda: statusByLoop(connection.cursor()), arguments.runs)
+        queryTime = bestOf(lambda: statusByQuery(connection), arguments.runs)
+        connection.close()
+        print("%7d %13.1f %13.1f %8.1fx" % (size, loopTime * 1000, queryTime * 1000, loopTime / queryTime))
+
+
+if __name__ == "__main__":
+    main()
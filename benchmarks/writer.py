@@ -0,0 +1,97 @@
+import argparse
+import random
+import statistics
+import threading
+import time
+from benchmarks.common import createDatabase, scratchDatabasePath
+from database import ConnectionPool, openConnection, writeTransaction
+from helpers import generateID
+from migrations import runMigrations
+from writer import WritePipeline
+
+
+# Compares write latency and throughput of the direct path, every request committing on its own connection,
+# with the write pipeline, one writer thread committing the queued writes in batches
+# Run from the repo root with: python -m benchmarks.writer
+
+
+# The write /addAnExpense does, check the amount and its spent total then insert the expense, of 1.00, in cents
+def addExpense(connection, amountID):
+    cur = connection.cursor()
+    amountValue = cur.execute("SELECT VALUE FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'", [amountID]).fetchone()[0]
+    summedUpAmount = cur.execute("SELECT SPENT FROM AMOUNTTOTALS WHERE AMT_ID = ?", [amountID]).fetchone()[0]
+    if summedUpAmount + 100 <= amountValue:
+        cur.execute("INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) Values (?, ?, ?, ?, ?, ?)",
+                    (generateID(), "Bench", 100, 'EXP', 1704067200, amountID))
+
+
+# Sends writes from the given number of threads for the duration, in seconds
+# Returns the latency of every write, in seconds
+def measure(write, threads, duration):
+    deadline = time.perf_counter() + duration
+    latencies = [[] for _ in range(threads)]
+
+    def loop(threadIndex):
+        while time.perf_counter() < deadline:
+            startTime = time.perf_counter()
+            write(threadIndex)
+            latencies[threadIndex].append(time.perf_counter() - startTime)
+
+    runningThreads = [threading.Thread(target=loop, args=(index,)) for index in range(threads)]
+    for thread in runningThreads:
+        thread.start()
+    for thread in runningThreads:
+        thread.join()
+    return [latency for threadLatencies in latencies for latency in threadLatencies]
+
+
+def report(mode, latencies, duration):
+    percentiles = statistics.quantiles(latencies, n=100)
+    print("%-22s %10.0f %10.2f %10.2f" % (mode, len(latencies) / duration, percentiles[49] * 1000, percentiles[98] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Direct commits vs the write pipeline")
+    parser.add_argument("--amounts", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode")
+    parser.add_argument("--batch-size", type=int, default=64, help="Largest batch of the write pipeline")
+    parser.add_argument("--linger-ms", type=float, default=1.0, help="Linger time of the write pipeline")
+    arguments = parser.parse_args()
+
+    databasePath = scratchDatabasePath()
+    amountIDs, _ = createDatabase(databasePath, arguments.amounts, 0)
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    connection.execute("UPDATE AMOUNTTRACKER SET VALUE = 1e12 WHERE TYPE = 'AMT'")
+    connection.commit()
+    connection.close()
+
+    print("mode                    writes/s    p50 ms     p99 ms")
+
+    connectionPool = ConnectionPool(databasePath, arguments.threads)
+
+    def directWrite(threadIndex):
+        connection = connectionPool.checkOut()
+        try:
+            with writeTransaction(connection):
+                addExpense(connection, random.choice(amountIDs))
+        finally:
+            connectionPool.checkIn(connection)
+
+    report("direct", measure(directWrite, arguments.threads, arguments.duration), arguments.duration)
+    connectionPool.closeAll()
+
+    pipeline = WritePipeline(databasePath, arguments.batch_size, arguments.linger_ms / 1000)
+    pipeline.start()
+
+    def pipelineWrite(threadIndex):
+        amountID = random.choice(amountIDs)
+        pipeline.submit(lambda connection: addExpense(connection, amountID)).result()
+
+    report("pipeline", measure(pipelineWrite, arguments.threads, arguments.duration), arguments.duration)
+    pipeline.stop()
+
+
+if __name__ == "__main__":
+    main()
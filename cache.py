@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+import settings
+
+
+# In-process LRU cache of serialized responses
+# Keys hold the version of the data a response was built from, so a write makes the old entries unreachable instead of having to find and drop them
+# Entries are evicted least recently used first once the serialized bodies add up to more than maxBytes
+class ResponseCache:
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.notModified = 0
+
+    # Returns the cached body of the key, None if its not cached
+    def get(self, key):
+        with self.lock:
+            body = self.entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, body):
+        if len(body) > self.maxBytes:
+            return
+        with self.lock:
+            previousBody = self.entries.pop(key, None)
+            if previousBody is not None:
+                self.totalBytes -= len(previousBody)
+            self.entries[key] = body
+            self.totalBytes += len(body)
+            while self.totalBytes > self.maxBytes:
+                _, evictedBody = self.entries.popitem(last=False)
+                self.totalBytes -= len(evictedBody)
+                self.evictions += 1
+
+    # Drops every entry, for when the app is pointed to another DB whose versions would match the cached ones
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
+
+    # Counts a conditional GET answered with a 304
+    def countNotModified(self):
+        with self.lock:
+            self.notModified += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries), "bytes": self.totalBytes, "maxBytes": self.maxBytes,
+                    "hits": self.hits, "misses": self.misses, "hitRate": self.hits / lookups if lookups else None,
+                    "evictions": self.evictions, "notModified": self.notModified}
+
+
+responseCache = ResponseCache(settings.RESPONSE_CACHE_BYTES)
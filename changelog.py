@@ -0,0 +1,79 @@
+import logging
+import threading
+import time
+import settings
+from database import openConnection, writeTransaction
+
+
+logger = logging.getLogger(__name__)
+
+
+# Removes the entries of AMOUNTCHANGES older than the retention window and moves CHANGES_COMPACTED_SEQ up to the last of them
+# Entries are read in SEQ order, which is the order they were logged in, so the expired ones are at the start and are found without an index on CHANGED_AT
+# They are removed DELETE_CHUNK_SIZE at a time, each chunk its own short write, so writers are never held up for long
+# Returns the no of entries removed
+def compactChanges(connection, retentionSeconds):
+    cur = connection.cursor()
+    cutoff = int(time.time()) - retentionSeconds
+    noOfCompactedChanges = 0
+    while True:
+        with writeTransaction(connection):
+            expiredSeqs = []
+            for SEQ, CHANGED_AT in cur.execute("SELECT SEQ, CHANGED_AT FROM AMOUNTCHANGES ORDER BY SEQ LIMIT ?", [settings.DELETE_CHUNK_SIZE]).fetchall():
+                if CHANGED_AT >= cutoff:
+                    break
+                expiredSeqs.append(SEQ)
+            if len(expiredSeqs) > 0:
+                cur.execute("DELETE FROM AMOUNTCHANGES WHERE SEQ <= ?", [expiredSeqs[-1]])
+                cur.execute("UPDATE DATAVERSION SET CHANGES_COMPACTED_SEQ = MAX(CHANGES_COMPACTED_SEQ, ?) WHERE ID = 0", [expiredSeqs[-1]])
+        noOfCompactedChanges += len(expiredSeqs)
+        if len(expiredSeqs) < settings.DELETE_CHUNK_SIZE:
+            return noOfCompactedChanges
+
+
+# Compacts the change log of the DB every interval, on its own connection
+class ChangeLogCompaction:
+
+    def __init__(self, path, intervalSeconds, retentionSeconds):
+        self.path = path
+        self.intervalSeconds = intervalSeconds
+        self.retentionSeconds = retentionSeconds
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ChangeLogCompaction", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        connection = openConnection(self.path)
+        while not self.stopping.wait(self.intervalSeconds):
+            try:
+                noOfCompactedChanges = compactChanges(connection, self.retentionSeconds)
+                if noOfCompactedChanges > 0:
+                    logger.info("Compacted %d changes", noOfCompactedChanges)
+            except Exception:
+                logger.exception("Change log compaction failed")
+        connection.close()
+
+
+# Change log compaction of each shard of the DB
+compactions = []
+
+
+# Starts the change log compaction of each shard, if its turned on
+def startCompaction(paths):
+    if settings.CHANGES_COMPACT_INTERVAL_S > 0:
+        for path in paths:
+            compaction = ChangeLogCompaction(path, settings.CHANGES_COMPACT_INTERVAL_S, settings.CHANGES_RETENTION_S)
+            compaction.start()
+            compactions.append(compaction)
+
+
+# Stops the change log compactions, if they are running
+def stopCompaction():
+    while compactions:
+        compactions.pop().stop()
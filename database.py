@@ -0,0 +1,114 @@
+import queue
+import sqlite3
+import threading
+import settings
+from contextlib import contextmanager
+
+
+# Opens a connection to the DB and tunes it
+# WAL lets readers carry on while a write is being committed
+# busy_timeout makes a writer wait for the lock instead of failing straight away with "database is locked"
+# synchronous=NORMAL is safe with WAL, commits are only synced to disk at checkpoints
+# check_same_thread is off as a pooled connection is handed to whichever thread checks it out
+# factory is the connection class, e.g. one which times the queries
+def openConnection(path, factory=sqlite3.Connection):
+    connection = sqlite3.connect(path, timeout=settings.BUSY_TIMEOUT_MS / 1000, factory=factory,
+                                 cached_statements=settings.STATEMENT_CACHE_SIZE, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA busy_timeout = " + str(settings.BUSY_TIMEOUT_MS))
+    connection.execute("PRAGMA synchronous = NORMAL")
+    return connection
+
+
+# Pool of long lived connections to one DB file
+# A connection is checked out by one request at a time and returned when the request is done
+# Connections are opened lazily, up to maxSize, after which a request waits for one to be returned
+class ConnectionPool:
+
+    def __init__(self, path, maxSize):
+        self.path = path
+        self.maxSize = maxSize
+        self.idleConnections = queue.LifoQueue()
+        self.openConnections = []
+        self.lock = threading.Lock()
+        # Functions called with every newly opened connection, e.g. to install a trace callback
+        self.connectionHooks = []
+        # Class of the connections opened by the pool
+        self.connectionFactory = sqlite3.Connection
+
+    # Hands out an idle connection, opens a new one if none is idle and the pool is not full
+    def checkOut(self):
+        try:
+            return self.idleConnections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            if len(self.openConnections) < self.maxSize:
+                connection = self.openUnpooledConnection()
+                self.openConnections.append(connection)
+                return connection
+
+        return self.idleConnections.get()
+
+    # Opens a connection to the pool's DB like the pooled ones, with its connection class and hooks, for a caller which keeps it to itself and closes it
+    def openUnpooledConnection(self):
+        connection = openConnection(self.path, self.connectionFactory)
+        for hook in self.connectionHooks:
+            hook(connection)
+        return connection
+
+    # Returns a connection to the pool, rolling back anything a failed request left uncommitted
+    def checkIn(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+        self.idleConnections.put(connection)
+
+    # Closes every connection, used when the app shuts down
+    def closeAll(self):
+        with self.lock:
+            for connection in self.openConnections:
+                connection.close()
+            self.openConnections = []
+            self.idleConnections = queue.LifoQueue()
+
+    # Points the pool to another DB file, closing the connections to the current one
+    def configure(self, path):
+        self.closeAll()
+        self.path = path
+
+
+pool = ConnectionPool(settings.DATABASE_PATH, settings.POOL_SIZE)
+
+
+# FastAPI dependency which gives each request a pooled connection for its lifetime
+def getConnection():
+    connection = pool.checkOut()
+    try:
+        yield connection
+    finally:
+        pool.checkIn(connection)
+
+
+# Runs the block in a write transaction which is committed when the block finishes and rolled back if it raises
+# BEGIN IMMEDIATE takes the DB write lock up front, so what the block reads cannot be changed by another connection, or another worker process, before the block writes
+@contextmanager
+def writeTransaction(connection):
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
+# Runs the block in a read transaction, so every query in it sees the same snapshot of the DB
+# Used where a response is tagged with a version, so the version and the data it tags are read together
+@contextmanager
+def readTransaction(connection):
+    connection.execute("BEGIN")
+    try:
+        yield
+    finally:
+        connection.rollback()
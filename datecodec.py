@@ -0,0 +1,99 @@
+import functools
+import settings
+
+
+# Converts dates between the DD-MMM-YYYY format of the API, e.g. 23-May-2053, and the epochs stored in the DB
+# A date is stored as the epoch of its midnight at the fixed UTC offset in settings, not the server's local time, so a DB reads the same on every server
+# Parsing and formatting are plain arithmetic on the proleptic Gregorian calendar, without datetime or the locale
+
+
+monthNames = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+# Month no of every month name, lowercased as the month is matched case insensitively, like %b in strptime
+monthNumbers = {monthName.lower(): monthNumber for monthNumber, monthName in enumerate(monthNames, start=1)}
+
+daysInMonth = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+asciiDigits = frozenset("0123456789")
+
+
+# Converts a UTC offset, e.g. +05:30, to seconds
+def parseUTCOffset(utcOffset):
+    if len(utcOffset) != 6 or utcOffset[0] not in "+-" or utcOffset[3] != ":" or not set(utcOffset[1:3] + utcOffset[4:]) <= asciiDigits:
+        raise ValueError(utcOffset + " is not a UTC offset in +HH:MM or -HH:MM format")
+    offsetSeconds = int(utcOffset[1:3]) * 3600 + int(utcOffset[4:]) * 60
+    return -offsetSeconds if utcOffset[0] == "-" else offsetSeconds
+
+
+utcOffsetSeconds = parseUTCOffset(settings.UTC_OFFSET)
+
+
+def isLeapYear(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+# No of days from 01-Jan-1970 to the date
+# Counts in 400 year eras starting on 1st March, so the leap day is the last day of a year
+def daysFromCivil(year, month, day):
+    year -= month <= 2
+    era = year // 400
+    yearOfEra = year - era * 400
+    dayOfYear = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    dayOfEra = yearOfEra * 365 + yearOfEra // 4 - yearOfEra // 100 + dayOfYear
+    return era * 146097 + dayOfEra - 719468
+
+
+# The date, as (year, month, day), which is the given no of days from 01-Jan-1970
+def civilFromDays(days):
+    days += 719468
+    era = days // 146097
+    dayOfEra = days - era * 146097
+    yearOfEra = (dayOfEra - dayOfEra // 1460 + dayOfEra // 36524 - dayOfEra // 146096) // 365
+    dayOfYear = dayOfEra - (365 * yearOfEra + yearOfEra // 4 - yearOfEra // 100)
+    shiftedMonth = (5 * dayOfYear + 2) // 153
+    day = dayOfYear - (153 * shiftedMonth + 2) // 5 + 1
+    month = shiftedMonth + (3 if shiftedMonth < 10 else -9)
+    return yearOfEra + era * 400 + (month <= 2), month, day
+
+
+# Parses and validates a date in DD-MMM-YYYY format in one pass
+# The day can be 1 or 2 digits and the year must be 4 digits, as with strptime's %d and %Y
+# Returns the epoch of the date, or None if its not a valid date in the format
+def parseDate(inputDate):
+    if not isinstance(inputDate, str):
+        return None
+    dateParts = inputDate.split("-")
+    if len(dateParts) != 3:
+        return None
+    dayText, monthText, yearText = dateParts
+    if not 1 <= len(dayText) <= 2 or len(yearText) != 4 or not set(dayText + yearText) <= asciiDigits:
+        return None
+    month = monthNumbers.get(monthText.lower())
+    if month is None:
+        return None
+
+    day = int(dayText)
+    year = int(yearText)
+    lastDayOfMonth = 29 if month == 2 and isLeapYear(year) else daysInMonth[month - 1]
+    if year == 0 or day == 0 or day > lastDayOfMonth:
+        return None
+    return daysFromCivil(year, month, day) * 86400 - utcOffsetSeconds
+
+
+# Formats an epoch as DD-MMM-YYYY, the date its on at the UTC offset in settings
+# The dates of the rows returned by the list endpoints repeat a lot, so the formatted dates are memoized
+@functools.lru_cache(maxsize=settings.DATE_CACHE_SIZE)
+def formatEpoch(epoch):
+    year, month, day = civilFromDays((epoch + utcOffsetSeconds) // 86400)
+    return "%02d-%s-%04d" % (day, monthNames[month - 1], year)
+
+
+# Formats a column of epochs, each distinct epoch is formatted once
+def formatEpochs(epochs):
+    formattedDates = {epoch: formatEpoch(epoch) for epoch in set(epochs)}
+    return [formattedDates[epoch] for epoch in epochs]
+
+
+# Formats a date in YYYY-MM-DD format, as SQLite's date functions return it, as DD-MMM-YYYY
+def formatISODate(isoDate):
+    return isoDate[8:10] + "-" + monthNames[int(isoDate[5:7]) - 1] + "-" + isoDate[:4]
@@ -1,8 +1,10 @@
-import datetime
+import base64
 import html
+import json
+import math
 import re
-import time
 import shortuuid
+from datecodec import parseDate, formatEpoch
 
 
 
@@ -19,25 +21,66 @@ def sanitizeString(inputString):
     return santizedString
 
 
+# Turns the text searched for into an FTS5 query of its words, sanitized like the descriptions they are matched against
+# Every word is quoted, so no FTS5 syntax can be sent, and with prefix, every word matches the words starting with it
+# The words are ANDed, so every word must match. Returns None if there are no words
+def buildSearchQuery(searchText, prefix):
+    searchWords = re.findall(r"\w+", sanitizeString(searchText))
+    if len(searchWords) == 0:
+        return None
+    return " ".join('"' + searchWord + '"' + ("*" if prefix else "") for searchWord in searchWords)
+
+
 # Checks if the date format is in DD-MMM-YYYY format, e.g. 23-May-2053
 # Returns TRUE if its in the format or FALSE if its not
 def checkDateFormat(inputDate):
-    try:
-        datetime.datetime.strptime(inputDate, "%d-%b-%Y")
-        return True
-    except:
-        return False
-    
+    return parseDate(inputDate) is not None
+
 
 # Converts date in DD-MMM-YYYY format, e.g. 23-May-2053 to Epoch
 def convertDateToEpoch(inputDate):
-    dateObject = datetime.datetime.strptime(inputDate, "%d-%b-%Y")
-    epochTimestamp = int(dateObject.timestamp())
+    epochTimestamp = parseDate(inputDate)
+    if epochTimestamp is None:
+        raise ValueError(str(inputDate) + " is not a date in DD-MMM-YYYY format")
     return epochTimestamp
 
 
 # Converts date in Epoch format to DD-MMM-YYYY format, e.g. 23-May-2053
 def convertEpochToDate(inputDate):
-    dateObject = datetime.datetime.fromtimestamp(inputDate)
-    formattedDate = dateObject.strftime('%d-%b-%Y')
-    return formattedDate
\ No newline at end of file
+    return formatEpoch(inputDate)
+
+
+# Smallest and largest value of an amount or expense, one cent and 10^13, so the cents, and the sums of them, fit in SQLite's 64 bit integers
+smallestValue = 0.01
+largestValue = 10 ** 13
+
+
+# Converts a value, e.g. 12.5, to the integer cents it is stored as, 1250
+# Rounds half away from zero, like SQLite's ROUND did when the stored values were converted
+def convertValueToCents(inputValue):
+    return int(math.copysign(math.floor(abs(inputValue) * 100 + 0.5), inputValue))
+
+
+# Converts integer cents, e.g. 1250, back to the value the API returns, 12.5
+def convertCentsToValue(cents):
+    return cents / 100
+
+
+# Encodes the sort key of the last row of a page, e.g. its (DATE, ID), into an opaque cursor for the next page
+def encodeCursor(*sortKey):
+    return base64.urlsafe_b64encode(json.dumps(sortKey).encode()).decode().rstrip("=")
+
+
+# Decodes a cursor made by encodeCursor back to the sort key, whose values must be of the given types, by default (DATE, ID)
+# Returns FALSE if its not a valid cursor
+def decodeCursor(cursor, sortKeyTypes=(int, str)):
+    try:
+        sortKey = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except:
+        return False
+    if not isinstance(sortKey, list) or len(sortKey) != len(sortKeyTypes):
+        return False
+    for value, sortKeyType in zip(sortKey, sortKeyTypes):
+        if type(value) is not sortKeyType:
+            return False
+    return tuple(sortKey)
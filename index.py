@@ -1,13 +1,66 @@
+import csv
+import io
+import json
 import sqlite3
-from fastapi import FastAPI, Response, status, Request
-from fastapi.responses import FileResponse
+import time
+import zlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response, status, Request, Depends, Query
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from pydantic import BaseModel, Field
 from helpers import *
+from datecodec import parseDate, formatEpoch, formatEpochs, formatISODate, monthNames
+import settings
+from database import pool, getConnection
+from cache import responseCache
+from metrics import metrics, MetricsMiddleware, TimedConnection
+from writer import startPipeline, stopPipeline
+from vacuum import startVacuum, stopVacuum
+from changelog import startCompaction, stopCompaction
+import shards
+from shards import configureShards, closeShards, mergeShardRows
+import repository
+from repository import startRepository, stopRepository
+from migrations import runMigrations
 from fastapi.templating import Jinja2Templates
 
 
-app = FastAPI()
+# Sets up the shards and upgrades the schema of each of them, then starts the write pipeline, the incremental vacuum and the change log compaction,
+# if they are turned on, and the repository, when the app starts
+# Stops them, the repository first so a memory repository writes back what is left, and closes the pooled DB connections when it shuts down
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    configureShards(settings.SHARDS)
+    shardPaths = []
+    for shardPool in shards.shardPools:
+        connection = shardPool.checkOut()
+        try:
+            runMigrations(connection)
+        finally:
+            shardPool.checkIn(connection)
+        shardPaths.append(shardPool.path)
+    startPipeline(shardPaths)
+    startVacuum(shardPaths)
+    startCompaction(shardPaths)
+    startRepository(shardPaths)
+    yield
+    stopRepository()
+    stopCompaction()
+    stopVacuum()
+    stopPipeline()
+    closeShards()
+
+
+app = FastAPI(lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
+# Request metrics and query timing are only installed when turned on, so they cost nothing when off
+if settings.METRICS:
+    app.add_middleware(MetricsMiddleware)
+if settings.METRICS or settings.SLOW_QUERY_MS > 0:
+    pool.connectionFactory = TimedConnection
+
+# Templates are compiled once and reused, without checking the template files for changes on every render
+templates.env.auto_reload = False
 
 
 @app.get("/")
@@ -15,24 +68,30 @@ def landingPage():
     return FileResponse("AmountTracker.html")
 
 
+# Sets the status code of the response from the result of a repository write and returns the rest of the result as the body
+def writeResponse(response, result):
+    response.status_code = result.pop("statusCode")
+    return result
+
+
 # POST Body to add an amount
-# The amount is validated to be greater than 0
+# The amount is validated to be at least a cent
 class addAnAmount(BaseModel):
     amountDescription: str
-    amount: float = Field(gt=0, description="Amount must be greater than 0")
+    amount: float = Field(ge=smallestValue, le=largestValue, description="Amount must be at least 0.01")
     date: str
 
 # Add an amount endpoint
 
 
 @app.post("/addAnAmount")
-def addAnAmount(addAnAmountBody: addAnAmount, response: Response):
+def addAnAmount(addAnAmountBody: addAnAmount, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
 
     # Sanitzes the description
-    # Checks if the date format is correct
+    # Parses the date to its epoch, which is None if the date format is incorrect
     sanitizedDescription = sanitizeString(
         addAnAmountBody.amountDescription).strip()
-    sanitizedDate = checkDateFormat(addAnAmountBody.date)
+    sanitizedDate = parseDate(addAnAmountBody.date)
 
     # Checks the amount description, if its empty returns a 400
     if len(sanitizedDescription) == 0:
@@ -40,42 +99,34 @@ def addAnAmount(addAnAmountBody: addAnAmount, response: Response):
         return {"status": "Amount description cannot be empty."}
 
     # Checks the date format, if its incorrect returns a 400
-    if sanitizedDate == False:
+    if sanitizedDate is None:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"status": addAnAmountBody.date + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Inserts the amount into the DB and returns the generated ID in the response
-    queryToAddAnAmount = "INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE) Values (?, ?, ?, ?, ?)"
+    # Adds the amount, in cents, and returns the generated ID in the response
     generatedIDForAmount = generateID()
-    valuesToAddAnAmount = (generatedIDForAmount, sanitizedDescription,
-                           addAnAmountBody.amount, 'AMT', convertDateToEpoch(addAnAmountBody.date))
-    cur.execute(queryToAddAnAmount, valuesToAddAnAmount)
-    connection.commit()
+    repository.backend.addAmounts(connection, [(generatedIDForAmount, sanitizedDescription, convertValueToCents(addAnAmountBody.amount), sanitizedDate)])
     return {"amountID": generatedIDForAmount, "status": "Amount of " + str(addAnAmountBody.amount) + " added."}
 
 
 # POST Body to add an expense
-# The expense is validated to be greater than 0
+# The expense is validated to be at least a cent
 class addAnExpense(BaseModel):
     amountID: str
     expenseDescription: str
-    expense: float = Field(gt=0, description="Expense must be greater than 0")
+    expense: float = Field(ge=smallestValue, le=largestValue, description="Expense must be at least 0.01")
     date: str
 
 
 # Add an expense endpoint
 @app.post("/addAnExpense")
-def addAnExpense(addAnExpenseBody: addAnExpense, response: Response):
+def addAnExpense(addAnExpenseBody: addAnExpense, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
 
     # Sanitzes the description
-    # Checks if the date format is correct
+    # Parses the date to its epoch, which is None if the date format is incorrect
     sanitizedDescription = sanitizeString(
         addAnExpenseBody.expenseDescription).strip()
-    sanitizedDate = checkDateFormat(addAnExpenseBody.date)
+    sanitizedDate = parseDate(addAnExpenseBody.date)
 
     # Checks the expense description, if its empty returns a 400
     if len(sanitizedDescription) == 0:
@@ -83,70 +134,33 @@ def addAnExpense(addAnExpenseBody: addAnExpense, response: Response):
         return {"status": "Expense description cannot be empty."}
 
     # Checks the date format, if its incorrect returns a 400
-    if sanitizedDate == False:
+    if sanitizedDate is None:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"status": addAnExpenseBody.date + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Checks if the supplied amount ID exists in the DB.
-    # We try to fetch the ID, DATE and VALUE from the DB for that ID
-    # If there is no amount ID by that ID, it will return NONE, we return with 404
-    queryToCheckAmountID = "SELECT ID, DATE, VALUE FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'"
-    valuesToCheckAmountID = [addAnExpenseBody.amountID]
-    amountIDCheck = cur.execute(
-        queryToCheckAmountID, valuesToCheckAmountID).fetchone()
-    if amountIDCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount with the ID " + addAnExpenseBody.amountID + " exists. Please recheck"}
-
-    # Checking if the date of expense is less that the date of amount
-    # We can only spend on or after the amount date
-    if amountIDCheck[1] > convertDateToEpoch(addAnExpenseBody.date):
-        response.status_code = status.HTTP_403_FORBIDDEN
-        return {"status": "Expense date of " + addAnExpenseBody.date + " cannot be earlier than amount date of " + convertEpochToDate(amountIDCheck[1])}
-
-    # Checks the current amount usage
-    # We get all the values by the amount ID and add it into summedUpAmount
-    # If the supplied expense + summedUpAmount is greater than the amount value, reject with 403
-    # As we cannot spend more than the amount value
-    queryToCheckAmountUsage = "SELECT VALUE FROM AMOUNTTRACKER WHERE AMT_ID = ?"
-    valuesToCheckAmountUsage = [addAnExpenseBody.amountID]
-    currentAmountCheck = cur.execute(
-        queryToCheckAmountUsage, valuesToCheckAmountUsage).fetchall()
-    extractedNumbers = [number[0] for number in currentAmountCheck]
-    summedUpAmount = sum(extractedNumbers)
-    if summedUpAmount + addAnExpenseBody.expense > amountIDCheck[2]:
-        response.status_code = status.HTTP_403_FORBIDDEN
-        return {"status": "Can only add expense of " + str(amountIDCheck[2] - summedUpAmount)}
-
-    # Adds the Expense to the Amount
-    queryToAddAnExpense = "INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) Values (?, ?, ?, ?, ?, ?)"
-    generatedIDForExpense = generateID()
-    valuesToAddAnExpense = (generatedIDForExpense, sanitizedDescription, addAnExpenseBody.expense,
-                            'EXP', convertDateToEpoch(addAnExpenseBody.date), addAnExpenseBody.amountID)
-    cur.execute(queryToAddAnExpense, valuesToAddAnExpense)
-    connection.commit()
-    return {"expenseID": generatedIDForExpense, "status": "Expense of " + str(addAnExpenseBody.expense) + " added.", "amountID": addAnExpenseBody.amountID}
+    # The expense is checked against its amount and added, in cents, like one item of /addExpensesBatch
+    # Its 404 or 403 if there is no amount by the ID, or the expense is dated before the amount or is more than is left of it
+    results = [None]
+    expensesByAmount = {addAnExpenseBody.amountID: [(0, sanitizedDescription, convertValueToCents(addAnExpenseBody.expense), sanitizedDate, addAnExpenseBody.date)]}
+    repository.backend.addExpenses(connection, expensesByAmount, results)
+    return writeResponse(response, results[0])
 
 
 # PUT Body to update an amount
-# The amount is validated to be greater than 0
+# The amount is validated to be at least a cent
 
 
 class updateAnAmount(BaseModel):
     amountID: str
     amountDescription: str
-    amount: float = Field(gt=0, description="Amount must be greater than 0")
+    amount: float = Field(ge=smallestValue, le=largestValue, description="Amount must be at least 0.01")
     date: str
 
 # Update an amount endpoint
 
 
 @app.put("/updateAnAmount")
-def updateAnAmount(updateAnAmountBody: updateAnAmount, response: Response):
+def updateAnAmount(updateAnAmountBody: updateAnAmount, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
 
     # Sanitzes the description
     sanitizedDescription = sanitizeString(
@@ -157,77 +171,31 @@ def updateAnAmount(updateAnAmountBody: updateAnAmount, response: Response):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"status": "Amount description cannot be empty."}
 
-    # Checks the date format, if its incorrect returns a 400
-    if checkDateFormat(updateAnAmountBody.date) == False:
+    # Parses the date to its epoch, if the date format is incorrect returns a 400
+    sanitizedDate = parseDate(updateAnAmountBody.date)
+    if sanitizedDate is None:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"status": updateAnAmountBody.date + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Checks if the supplied amount ID exists in the DB.
-    # If there is no amount ID by that ID, it will return NONE, we return with 404
-    queryToCheckAmountID = "SELECT ID FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'"
-    valuesToCheckAmountID = [updateAnAmountBody.amountID]
-    amountIDCheck = cur.execute(
-        queryToCheckAmountID, valuesToCheckAmountID).fetchone()
-    if amountIDCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount with the ID " + updateAnAmountBody.amountID + " exists. Please recheck"}
-
-    # Checks the current amount usage and if its less than the value to be updated
-    # We get all the values by the amount ID and add it into summedUpAmount
-    # If the summedUpAmount is greater than the updated amount value, reject with 403
-    # As we cannot update the amount to less that what is already spent
-    queryToCheckAmountUsage = "SELECT VALUE FROM AMOUNTTRACKER WHERE AMT_ID = ?"
-    valuesToCheckAmountUsage = [updateAnAmountBody.amountID]
-    currentAmountCheck = cur.execute(
-        queryToCheckAmountUsage, valuesToCheckAmountUsage).fetchall()
-    extractedNumbers = [number[0] for number in currentAmountCheck]
-    summedUpAmount = sum(extractedNumbers)
-    if summedUpAmount > updateAnAmountBody.amount:
-        response.status_code = status.HTTP_403_FORBIDDEN
-        return {"status": "Total expense for this amount is " + str(summedUpAmount) + ". Cannot update the amount to anything below."}
-
-    # Check expenses date
-    queryToCheckExpensesDate = "SELECT DATE FROM AMOUNTTRACKER WHERE AMT_ID = ?"
-    checkExpenseDate = cur.execute(
-        queryToCheckExpensesDate, valuesToCheckAmountUsage).fetchall()
-
-    # Check if the supplied date, in Epoch, is less than all the expense dates
-    # As, the amount date must be less than or equal to the expense dates
-    # If the supplied date is less than or equal to all expense dates, return True, else False
-    newDateChecker = all(convertDateToEpoch(
-        updateAnAmountBody.date) <= item[0] for item in checkExpenseDate)
-
-    # If its False it means that there is one expense date that is less than the supplied amount date, reject with 403
-    if newDateChecker is False:
-        response.status_code = status.HTTP_403_FORBIDDEN
-        return {"status": "Date cannot be updated as there is an expense which is older than the provided date."}
-
-    # Updates the amount description value, date into the DB for the supplied amount ID
-    queryToUpdateAnAmount = "UPDATE AMOUNTTRACKER SET AMT_EXP_DESC = ?, VALUE = ?, DATE = ? WHERE ID = ?"
-    valuesToUpdateAnAmount = (sanitizedDescription, updateAnAmountBody.amount, convertDateToEpoch(
-        updateAnAmountBody.date), updateAnAmountBody.amountID)
-    cur.execute(queryToUpdateAnAmount, valuesToUpdateAnAmount)
-    connection.commit()
-    return {"amountID": updateAnAmountBody.amountID, "status": "Amount updated."}
+    # Updates the amount, in cents
+    # Its 404 if there is no amount by the ID, 403 if more than the new amount is spent or an expense is dated before the new date
+    return writeResponse(response, repository.backend.updateAmount(connection, updateAnAmountBody.amountID, sanitizedDescription,
+                                                                   convertValueToCents(updateAnAmountBody.amount), sanitizedDate))
 
 
 # PUT Body to update an expense
-# The expense is validated to be greater than 0
+# The expense is validated to be at least a cent
 class updateAnExpense(BaseModel):
     expenseID: str
     expenseDescription: str
-    expense: float = Field(gt=0, description="Expense must be greater than 0")
+    expense: float = Field(ge=smallestValue, le=largestValue, description="Expense must be at least 0.01")
     date: str
 
 # Update an expense endpoint
 
 
 @app.put("/updateAnExpense")
-def updateAnExpense(updateAnExpenseBody: updateAnExpense, response: Response):
+def updateAnExpense(updateAnExpenseBody: updateAnExpense, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
 
     # Sanitzes the description
     sanitizedDescription = sanitizeString(
@@ -238,291 +206,717 @@ def updateAnExpense(updateAnExpenseBody: updateAnExpense, response: Response):
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"status": "Expense description cannot be empty."}
 
-    # Checks the date format, if its incorrect returns a 400
-    if checkDateFormat(updateAnExpenseBody.date) == False:
+    # Parses the date to its epoch, if the date format is incorrect returns a 400
+    sanitizedDate = parseDate(updateAnExpenseBody.date)
+    if sanitizedDate is None:
         response.status_code = status.HTTP_400_BAD_REQUEST
         return {"status": updateAnExpenseBody.date + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Checks if the supplied expense ID exists in the DB.
-    # If there is no expense ID by that ID, it will return NONE, we return with 404
-    queryToCheckExpenseID = "SELECT ID, AMT_ID FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'EXP'"
-    valuesToCheckExpenseID = [updateAnExpenseBody.expenseID]
-    amountIDCheck = cur.execute(
-        queryToCheckExpenseID, valuesToCheckExpenseID).fetchone()
-    if amountIDCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Expense with the ID " + updateAnExpenseBody.expenseID + " exists. Please recheck"}
-
-    # Checks the current amount usage and if its less than the value to be updated
-    # We get all the values by the amount ID excluding the value of the expense to be updated and add it into summedUpAmount
-    # Then we get the amount and put it into currentAmountCheck
-    # If the summedUpAmount + supplied expense is greater than the amount value, reject with 403
-    # As we cannot update the expense to more than the expense
-    queryToCheckAmountUsage = "SELECT VALUE FROM AMOUNTTRACKER WHERE AMT_ID = ? AND ID IS NOT ?"
-    valuesToCheckAmountUsage = [
-        amountIDCheck[1], updateAnExpenseBody.expenseID]
-    currentAmountUsageCheck = cur.execute(
-        queryToCheckAmountUsage, valuesToCheckAmountUsage).fetchall()
-    extractedNumbers = [number[0] for number in currentAmountUsageCheck]
-    summedUpAmount = sum(extractedNumbers)
-
-    queryToCheckCurrentAmount = "SELECT VALUE FROM AMOUNTTRACKER WHERE ID = ?"
-    valuesToCheckCurrentAmount = [amountIDCheck[1]]
-    currentAmountCheck = cur.execute(
-        queryToCheckCurrentAmount, valuesToCheckCurrentAmount).fetchone()
-
-    if summedUpAmount + updateAnExpenseBody.expense > currentAmountCheck[0]:
-        response.status_code = status.HTTP_403_FORBIDDEN
-        return {"status": "Can only update expense to " + str(currentAmountCheck[0] - summedUpAmount)}
+    # Updates the expense, in cents
+    # Its 404 if there is no expense by the ID, 403 if the amount would be overspent or the new date is before the amount date
+    return writeResponse(response, repository.backend.updateExpense(connection, updateAnExpenseBody.expenseID, sanitizedDescription,
+                                                                    convertValueToCents(updateAnExpenseBody.expense), sanitizedDate))
 
-    # Get the Amount date of that expense
-    queryToGetAmountDate = "SELECT DATE FROM AMOUNTTRACKER WHERE ID = ?"
-    checkExpenseDate = cur.execute(
-        queryToGetAmountDate, [amountIDCheck[1]]).fetchone()
 
-    # If the provided date is less than the amount's expense date, we reject it
-    # Because, the expense date cannot be older than the amount date
-    if convertDateToEpoch(updateAnExpenseBody.date) < checkExpenseDate[0]:
-        response.status_code = status.HTTP_403_FORBIDDEN
-        return {"status": "Date cannot be updated as provided date is older than amount date."}
+# An amount in the POST Body of /addAmountsBatch, like the POST Body of /addAnAmount
+# The amount is validated with the rest of the item, so one invalid item does not reject the whole batch
+class amountOfBatch(BaseModel):
+    amountDescription: str
+    amount: float
+    date: str
 
-    # Updates the expense description, value, date into the DB for the supplied expense ID
-    queryToUpdateAnExpense = "UPDATE AMOUNTTRACKER SET AMT_EXP_DESC = ?, VALUE = ?, DATE =? WHERE ID = ?"
-    valuesToUpdateAnExpense = (sanitizedDescription, updateAnExpenseBody.expense, convertDateToEpoch(
-        updateAnExpenseBody.date), updateAnExpenseBody.expenseID)
-    cur.execute(queryToUpdateAnExpense, valuesToUpdateAnExpense)
-    connection.commit()
-    return {"amountID": updateAnExpenseBody.expenseID, "status": "Expense updated."}
 
+# POST Body to add amounts in a batch
+class addAmountsBatch(BaseModel):
+    amounts: list[amountOfBatch] = Field(min_length=1, max_length=settings.MAX_BATCH_SIZE)
+
+
+# Add amounts in a batch endpoint
+# Every amount is validated like in /addAnAmount and all the valid ones are added in one transaction
+# Returns the result of each amount, in the order they were sent
+@app.post("/addAmountsBatch")
+def addAmountsBatch(addAmountsBatchBody: addAmountsBatch, connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Validates each amount, the rejected ones get a 400 in their result
+    results = []
+    valuesToAddAmounts = []
+    for amountItem in addAmountsBatchBody.amounts:
+        sanitizedDescription = sanitizeString(amountItem.amountDescription).strip()
+        sanitizedDate = parseDate(amountItem.date)
+        if len(sanitizedDescription) == 0:
+            results.append({"statusCode": status.HTTP_400_BAD_REQUEST, "status": "Amount description cannot be empty."})
+        elif not smallestValue <= amountItem.amount <= largestValue:
+            results.append({"statusCode": status.HTTP_400_BAD_REQUEST, "status": "Amount must be from 0.01 to " + str(largestValue)})
+        elif sanitizedDate is None:
+            results.append({"statusCode": status.HTTP_400_BAD_REQUEST, "status": amountItem.date +
+                           " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."})
+        else:
+            generatedIDForAmount = generateID()
+            valuesToAddAmounts.append((generatedIDForAmount, sanitizedDescription, convertValueToCents(amountItem.amount), sanitizedDate))
+            results.append({"statusCode": status.HTTP_200_OK, "amountID": generatedIDForAmount,
+                           "status": "Amount of " + str(amountItem.amount) + " added."})
+
+    # Adds all the valid amounts, the amounts of each shard in one write
+    repository.backend.addAmounts(connection, valuesToAddAmounts)
+
+    return {"added": len(valuesToAddAmounts), "rejected": len(results) - len(valuesToAddAmounts), "results": results}
+
+
+# An expense in the POST Body of /addExpensesBatch, like the POST Body of /addAnExpense
+# The expense is validated with the rest of the item, so one invalid item does not reject the whole batch
+class expenseOfBatch(BaseModel):
+    amountID: str
+    expenseDescription: str
+    expense: float
+    date: str
 
-# Gets all the available Amount details
-# Requires amountID to be sent as a Query param
-@app.get("/getAllAmounts")
-def getAllAmountDetails(response: Response):
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
+# POST Body to add expenses in a batch, the expenses can be of different amounts
+class addExpensesBatch(BaseModel):
+    expenses: list[expenseOfBatch] = Field(min_length=1, max_length=settings.MAX_BATCH_SIZE)
+
+
+# Add expenses in a batch endpoint
+# Every expense is validated like in /addAnExpense, all the valid ones are added in one transaction
+# The expenses are grouped by amount, so each amount is read once per batch, and are checked against it in the order they were sent
+# Returns the result of each expense, in the order they were sent
+@app.post("/addExpensesBatch")
+def addExpensesBatch(addExpensesBatchBody: addExpensesBatch, connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Validates the description, value and date of each expense, the rejected ones get a 400 in their result
+    # The valid ones are grouped by their amount ID, with their value in cents
+    results = []
+    expensesByAmount = {}
+    for itemIndex, expenseItem in enumerate(addExpensesBatchBody.expenses):
+        sanitizedDescription = sanitizeString(expenseItem.expenseDescription).strip()
+        sanitizedDate = parseDate(expenseItem.date)
+        if len(sanitizedDescription) == 0:
+            results.append({"statusCode": status.HTTP_400_BAD_REQUEST, "status": "Expense description cannot be empty."})
+        elif not smallestValue <= expenseItem.expense <= largestValue:
+            results.append({"statusCode": status.HTTP_400_BAD_REQUEST, "status": "Expense must be from 0.01 to " + str(largestValue)})
+        elif sanitizedDate is None:
+            results.append({"statusCode": status.HTTP_400_BAD_REQUEST, "status": expenseItem.date +
+                           " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."})
+        else:
+            results.append(None)
+            expensesByAmount.setdefault(expenseItem.amountID, []).append(
+                (itemIndex, sanitizedDescription, convertValueToCents(expenseItem.expense), sanitizedDate, expenseItem.date))
+
+    # Checks and adds the valid expenses, all those of a shard in one write, so no other request can add to the amounts between the checks and the inserts
+    noOfAddedExpenses = repository.backend.addExpenses(connection, expensesByAmount, results)
+    return {"added": noOfAddedExpenses, "rejected": len(results) - noOfAddedExpenses, "results": results}
+
+
+# Checks the sort, date range and cursor query params shared by the amount list endpoints
+# Returns the reason if any of them is incorrect, else None
+def checkAmountRangeParams(sort, dateFrom, dateTo, cursor):
+    if sort != "asc" and sort != "desc":
+        return "Supported sort orders are asc and desc"
+    for inputDate in [dateFrom, dateTo]:
+        if inputDate is not None and checkDateFormat(inputDate) == False:
+            return inputDate + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."
+    if cursor is not None and decodeCursor(cursor) == False:
+        return cursor + " is not a valid cursor. Please use the nextCursor of the previous page."
+    return None
+
+
+# ETag of a response, the version of the data it was built from
+def versionETag(version):
+    return '"' + str(version) + '"'
+
+
+# Answers a GET from what the client or the response cache already has
+# Returns a 304 if the If-None-Match header of the request holds the ETag, the cached response if the key is cached, else None
+def cachedResponse(request, etag, cacheKey, mediaType="application/json"):
+    ifNoneMatch = request.headers.get("if-none-match")
+    if ifNoneMatch is not None and (ifNoneMatch.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in ifNoneMatch.split(",")]):
+        responseCache.countNotModified()
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    cachedBody = responseCache.get(cacheKey)
+    if cachedBody is not None:
+        return Response(content=cachedBody, media_type=mediaType, headers={"ETag": etag})
+    return None
+
+
+# Serializes a response body, caches it under the key and returns it with its ETag
+def cacheResponse(etag, cacheKey, body):
+    jsonResponse = JSONResponse(content=body, headers={"ETag": etag})
+    responseCache.put(cacheKey, jsonResponse.body)
+    return jsonResponse
 
-    # Query to get the ID, Description, Value of all the Amounts
-    queryToGetAmtDetails = "SELECT ID, AMT_EXP_DESC, VALUE, DATE FROM AMOUNTTRACKER WHERE TYPE = 'AMT'"
-    amtCheck = cur.execute(queryToGetAmtDetails).fetchall()
 
-    # Check if the amount is present in the DB
-    if amtCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount exists, please create one to get started."}
+# Gets all the available Amount details
+# Optionally filtered by dateFrom and dateTo, both in DD-MMM-YYYY format, and sorted by date with sort=asc|desc
+# Sending a limit and/or the nextCursor of the previous page returns one page at a time, with a nextCursor for the following page
+@app.get("/getAllAmounts")
+def getAllAmountDetails(request: Request, response: Response, limit: int | None = Query(default=None, ge=1, le=settings.MAX_PAGE_SIZE), cursor: str | None = None,
+                        sort: str = "asc", dateFrom: str | None = None, dateTo: str | None = None, connection: sqlite3.Connection = Depends(getConnection)):
 
-    # Loop through the amounts
-    # We query again to get the no of expenses for each amount
-    # Finally everything is appended to a list
+    # Checks the query params, if any of them is incorrect returns a 400
+    invalidParamReason = checkAmountRangeParams(sort, dateFrom, dateTo, cursor)
+    if invalidParamReason is not None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": invalidParamReason}
+
+    # The version and the amounts are read from one snapshot of every shard
+    with repository.backend.readAmounts(connection) as amountsReader:
+
+        # Any write bumps the global version, so the response is cached under it together with the query params
+        # If the client has the response of this version it gets a 304, if its cached its served from the cache
+        dataVersion = amountsReader.dataVersion()
+        etag = versionETag(dataVersion)
+        cacheKey = ("getAllAmounts", dataVersion, limit, cursor, sort, dateFrom, dateTo)
+        cached = cachedResponse(request, etag, cacheKey)
+        if cached is not None:
+            return cached
+
+        # Gets the ID, Description, Value, Date and the no of expenses of the Amounts
+        # When paging, one row more than the page is fetched to know if there is a next page
+        paging = limit is not None or cursor is not None
+        pageSize = limit or settings.DEFAULT_PAGE_SIZE
+        amtCheck = amountsReader.listAmounts(sort, dateFrom, dateTo, cursor, pageSize + 1 if paging else None)
+
+    # Loop through the amounts and append to a list
+    # The dates are formatted as a column, each distinct date once
+    pageOfAmounts = amtCheck[:pageSize] if paging else amtCheck
+    formattedDates = formatEpochs([row[3] for row in pageOfAmounts])
     formattedAmount = []
-    for ID, AMT_EXP_DESC, VALUE, DATE in amtCheck:
-        queryToGetCountOfExpenses = "SELECT COUNT(*) FROM AMOUNTTRACKER WHERE AMT_ID = ?"
-        valuesToGetCountOfExpenses = [ID]
-        countOfExpensesCheck = cur.execute(
-            queryToGetCountOfExpenses, valuesToGetCountOfExpenses).fetchone()
-        formattedAmount.append({"amountID": ID, "amountDescription": AMT_EXP_DESC, "amountValue": VALUE,
-                               "amountDate": convertEpochToDate(DATE), "noOfExpenses": countOfExpensesCheck[0]})
+    for (ID, AMT_EXP_DESC, VALUE, DATE, EXPENSE_COUNT, _), formattedDate in zip(pageOfAmounts, formattedDates):
+        formattedAmount.append({"amountID": ID, "amountDescription": AMT_EXP_DESC, "amountValue": convertCentsToValue(VALUE),
+                               "amountDate": formattedDate, "noOfExpenses": EXPENSE_COUNT})
 
     # Return the ID, Description, Value and the number of expenses
-    return {"amountDetails": formattedAmount}
+    # When paging, the cursor of the next page is returned too, it is None on the last page
+    if paging:
+        nextCursor = encodeCursor(amtCheck[pageSize - 1][3], amtCheck[pageSize - 1][0]) if len(amtCheck) > pageSize else None
+        return cacheResponse(etag, cacheKey, {"amountDetails": formattedAmount, "nextCursor": nextCursor})
+    return cacheResponse(etag, cacheKey, {"amountDetails": formattedAmount})
+
+
+# Fields of an expense which can be asked for with the fields query param of /getAmountExpenses
+expenseFields = ["expenseID", "expenseDescription", "expenseValue", "expenseDate"]
 
 
 # Gets all the expense details of an Amount
 # Requires amountID to be sent as a Query param
+# Optional query params, sort=asc|desc orders the expenses by date, limit and the returned nextCursor, sent back as cursor, page through the expenses
+# and fields, a comma separated list of expenseID, expenseDescription, expenseValue and expenseDate, returns only those fields of each expense
+# The totals are those of all the expenses, whichever page is returned
 @app.get("/getAmountExpenses")
-def getAmountExpenses(response: Response, amountID: str):
-
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # We query 2 times using the supplied amountID
-    # queryToGetTotalDetails queries the Value of the Amount
-    # queryToGetAmtDetails queries the ID, Description, value of the expenses
-    queryToGetTotalDetails = "SELECT VALUE FROM AMOUNTTRACKER WHERE ID = ?"
-    valuesToGetAmtDetails = [amountID]
-    totalValueCheck = cur.execute(
-        queryToGetTotalDetails, valuesToGetAmtDetails).fetchone()
-    queryToGetAmtDetails = "SELECT ID, AMT_EXP_DESC, VALUE, DATE FROM AMOUNTTRACKER WHERE AMT_ID = ? "
-    noOfExpensesCheck = cur.execute(
-        queryToGetAmtDetails, valuesToGetAmtDetails).fetchall()
-
-    # Check if the amount is present in the DB
-    if len(totalValueCheck) == 0:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount with the ID " + amountID + " exists. Please recheck"}
-
-    # Add the values of the expenses
-    extractedNumbers = [number[2] for number in noOfExpensesCheck]
-    summedUpAmount = sum(extractedNumbers)
-
-    # Subract from the total amount to get the remaining amount
-    remainingAmount = totalValueCheck[0] - summedUpAmount
+def getAmountExpenses(request: Request, response: Response, amountID: str, limit: int | None = Query(default=None, ge=1, le=settings.MAX_PAGE_SIZE),
+                      cursor: str | None = None, sort: str = "asc", fields: str | None = None, connection: sqlite3.Connection = Depends(getConnection)):
 
-    # Loop through the expenses and append to a list
+    # Checks the query params, if any of them is incorrect returns a 400
+    invalidParamReason = checkAmountRangeParams(sort, None, None, cursor)
+    if invalidParamReason is not None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": invalidParamReason}
+    selectedFields = expenseFields if fields is None else [field.strip() for field in fields.split(",") if field.strip()]
+    if len(selectedFields) == 0 or any(field not in expenseFields for field in selectedFields):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": "Supported fields are expenseID, expenseDescription, expenseValue and expenseDate"}
+
+    # The amount and its expenses are read from one snapshot
+    with repository.backend.readAmount(connection, amountID) as amountReader:
+
+        # Gets the version, value and totals of the amount, there are none if the amount is not present in the DB
+        # The spent total and no of expenses are kept up to date, so they are not summed up from the expenses
+        totalValueCheck = amountReader.totals()
+        if totalValueCheck is None:
+            response.status_code = status.HTTP_404_NOT_FOUND
+            return {"status": "No Amount with the ID " + amountID + " exists. Please recheck"}
+        amountVersion, amountValue, summedUpAmount, noOfExpenses = totalValueCheck
+
+        # If the client has the response of this version it gets a 304, if its cached its served from the cache
+        # Either way the expenses are not read
+        etag = versionETag(amountVersion)
+        cacheKey = ("getAmountExpenses", amountID, amountVersion, limit, cursor, sort, tuple(selectedFields))
+        cached = cachedResponse(request, etag, cacheKey)
+        if cached is not None:
+            return cached
+
+        # Gets the ID, Description, Value and Date of the expenses, in (DATE, ID) order
+        # When paging, one row more than the page is fetched to know if there is a next page
+        paging = limit is not None or cursor is not None
+        pageSize = limit or settings.DEFAULT_PAGE_SIZE
+        noOfExpensesCheck = amountReader.expenses(sort, cursor, pageSize + 1 if paging else None)
+
+    # Subract from the total amount to get the remaining amount, in cents, so a spent amount is exactly 0
+    remainingAmount = amountValue - summedUpAmount
+
+    # Loop through the expenses and append the selected fields to a list
+    # The dates are formatted as a column, each distinct date once, and only if they are selected
+    pageOfExpenses = noOfExpensesCheck[:pageSize] if paging else noOfExpensesCheck
+    formattedDates = formatEpochs([row[3] for row in pageOfExpenses]) if "expenseDate" in selectedFields else [None] * len(pageOfExpenses)
     formattedExpenses = []
-    for ID, AMT_EXP_DESC, VALUE, DATE in noOfExpensesCheck:
-        formattedExpenses.append({"expenseID": ID, "expenseDescription": AMT_EXP_DESC,
-                                 "expenseValue": VALUE, "expenseDate": convertEpochToDate(DATE)})
-
-    # Return JSON response
-    return {"amountID": amountID, "totalAmount": totalValueCheck[0], "totalExpenses": summedUpAmount, "remainingAmount": remainingAmount, "expenseDetails": formattedExpenses}
+    for (ID, AMT_EXP_DESC, VALUE, DATE), formattedDate in zip(pageOfExpenses, formattedDates):
+        expense = {"expenseID": ID, "expenseDescription": AMT_EXP_DESC, "expenseValue": convertCentsToValue(VALUE), "expenseDate": formattedDate}
+        formattedExpenses.append({field: expense[field] for field in selectedFields})
+
+    # Return JSON response, cached under the version of the amount
+    # When paging, the cursor of the next page is returned too, it is None on the last page
+    expenseDetails = {"amountID": amountID, "totalAmount": convertCentsToValue(amountValue), "totalExpenses": convertCentsToValue(summedUpAmount),
+                      "remainingAmount": convertCentsToValue(remainingAmount),
+                      "noOfExpenses": noOfExpenses, "expenseDetails": formattedExpenses}
+    if paging:
+        expenseDetails["nextCursor"] = encodeCursor(noOfExpensesCheck[pageSize - 1][3], noOfExpensesCheck[pageSize - 1][0]) if len(noOfExpensesCheck) > pageSize else None
+    return cacheResponse(etag, cacheKey, expenseDetails)
+
+
+# Label of a bucket from its key, for each bucket of /getAmountExpensesChart
+# The keys of the date buckets are dates in YYYY-MM-DD format, or YYYY-MM for a month, as SQLite's date functions return them
+chartBuckets = {
+    "day": lambda bucketKey: formatISODate(bucketKey),
+    "week": lambda bucketKey: "Week of " + formatISODate(bucketKey),
+    "month": lambda bucketKey: monthNames[int(bucketKey[5:7]) - 1] + "-" + bucketKey[:4],
+    "description": lambda bucketKey: bucketKey,
+}
+
+
+# Computes the chart of an amount from its slices, largest first, at most top slices plus one "Other" slice with the rest of the expenses
+# Without a bucket every expense is a slice, labelled with its description and date
+# The largest slices are kept, date buckets are then put back in date order
+# Returns the labels and the values of the slices
+def chartSlices(slices, bucket, top):
+    if bucket is None:
+        formattedDates = formatEpochs([row[1] for row in slices[:top]])
+        labels = [row[0] + " (" + formattedDate + ")" for row, formattedDate in zip(slices, formattedDates)]
+    else:
+        bucketLabel = chartBuckets[bucket]
+        keptSlices = slices[:top] if bucket == "description" else sorted(slices[:top])
+        labels = [bucketLabel(row[0]) for row in keptSlices]
+        slices = keptSlices + slices[top:]
+
+    values = [convertCentsToValue(row[2]) for row in slices[:top]]
+    if len(slices) > top:
+        otherSlices = slices[top:]
+        noOfOtherExpenses = sum(row[3] for row in otherSlices)
+        labels.append("Other (" + str(noOfOtherExpenses) + (" expense)" if noOfOtherExpenses == 1 else " expenses)"))
+        values.append(convertCentsToValue(sum(row[2] for row in otherSlices)))
+    return labels, values
 
 
 # Gets all the expense details of an Amount as a chart
 # Requires amountID and chartType to be sent as a Query param
+# Optionally bucket=day|week|month|description sums up the expenses by date or description, and top caps the no of slices, the rest are summed up as "Other"
+# The chart data is computed here and embedded in the page, the page is cached under the version of the amount
 @app.get("/getAmountExpensesChart")
-def getAmountExpensesChart(amountID: str, chartType: str, request: Request, response: Response):
+def getAmountExpensesChart(amountID: str, chartType: str, request: Request, response: Response, bucket: str | None = None,
+                           top: int = Query(default=settings.CHART_TOP_N, ge=1, le=settings.MAX_CHART_TOP_N), connection: sqlite3.Connection = Depends(getConnection)):
 
     if chartType != "pie" and chartType != "bar" and chartType != "doughnut" and chartType != "line" and chartType != "polarArea" and chartType != "radar":
         response.status_code = status.HTTP_403_FORBIDDEN
         return {"status": "Supported chart types are pie, bar, doughnut, line, polarArea and radar"}
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
+    if bucket is not None and bucket not in chartBuckets:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": "Supported buckets are day, week, month and description"}
 
-    # Check if the amount is present in the DB
-    queryToGetAmtDetails = "SELECT ID, AMT_EXP_DESC FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'"
-    valuesToGetAmtDetails = [amountID]
-    amtCheck = cur.execute(queryToGetAmtDetails,
-                           valuesToGetAmtDetails).fetchone()
+    # The amount and its expenses are read from one snapshot
+    with repository.backend.readAmount(connection, amountID) as amountReader:
 
-    if amtCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount with the ID " + amountID + " exists. Please recheck"}
+        # Check if the amount is present in the DB, and get its totals and version
+        amtCheck = amountReader.details()
+        if amtCheck is None:
+            response.status_code = status.HTTP_404_NOT_FOUND
+            return {"status": "No Amount with the ID " + amountID + " exists. Please recheck"}
 
-    # Returns a HTML chart
-    return templates.TemplateResponse(request=request, name="amountExpenses.html", context={"amountID": amtCheck[0], "amtDesc": amtCheck[1], "chartType": chartType})
+        # If the client has the page of this version it gets a 304, if its cached its served from the cache
+        etag = versionETag(amtCheck[3])
+        cacheKey = ("getAmountExpensesChart", amountID, amtCheck[3], chartType, bucket, top)
+        cached = cachedResponse(request, etag, cacheKey, "text/html; charset=utf-8")
+        if cached is not None:
+            return cached
 
+        slices = amountReader.chartSlices(bucket)
+
+    # Returns a HTML chart with the chart data embedded
+    labels, values = chartSlices(slices, bucket, top)
+    chartData = {"amountDescription": amtCheck[0], "labels": labels, "values": values, "totalAmount": convertCentsToValue(amtCheck[1]),
+                 "totalExpenses": convertCentsToValue(amtCheck[2]), "remainingAmount": convertCentsToValue(amtCheck[1] - amtCheck[2])}
+    templateResponse = templates.TemplateResponse(request=request, name="amountExpenses.html", context={"chartType": chartType, "chartData": chartData},
+                                                  headers={"ETag": etag})
+    responseCache.put(cacheKey, templateResponse.body)
+    return templateResponse
 
 
 # Gets all the amounts with their status, finished or remaining
+# Optionally only the amounts with status=finished|remaining, filtered and paged with the same query params as /getAllAmounts
 @app.get("/getAmountStatus")
-def getAmountByStatus(response: Response):
-
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Query to get the ID all the Amounts
-    queryToGetAmtDetails = "SELECT ID FROM AMOUNTTRACKER WHERE TYPE = 'AMT'"
-    amtCheck = cur.execute(queryToGetAmtDetails).fetchall()
-
-    # Check if the amount is present in the DB
-    if amtCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount exists, please create one to get started."}
-    
-
-    # Create an empty list, formattedAmount, to hold the final data
+def getAmountByStatus(response: Response, amountStatus: str | None = Query(default=None, alias="status"),
+                      limit: int | None = Query(default=None, ge=1, le=settings.MAX_PAGE_SIZE), cursor: str | None = None,
+                      sort: str = "asc", dateFrom: str | None = None, dateTo: str | None = None, connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Checks the query params, if any of them is incorrect returns a 400
+    invalidParamReason = checkAmountRangeParams(sort, dateFrom, dateTo, cursor)
+    if amountStatus is not None and amountStatus != "finished" and amountStatus != "remaining":
+        invalidParamReason = "Supported statuses are finished and remaining"
+    if invalidParamReason is not None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": invalidParamReason}
+
+    # Gets every amount with its remaining amount, from its spent total, and only those with the status if one is sent
+    # The values are in cents, so the remaining amount of a spent amount is exactly 0
+    # If the remaining amount is 0, the amount is finished, else its remaining
+    # When paging, one row more than the page is fetched to know if there is a next page
+    paging = limit is not None or cursor is not None
+    pageSize = limit or settings.DEFAULT_PAGE_SIZE
+    with repository.backend.readAmounts(connection) as amountsReader:
+        amtCheck = amountsReader.listAmounts(sort, dateFrom, dateTo, cursor, pageSize + 1 if paging else None, amountStatus)
+
+    # Loop through the amounts and append to a list
+    # Finished amounts get their ID, Description and Value, remaining amounts get the remaining amount too
     formattedAmount = []
-
-    # For each Amount ID, get the Value (1st query) and get the expense values (2nd query)
-    # Add all the expense values in summedUpExpenses
-    # If Value and summedUpExpenses are the same, means the amount is completed, get the ID, Description and Value for that ID and append to the list
-    # If Value and summedUpExpenses are not same, means the amount is not finished, get the ID, Description, Value, remaining amount for that ID and append to the list
-    index = 0
-    while index < len(amtCheck):
-        queryToGetValueOfAmount = "SELECT VALUE FROM AMOUNTTRACKER WHERE ID = ?"
-        valuesToGetValueOfAmount = amtCheck[index]
-        amountValue = cur.execute(queryToGetValueOfAmount, valuesToGetValueOfAmount).fetchone()
-
-        queryToGetExpenseDetails = "SELECT VALUE FROM AMOUNTTRACKER WHERE AMT_ID = ?"
-        expenseValue = cur.execute(queryToGetExpenseDetails, valuesToGetValueOfAmount).fetchall()
-    
-        summedUpExpenses =  sum(item[0] for item in expenseValue)
-
-        queryToDisplayData = "SELECT ID, AMT_EXP_DESC, VALUE FROM AMOUNTTRACKER WHERE ID = ?"
-        returnData = cur.execute(queryToDisplayData, valuesToGetValueOfAmount).fetchone()
-
-        if amountValue[0] == summedUpExpenses:
-            formattedAmount.append({"amountID": returnData[0], "amountDescription": returnData[1], "amountValue": returnData[2], "amountStatus" : "finished"})
-
-        if amountValue[0] != summedUpExpenses:
-            formattedAmount.append({"amountID": returnData[0], "amountDescription": returnData[1], "amountValue": returnData[2], "amountStatus" : "remaining", "remainingAmount" : amountValue[0] - summedUpExpenses})
-
-        index += 1
+    for ID, AMT_EXP_DESC, VALUE, DATE, _, REMAINING in amtCheck[:pageSize] if paging else amtCheck:
+        if REMAINING == 0:
+            formattedAmount.append({"amountID": ID, "amountDescription": AMT_EXP_DESC, "amountValue": convertCentsToValue(VALUE), "amountStatus": "finished"})
+        else:
+            formattedAmount.append({"amountID": ID, "amountDescription": AMT_EXP_DESC, "amountValue": convertCentsToValue(VALUE), "amountStatus": "remaining",
+                                    "remainingAmount": convertCentsToValue(REMAINING)})
 
     # Return the list
+    # When paging, the cursor of the next page is returned too, it is None on the last page
+    if paging:
+        nextCursor = encodeCursor(amtCheck[pageSize - 1][3], amtCheck[pageSize - 1][0]) if len(amtCheck) > pageSize else None
+        return {"amountDetails": formattedAmount, "nextCursor": nextCursor}
     return {"amountDetails": formattedAmount}
 
 
+# Label of a period, for each granularity of /analytics/spend
+# A day is the epoch of the day, the longer periods are dates in YYYY-MM-DD format, YYYY-MM for a month or YYYY for a year, as SQLite's date functions return them
+analyticsPeriods = {
+    "day": lambda period: formatEpoch(period),
+    "week": lambda period: "Week of " + formatISODate(period),
+    "month": lambda period: monthNames[int(period[5:7]) - 1] + "-" + period[:4],
+    "year": lambda period: period,
+}
+
+
+# Gets the spend per day, week, month or year across all the amounts, or only the amounts with the given IDs
+# Optional query params, dateFrom and dateTo limit the date range, amountID, which can be sent more than once, filters the amounts
+# and top returns that many descriptions with the most spent in the range
+# Its served from the daily rollups, SPENDBYDESCRIPTION by description across all the amounts and SPENDROLLUP by amount and description
+# so it reads one row per day and description, or per day, amount and description when the amounts are filtered
+@app.get("/analytics/spend")
+def getSpendAnalytics(response: Response, dateFrom: str | None = None, dateTo: str | None = None, granularity: str = "day",
+                      amountID: list[str] | None = Query(default=None, max_length=settings.MAX_PAGE_SIZE),
+                      top: int | None = Query(default=None, ge=1, le=settings.MAX_CHART_TOP_N), connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Checks the query params, if any of them is incorrect returns a 400
+    if granularity not in analyticsPeriods:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": "Supported granularities are day, week, month and year"}
+    for inputDate in [dateFrom, dateTo]:
+        if inputDate is not None and parseDate(inputDate) is None:
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return {"status": inputDate + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
+
+    # The spend of each period and the top descriptions, summed up across the shards
+    with repository.backend.readDB(connection) as dbReader:
+        spendCheck, topDescriptionsCheck = dbReader.spend(granularity, dateFrom, dateTo, amountID, top)
+
+    # Loop through the periods and append to a list
+    periodLabel = analyticsPeriods[granularity]
+    formattedSpend = []
+    for PERIOD, SPENT, EXPENSE_COUNT in spendCheck:
+        formattedSpend.append({"period": periodLabel(PERIOD), "spent": convertCentsToValue(SPENT), "noOfExpenses": EXPENSE_COUNT})
+
+    # Return the spend of every period and the total, with the top descriptions if asked for
+    spendDetails = {"granularity": granularity, "totalSpent": convertCentsToValue(sum(row[1] for row in spendCheck)),
+                    "noOfExpenses": sum(row[2] for row in spendCheck), "spend": formattedSpend}
+    if top is not None:
+        spendDetails["topDescriptions"] = [{"description": DESCRIPTION, "spent": convertCentsToValue(SPENT), "noOfExpenses": EXPENSE_COUNT}
+                                           for DESCRIPTION, SPENT, EXPENSE_COUNT in topDescriptionsCheck]
+    return spendDetails
+
+
+# Searches the descriptions of the amounts and expenses
+# Requires q, the words to search for. Every word must match, and by default matches the words starting with it, prefix=false matches whole words only
+# Optional query params, type=amount|expense limits the results to one of them, dateFrom and dateTo limit the date range
+# The results are ranked by bm25, best first, and returned one page at a time, with a nextCursor for the following page
+# Its served from the AMOUNTSEARCH full text index, so only the matching rows are read
+@app.get("/search")
+def searchDescriptions(request: Request, response: Response, q: str, searchType: str | None = Query(default=None, alias="type"), dateFrom: str | None = None,
+                       dateTo: str | None = None, prefix: bool = True, limit: int | None = Query(default=None, ge=1, le=settings.MAX_PAGE_SIZE),
+                       cursor: str | None = None, connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Checks the query params, if any of them is incorrect returns a 400
+    searchQuery = buildSearchQuery(q, prefix)
+    if searchQuery is None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": "Search query must have at least one word."}
+    if searchType is not None and searchType not in ("amount", "expense"):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": "Supported types are amount and expense"}
+    for inputDate in [dateFrom, dateTo]:
+        if inputDate is not None and parseDate(inputDate) is None:
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return {"status": inputDate + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
+
+    # The results are ordered by (score, ID), so the cursor is the (score, ID) of the last result of the previous page
+    if cursor is not None and decodeCursor(cursor, (float, str)) == False:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": cursor + " is not a valid cursor. Please use the nextCursor of the previous page."}
+
+    # The version and the results are read from one snapshot of every shard
+    with repository.backend.readDB(connection) as dbReader:
+
+        # Any write bumps the global version, so the response is cached under it together with the query params
+        dataVersion = dbReader.dataVersion()
+        etag = versionETag(dataVersion)
+        cacheKey = ("search", dataVersion, searchQuery, searchType, dateFrom, dateTo, limit, cursor)
+        cached = cachedResponse(request, etag, cacheKey)
+        if cached is not None:
+            return cached
+
+        # Gets the matching rows, best first
+        # One row more than the page is fetched to know if there is a next page
+        pageSize = limit or settings.DEFAULT_PAGE_SIZE
+        searchCheck = dbReader.search(searchQuery, searchType, dateFrom, dateTo, cursor, pageSize + 1)
+
+    # Loop through the results and append to a list, amounts and expenses in the same format as the export
+    pageOfResults = searchCheck[:pageSize]
+    formattedDates = formatEpochs([row[5] for row in pageOfResults])
+    formattedResults = []
+    for (ID, TYPE, AMT_ID, AMT_EXP_DESC, VALUE, DATE, SCORE), formattedDate in zip(pageOfResults, formattedDates):
+        if TYPE == "AMT":
+            formattedResults.append({"type": "amount", "amountID": ID, "amountDescription": AMT_EXP_DESC, "amountValue": convertCentsToValue(VALUE),
+                                     "amountDate": formattedDate})
+        else:
+            formattedResults.append({"type": "expense", "expenseID": ID, "amountID": AMT_ID, "expenseDescription": AMT_EXP_DESC,
+                                     "expenseValue": convertCentsToValue(VALUE), "expenseDate": formattedDate})
+
+    # Return the results and the cursor of the next page, it is None on the last page
+    nextCursor = encodeCursor(searchCheck[pageSize - 1][6], searchCheck[pageSize - 1][0]) if len(searchCheck) > pageSize else None
+    return cacheResponse(etag, cacheKey, {"results": formattedResults, "nextCursor": nextCursor})
+
+
+# Gets the amounts and expenses changed since a point in the change log, so clients keep their copy up to date without reloading it
+# Requires since, 0 the first time and then the nextSince of the previous response, optionally limit, the most changes returned at once
+# Each change is the row as it is now, or a tombstone with deleted set if it was deleted, the earlier changes of a row are not returned
+# A change to an expense returns its amount too, with its new no of expenses
+# When sharded each shard logs its own changes, so since is the position in each of them, joined with dots
+# If the changes since are compacted away, or since is from a DB sharded differently, it returns a 410 with the current since,
+# the client then reloads with /getAllAmounts and /getAmountExpenses and carries on from it
+@app.get("/changes")
+def getChanges(response: Response, since: str, limit: int | None = Query(default=None, ge=1, le=settings.MAX_PAGE_SIZE),
+               connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Checks since, if its not a sequence no, or one for each shard, returns a 400
+    noOfShards = len(shards.shardPools)
+    sinceParts = since.split(".")
+    if not all(sincePart.isascii() and sincePart.isdigit() for sincePart in sinceParts):
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": since + " is not a valid since. Please use 0 or the nextSince of the previous response."}
+    sinceSeqs = [int(sincePart) for sincePart in sinceParts]
+    if sinceSeqs == [0]:
+        sinceSeqs = [0] * noOfShards
+
+    # Gets the changes after since from every shard, each with the row as it is now
+    # One change more than the limit is fetched from each shard to know if there are more
+    # A since of another no of shards is read as -1 on every shard, which is never in the log, so only the sequence nos are read
+    pageSize = limit or settings.DEFAULT_PAGE_SIZE
+    with repository.backend.readDB(connection) as dbReader:
+        shardChanges = dbReader.changes(sinceSeqs if len(sinceSeqs) == noOfShards else [-1] * noOfShards, pageSize + 1)
+
+    # If since is not from this DB or its changes are compacted away, returns a 410 with the since to carry on from after a reload
+    if any(shardChangeRows is None for _, _, shardChangeRows in shardChanges):
+        latestSeqs = [latestSeq for _, latestSeq, _ in shardChanges]
+        response.status_code = status.HTTP_410_GONE
+        return {"status": "Changes since " + since + " are no longer available. Please reload with /getAllAmounts and /getAmountExpenses and then use the since returned.",
+                "since": latestSeqs[0] if noOfShards == 1 else ".".join(str(latestSeq) for latestSeq in latestSeqs)}
+
+    # The changes of the shards are merged in the order they were made, and the since of each shard moves up to the last of its changes returned
+    changeRows = mergeShardRows([[(shard,) + changeRow for changeRow in shardChangeRows] for shard, (_, _, shardChangeRows) in enumerate(shardChanges)],
+                                key=lambda row: row[2], limit=pageSize)
+    nextSeqs = list(sinceSeqs)
+    for changeRow in changeRows:
+        nextSeqs[changeRow[0]] = changeRow[1]
+
+    # Loop through the changes and append to a list, amounts and expenses in the same format as /getAllAmounts and /search
+    formattedDates = iter(formatEpochs([row[9] for row in changeRows if not row[6]]))
+    formattedChanges = []
+    for shard, SEQ, CHANGED_AT, ID, TYPE, AMT_ID, DELETED, AMT_EXP_DESC, VALUE, DATE, EXPENSE_COUNT in changeRows:
+        if TYPE == "AMT":
+            formattedChange = {"type": "amount", "amountID": ID, "deleted": bool(DELETED)}
+            if not DELETED:
+                formattedChange.update({"amountDescription": AMT_EXP_DESC, "amountValue": convertCentsToValue(VALUE), "amountDate": next(formattedDates),
+                                        "noOfExpenses": EXPENSE_COUNT})
+        else:
+            formattedChange = {"type": "expense", "expenseID": ID, "amountID": AMT_ID, "deleted": bool(DELETED)}
+            if not DELETED:
+                formattedChange.update({"expenseDescription": AMT_EXP_DESC, "expenseValue": convertCentsToValue(VALUE), "expenseDate": next(formattedDates)})
+        formattedChanges.append(formattedChange)
+
+    # Return the changes, the since to send next and if there are more changes after them
+    return {"changes": formattedChanges, "nextSince": nextSeqs[0] if noOfShards == 1 else ".".join(str(nextSeq) for nextSeq in nextSeqs),
+            "hasMore": sum(len(shardChangeRows) for _, _, shardChangeRows in shardChanges) > len(changeRows)}
+
+
+# Formats a batch of amount or expense rows as NDJSON lines or CSV rows
+def formatExportRows(rows, exportFormat):
+    formattedDates = formatEpochs([row[4] for row in rows])
+    if exportFormat == "csv":
+        csvBuffer = io.StringIO()
+        csv.writer(csvBuffer).writerows((ID, TYPE, AMT_ID or "", AMT_EXP_DESC, convertCentsToValue(VALUE), formattedDate)
+                                        for (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID), formattedDate in zip(rows, formattedDates))
+        return csvBuffer.getvalue()
+
+    lines = []
+    for (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID), formattedDate in zip(rows, formattedDates):
+        if TYPE == "AMT":
+            lines.append(json.dumps({"type": "amount", "amountID": ID, "amountDescription": AMT_EXP_DESC,
+                                     "amountValue": convertCentsToValue(VALUE), "amountDate": formattedDate}))
+        else:
+            lines.append(json.dumps({"type": "expense", "expenseID": ID, "amountID": AMT_ID, "expenseDescription": AMT_EXP_DESC,
+                                     "expenseValue": convertCentsToValue(VALUE), "expenseDate": formattedDate}))
+    return "\n".join(lines) + "\n"
+
+
+# Generates the export from the batches of rows read by the repository, each amount followed by its expenses, in (DATE, ID) order
+# The formatted rows are sent in chunks of about 64KB, so the memory used stays the same whatever the size of the DB
+def generateExport(rowBatches, exportFormat, compression):
+    compressor = zlib.compressobj(wbits=31) if compression == "gzip" else None
+    try:
+        def encodeChunk(chunk):
+            return compressor.compress(chunk.encode()) if compressor else chunk.encode()
+
+        if exportFormat == "csv":
+            yield encodeChunk("ID,TYPE,AMT_ID,DESCRIPTION,VALUE,DATE\r\n")
+
+        chunk = ""
+        for rows in rowBatches:
+            chunk += formatExportRows(rows, exportFormat)
+            if len(chunk) >= 65536:
+                yield encodeChunk(chunk)
+                chunk = ""
+        if chunk:
+            yield encodeChunk(chunk)
+
+        if compressor:
+            yield compressor.flush()
+    finally:
+        rowBatches.close()
+
+
+# Exports all the amounts and their expenses, streamed as NDJSON, the default, or CSV with format=ndjson|csv
+# Optionally only the amounts dated between dateFrom and dateTo, both in DD-MMM-YYYY format, and gzip compressed with compression=gzip
+@app.get("/export")
+def exportAmounts(response: Response, exportFormat: str = Query(default="ndjson", alias="format"), compression: str | None = None,
+                  dateFrom: str | None = None, dateTo: str | None = None):
+
+    # Checks the query params, if any of them is incorrect returns a 400
+    invalidParamReason = checkAmountRangeParams("asc", dateFrom, dateTo, None)
+    if exportFormat != "ndjson" and exportFormat != "csv":
+        invalidParamReason = "Supported formats are ndjson and csv"
+    if compression is not None and compression != "gzip":
+        invalidParamReason = "Supported compression is gzip"
+    if invalidParamReason is not None:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": invalidParamReason}
+
+    headers = {"Content-Disposition": "attachment; filename=AMOUNTTRACKER." + exportFormat}
+    if compression == "gzip":
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(generateExport(repository.backend.exportRows(dateFrom, dateTo), exportFormat, compression), headers=headers,
+                             media_type="application/x-ndjson" if exportFormat == "ndjson" else "text/csv")
+
 
 # Deletes an amount from the DB, when an amount is deleted all its expenses are also deleted
 # Requires amountID to be sent as a Query param
 @app.delete("/deleteAmount")
-def deleteAmount(amountID: str, response: Response):
-
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Check if the amount is present in the DB
-    queryToCheckAmount = "SELECT * FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'"
-    valuesToCheckAmount = [amountID]
-    amtCheck = cur.execute(queryToCheckAmount, valuesToCheckAmount).fetchone()
-
-    if amtCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount with the ID " + amountID + " exists. Please recheck"}
+def deleteAmount(amountID: str, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
 
-    queryToDeleteAmount = 'DELETE FROM AMOUNTTRACKER WHERE ID = ? OR AMT_ID = ?'
-    cur.execute(queryToDeleteAmount, [amountID, amountID])
-    connection.commit()
-    return {"status": "Amount with the ID, " + amountID + " and all its expenses are deleted."}
+    # Its 404 if there is no amount by the ID
+    return writeResponse(response, repository.backend.deleteAmount(connection, amountID))
 
 
 # Deletes an expense from the DB
 # Requires expenseID to be sent as a Query param
 @app.delete("/deleteExpense")
-def deleteExpense(expenseID: str, response: Response):
+def deleteExpense(expenseID: str, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
 
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Check if the expense is present in the DB
-    queryToCheckExpense = "SELECT * FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'EXP'"
-    valuesToCheckExpense = [expenseID]
-    expCheck = cur.execute(queryToCheckExpense,
-                           valuesToCheckExpense).fetchone()
-
-    if expCheck is None:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Expense with the ID " + expenseID + " exists. Please recheck"}
-
-    queryToDeleteExpense = 'DELETE FROM AMOUNTTRACKER WHERE ID = ? OR AMT_ID = ?'
-    cur.execute(queryToDeleteExpense, [expenseID, expenseID])
-    connection.commit()
-    return {"status": "Expense with the ID, " + expenseID + " is deleted."}
+    # Its 404 if there is no expense by the ID
+    return writeResponse(response, repository.backend.deleteExpense(connection, expenseID))
 
 
 # Deletes all the expenses of an amount
 # Requires amountID to be sent as a Query param
 @app.delete("/deleteAmountExpenses")
-def deleteAmountExpenses(amountID: str, response: Response):
-
-    # Connects to the DB
-    connection = sqlite3.connect("AMOUNTTRACKER.db")
-    cur = connection.cursor()
-
-    # Check if the amount is present in the DB
-    queryToCheckAmount = "SELECT * FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'"
-    valuesToCheckAmount = [amountID]
-    amtCheck = cur.execute(queryToCheckAmount, valuesToCheckAmount).fetchone()
-
-    if amtCheck is None:
+def deleteAmountExpenses(amountID: str, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Its 404 if there is no amount by the ID
+    return writeResponse(response, repository.backend.deleteAmountExpenses(connection, amountID))
+
+
+# POST Body to delete amounts and expenses in bulk
+# Either the IDs of the amounts and expenses to delete, or a date range, in DD-MMM-YYYY format, of the amounts to delete
+# With archive, the deleted rows are moved to AMOUNTTRACKERARCHIVE instead of being discarded
+class deleteBatch(BaseModel):
+    IDs: list[str] | None = Field(default=None, min_length=1, max_length=settings.MAX_BATCH_SIZE)
+    dateFrom: str | None = None
+    dateTo: str | None = None
+    archive: bool = False
+
+
+# Deletes amounts and expenses in bulk
+# Sending IDs deletes those amounts, each with all its expenses, and expenses, the IDs which are not present in the DB are returned as notFound
+# Sending dateFrom and/or dateTo deletes the amounts dated in the range, each with all its expenses
+# The rows are deleted in chunks of DELETE_CHUNK_SIZE IDs or amounts, each chunk its own transaction, so the write lock is never held for long
+# and other requests get to write in between. A failure part way leaves the chunks before it deleted
+@app.post("/deleteBatch")
+def deleteBatch(deleteBatchBody: deleteBatch, response: Response, connection: sqlite3.Connection = Depends(getConnection)):
+
+    # Checks that either IDs or a date range is sent, if not returns a 400
+    deleteByIDs = deleteBatchBody.IDs is not None
+    deleteByDates = deleteBatchBody.dateFrom is not None or deleteBatchBody.dateTo is not None
+    if deleteByIDs == deleteByDates:
+        response.status_code = status.HTTP_400_BAD_REQUEST
+        return {"status": "Send either the IDs to delete or a dateFrom and/or dateTo of the amounts to delete."}
+    for inputDate in [deleteBatchBody.dateFrom, deleteBatchBody.dateTo]:
+        if inputDate is not None and parseDate(inputDate) is None:
+            response.status_code = status.HTTP_400_BAD_REQUEST
+            return {"status": inputDate + " is not a valid date or is not in DD-MMM-YYYY format, e.g., 05-Aug-2024. Please correct the date."}
+
+    archivedAt = int(time.time())
+    noOfDeletedAmounts = 0
+    noOfDeletedExpenses = 0
+    notFoundIDs = []
+
+    if deleteByIDs:
+        IDs = list(dict.fromkeys(deleteBatchBody.IDs))
+
+        # Deletes the IDs a chunk at a time, each chunk in one write per shard
+        for chunkStart in range(0, len(IDs), settings.DELETE_CHUNK_SIZE):
+            chunkOfIDs = IDs[chunkStart:chunkStart + settings.DELETE_CHUNK_SIZE]
+            noOfAmounts, noOfExpenses, foundIDs = repository.backend.deleteIDs(connection, chunkOfIDs, deleteBatchBody.archive, archivedAt)
+            noOfDeletedAmounts += noOfAmounts
+            noOfDeletedExpenses += noOfExpenses
+            notFoundIDs.extend(ID for ID in chunkOfIDs if ID.lower() not in foundIDs)
+
+    else:
+        # Deletes the amounts in the range a chunk at a time
+        noOfDeletedAmounts, noOfDeletedExpenses = repository.backend.deleteAmountsInRange(connection, deleteBatchBody.dateFrom, deleteBatchBody.dateTo,
+                                                                                        deleteBatchBody.archive, archivedAt)
+
+    # Return the no of amounts and expenses deleted, with the IDs not found when deleting by IDs
+    deleteDetails = {"deletedAmounts": noOfDeletedAmounts, "deletedExpenses": noOfDeletedExpenses, "archived": deleteBatchBody.archive}
+    if deleteByIDs:
+        deleteDetails["notFound"] = notFoundIDs
+    return deleteDetails
+
+
+# Gets the hit rate, size and evictions of the response cache, and the no of 304s sent, for tuning its size
+@app.get("/cacheStats")
+def getCacheStats():
+    return responseCache.stats()
+
+
+# Gets the request and query metrics in Prometheus text format
+# Returns a 404 when the metrics are turned off
+@app.get("/metrics")
+def getMetrics(response: Response):
+    if not settings.METRICS:
         response.status_code = status.HTTP_404_NOT_FOUND
-        return {"status": "No Amount with the ID " + amountID + " exists. Please recheck"}
-
-    queryToDeleteAmountExpenses = 'DELETE FROM AMOUNTTRACKER WHERE AMT_ID = ?'
-    cur.execute(queryToDeleteAmountExpenses, [amountID])
-    connection.commit()
-    return {"status": "All expenses for the Amount with the ID, " + amountID + " are deleted."}
\ No newline at end of file
+        return {"status": "Metrics are turned off, set AMOUNTTRACKER_METRICS=1 to turn them on"}
+    return Response(content=metrics.render(responseCache.stats()), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,385 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+
+# Maintenance commands for the AMOUNTTRACKER DB, run from the repo root, e.g.
+# python maintenance.py checkQueryPlans
+
+
+# Reads the requests recorded in the HAR
+# Returns a list of dicts with the method, the path with its query string, the body and the recorded response
+def loadHarRequests(harPath="PythonAmountTracker.har"):
+    with open(harPath, encoding="utf-8") as harFile:
+        entries = json.load(harFile)["log"]["entries"]
+
+    harRequests = []
+    for entry in entries:
+        splitURL = urlsplit(entry["request"]["url"])
+        harRequests.append({"method": entry["request"]["method"],
+                            "url": splitURL.path + ("?" + splitURL.query if splitURL.query else ""),
+                            "body": entry["request"].get("postData", {}).get("text"),
+                            "recordedResponse": entry["response"]["content"].get("text", "")})
+    return harRequests
+
+
+# Sends the HAR requests, in order, through the client
+# The IDs generated when the HAR was recorded are swapped for the IDs generated now, so later requests reference the rows created by earlier ones
+def replayHar(client, harRequests):
+    generatedIDs = {}
+    responses = []
+    for harRequest in harRequests:
+        url = harRequest["url"]
+        body = harRequest["body"]
+        for recordedID, generatedID in generatedIDs.items():
+            url = url.replace(recordedID, generatedID)
+            if body is not None:
+                body = body.replace(recordedID, generatedID)
+
+        response = client.request(harRequest["method"], url, content=body,
+                                  headers={"Content-Type": "application/json"} if body is not None else None)
+        responses.append(response)
+
+        try:
+            recordedJSON = json.loads(harRequest["recordedResponse"])
+            responseJSON = response.json()
+        except ValueError:
+            continue
+        if isinstance(recordedJSON, dict) and isinstance(responseJSON, dict):
+            for key in ["amountID", "expenseID"]:
+                if key in recordedJSON and key in responseJSON:
+                    generatedIDs[recordedJSON[key]] = responseJSON[key]
+    return responses
+
+
+# Copies the DB into a temp directory, so commands which write to it leave the real one untouched
+# Yields the path of the copy, the directory is removed with the copy and its WAL files when the command is done with it
+@contextmanager
+def scratchCopy(databasePath):
+    with tempfile.TemporaryDirectory(prefix="amounttracker-") as scratchDirectory:
+        scratchPath = os.path.join(scratchDirectory, os.path.basename(databasePath))
+        shutil.copy(databasePath, scratchPath)
+        yield scratchPath
+
+
+# Sends a request to each of the endpoints the HAR does not have, /search, /changes, /analytics/spend, /export and /deleteBatch,
+# and to the variants of the others the HAR does not send, so their statements are checked too
+# They run on an amount and an expense added first, with date ranges, cursors and filters, so the statements which narrow by them are sent
+def sendUncoveredRequests(client):
+    amountID = client.post("/addAnAmount", json={"amountDescription": "Query plan check", "amount": 100, "date": "01-Sep-2024"}).json()["amountID"]
+    expenseID = client.post("/addAnExpense", json={"amountID": amountID, "expenseDescription": "Query plan check", "expense": 10, "date": "02-Sep-2024"}).json()["expenseID"]
+    dateRange = "dateFrom=01-Jan-2024&dateTo=31-Dec-2024"
+
+    client.get("/getAllAmounts?limit=1&sort=desc&" + dateRange)
+    client.get("/getAmountStatus?status=remaining&limit=1&" + dateRange)
+    client.get("/getAmountExpenses?amountID=" + amountID + "&limit=1&sort=desc")
+    for bucket in ["day", "week", "month", "description"]:
+        client.get("/getAmountExpensesChart?amountID=" + amountID + "&chartType=pie&bucket=" + bucket)
+
+    for granularity in ["day", "month"]:
+        client.get("/analytics/spend?granularity=" + granularity + "&top=3&" + dateRange)
+        client.get("/analytics/spend?granularity=" + granularity + "&top=3&amountID=" + amountID + "&" + dateRange)
+
+    searchPage = client.get("/search?q=query&limit=1&" + dateRange).json()
+    if searchPage.get("nextCursor"):
+        client.get("/search?q=query&limit=1&" + dateRange + "&cursor=" + searchPage["nextCursor"])
+    client.get("/search?q=check&type=expense&prefix=false")
+
+    # A since of 0 is answered with a 410 and the latest since once the log is compacted, the changes are then read from that since
+    changes = client.get("/changes?since=0&limit=5").json()
+    client.get("/changes?since=" + str(changes.get("nextSince", changes.get("since"))))
+
+    client.get("/export")
+    client.get("/export?format=csv&" + dateRange)
+
+    client.post("/deleteBatch", json={"IDs": [expenseID, "notAnID"], "archive": True})
+    client.post("/deleteBatch", json={"dateFrom": "01-Sep-2024", "dateTo": "01-Sep-2024", "archive": True})
+    client.post("/deleteBatch", json={"IDs": [amountID]})
+
+
+# A predicate of a statement on the ID or AMT_ID of a row, compared with a value or a list of them, which an index can look up a few rows by
+selectivePredicate = re.compile(r"\b(ID|AMT_ID) (= ('|\?|-?\d)|IN \()")
+
+
+# Replays the HAR against a copy of the DB, then sends the requests the HAR does not cover, capturing every statement the endpoints send to SQLite
+# Each captured statement is run through EXPLAIN QUERY PLAN and any statement which scans a table instead of using an index is reported
+# The full text index is read by its MATCH, which the plan shows as a scan of the virtual table, and sqlite_sequence, one row per table, has no index, so they are not
+# A statement which has an ID or AMT_ID predicate but searches a table only by TYPE=?, which reads every amount or every expense, is reported too
+# Returns the number of statements reported, the command exits with 1 when there are any, so it can run in CI
+def checkQueryPlans(databasePath):
+    from fastapi.testclient import TestClient
+    from database import pool
+    import settings
+    import index
+
+    # The statements are captured from the pooled connections, which the SQLite repository runs every query on
+    settings.REPOSITORY = "sqlite"
+    with scratchCopy(databasePath) as scratchPath:
+        pool.configure(scratchPath)
+        capturedStatements = []
+        pool.connectionHooks.append(lambda connection: connection.set_trace_callback(capturedStatements.append))
+        with TestClient(index.app) as client:
+            # The statements run by the migrations at startup are not endpoint queries
+            capturedStatements.clear()
+            replayHar(client, loadHarRequests())
+            sendUncoveredRequests(client)
+        pool.connectionHooks.clear()
+
+        explainConnection = sqlite3.connect(pool.path)
+        noOfReportedStatements = 0
+        checkedStatements = set()
+        for statement in capturedStatements:
+            if not statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT")) or statement in checkedStatements:
+                continue
+            # The statements FTS5 runs on the shadow tables of the search index, always prefixed with the quoted schema, are not endpoint queries
+            if "'main'." in statement:
+                continue
+            checkedStatements.add(statement)
+
+            plan = [row[3] for row in explainConnection.execute("EXPLAIN QUERY PLAN " + statement)]
+            scans = [detail for detail in plan if detail.startswith("SCAN") and " VIRTUAL TABLE " not in detail and detail.split()[1] != "sqlite_sequence"]
+            typeSearches = [detail for detail in plan if detail.startswith("SEARCH") and detail.endswith("(TYPE=?)")] if selectivePredicate.search(statement) else []
+            noOfReportedStatements += len(scans) > 0 or len(typeSearches) > 0
+            print(("SCAN  " if scans else "TYPE  " if typeSearches else "OK    ") + " ".join(statement.split()))
+            for detail in plan:
+                print("        " + detail)
+
+        explainConnection.close()
+    print(str(len(checkedStatements)) + " statements checked, " + str(noOfReportedStatements) + " scan or search only by TYPE")
+    return noOfReportedStatements
+
+
+# Computes the totals of every amount from the expense rows, like the query migration 2 fills AMOUNTTOTALS with
+# The unary + on EXPENSE.TYPE stops SQLite from looking up the expenses by the TYPE index instead of the AMT_ID one, which would read every expense for every amount
+queryToRecomputeAmountTotals = """SELECT AMOUNT.ID, COALESCE(SUM(EXPENSE.VALUE), 0), COUNT(EXPENSE.ID), MIN(EXPENSE.DATE), MAX(EXPENSE.DATE)
+FROM AMOUNTTRACKER AS AMOUNT LEFT JOIN AMOUNTTRACKER AS EXPENSE ON EXPENSE.AMT_ID = AMOUNT.ID AND +EXPENSE.TYPE = 'EXP'
+WHERE AMOUNT.TYPE = 'AMT' GROUP BY AMOUNT.ID"""
+
+
+# Recomputes the totals of every amount from the expense rows and compares them with AMOUNTTOTALS
+# Reports every amount whose maintained totals have drifted, with repair the drifted rows are overwritten with the recomputed ones
+# The values are integer cents, so the totals must match exactly
+# Returns the number of drifted amounts
+def checkAggregates(databasePath, repair=False):
+    from database import openConnection
+    from migrations import runMigrations
+
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    cur = connection.cursor()
+    cur.execute("BEGIN IMMEDIATE" if repair else "BEGIN")
+
+    recomputedTotals = {row[0]: row for row in cur.execute(queryToRecomputeAmountTotals)}
+    maintainedTotals = {row[0]: row for row in cur.execute(
+        "SELECT AMT_ID, SPENT, EXPENSE_COUNT, MIN_DATE, MAX_DATE FROM AMOUNTTOTALS")}
+
+    driftedAmounts = []
+    for amountID in recomputedTotals.keys() | maintainedTotals.keys():
+        recomputed = recomputedTotals.get(amountID)
+        maintained = maintainedTotals.get(amountID)
+        if recomputed is None or maintained is None or maintained[1:] != recomputed[1:]:
+            driftedAmounts.append(amountID)
+            print(amountID + " maintained " + str(maintained and maintained[1:]) + " recomputed " + str(recomputed and recomputed[1:]))
+
+    if repair:
+        # The rows are updated in place and their versions bumped, as a version reset to 0 would bring back ETags of old responses
+        for amountID in driftedAmounts:
+            if amountID in recomputedTotals:
+                cur.execute("""INSERT INTO AMOUNTTOTALS (AMT_ID, SPENT, EXPENSE_COUNT, MIN_DATE, MAX_DATE) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (AMT_ID) DO UPDATE SET SPENT = excluded.SPENT, EXPENSE_COUNT = excluded.EXPENSE_COUNT,
+MIN_DATE = excluded.MIN_DATE, MAX_DATE = excluded.MAX_DATE, VERSION = VERSION + 1""", recomputedTotals[amountID])
+            else:
+                cur.execute("DELETE FROM AMOUNTTOTALS WHERE AMT_ID = ?", [amountID])
+        cur.execute("UPDATE DATAVERSION SET VERSION = VERSION + 1")
+        connection.commit()
+    else:
+        connection.rollback()
+    connection.close()
+
+    print(str(len(recomputedTotals)) + " amounts checked, " + str(len(driftedAmounts)) +
+          " drifted" + (" and repaired" if repair and driftedAmounts else ""))
+    return len(driftedAmounts)
+
+
+# Refills the daily spend rollups, SPENDROLLUP and SPENDBYDESCRIPTION, from the expense rows in one transaction
+# Returns the number of rollup rows
+def rebuildRollups(databasePath):
+    from database import openConnection, writeTransaction
+    from migrations import runMigrations, rebuildSpendRollups
+
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    cur = connection.cursor()
+    with writeTransaction(connection):
+        rebuildSpendRollups(cur)
+        noOfRollupRows = cur.execute("SELECT COUNT(*) FROM SPENDROLLUP").fetchone()[0]
+        noOfDays = cur.execute("SELECT COUNT(DISTINCT DAY) FROM SPENDBYDESCRIPTION").fetchone()[0]
+    connection.close()
+
+    print("Spend rollups rebuilt, " + str(noOfRollupRows) + " rows over " + str(noOfDays) + " days")
+    return noOfRollupRows
+
+
+# Rebuilds the AMOUNTSEARCH full text index from the descriptions in one transaction, then merges it into one segment
+# Needed after a VACUUM, which can renumber the rowids the index refers to
+# Returns the number of indexed rows
+def rebuildSearchIndex(databasePath):
+    from database import openConnection, writeTransaction
+    from migrations import runMigrations, rebuildDescriptionSearch
+
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    cur = connection.cursor()
+    with writeTransaction(connection):
+        rebuildDescriptionSearch(cur)
+        cur.execute("INSERT INTO AMOUNTSEARCH (AMOUNTSEARCH) VALUES ('optimize')")
+        noOfIndexedRows = cur.execute("SELECT COUNT(*) FROM AMOUNTTRACKER").fetchone()[0]
+    connection.close()
+
+    print("Search index rebuilt, " + str(noOfIndexedRows) + " rows indexed")
+    return noOfIndexedRows
+
+
+# Turns on auto_vacuum=INCREMENTAL, which the background incremental vacuum needs, and shrinks the file to its used pages
+# The mode of an existing DB only changes with a full VACUUM, which has to run outside a transaction and holds the write lock until its done,
+# so its a command to run once while the app is stopped, not a migration
+# A VACUUM can renumber the rowids the search index refers to, so the index is rebuilt after it
+def enableIncrementalVacuum(databasePath):
+    from database import openConnection, writeTransaction
+    from migrations import runMigrations, rebuildDescriptionSearch
+
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    cur = connection.cursor()
+    sizeBefore = os.path.getsize(databasePath)
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cur.execute("VACUUM")
+    with writeTransaction(connection):
+        rebuildDescriptionSearch(cur)
+    cur.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    autoVacuum = cur.execute("PRAGMA auto_vacuum").fetchone()[0]
+    connection.close()
+
+    print("auto_vacuum is " + ("INCREMENTAL" if autoVacuum == 2 else str(autoVacuum)) + ", the DB went from " +
+          str(sizeBefore) + " to " + str(os.path.getsize(databasePath)) + " bytes")
+    return autoVacuum == 2
+
+
+# Compacts the change log /changes is served from, removing the entries older than retentionSeconds, as the app does every CHANGES_COMPACT_INTERVAL_S
+# Returns the no of entries removed
+def compactChangeLog(databasePath, retentionSeconds):
+    from database import openConnection
+    from migrations import runMigrations
+    from changelog import compactChanges
+
+    connection = openConnection(databasePath)
+    runMigrations(connection)
+    noOfCompactedChanges = compactChanges(connection, retentionSeconds)
+    connection.close()
+
+    print(str(noOfCompactedChanges) + " changes older than " + str(retentionSeconds) + " seconds compacted")
+    return noOfCompactedChanges
+
+
+# Moves every amount, with its expenses, to the shard it belongs to when the DB is sharded over noOfShards files, see shards.py
+# Run it with the app stopped, giving fromShards, the no of shards the DB is sharded over now, 1 if its a single file, then start the app with AMOUNTTRACKER_SHARDS=noOfShards
+# Amounts are copied to their new shard, by attaching it, and then deleted from their old one, so the triggers keep the totals, rollups and search index of both up to date
+# The copy and the delete are separate transactions, as a transaction across two WAL files is not atomic, and the copy skips rows already copied,
+# so if its stopped part way, running it again finishes the move
+# The version of a moved amount carries on from its version on the old shard, so its ETags are never reused
+# Returns the no of amounts moved
+def reshard(databasePath, noOfShards, fromShards=1):
+    import settings
+    from database import openConnection, writeTransaction
+    from migrations import runMigrations
+    from shards import shardPaths, shardOf
+
+    paths = shardPaths(databasePath, max(noOfShards, fromShards))
+    for path in paths:
+        connection = openConnection(path)
+        runMigrations(connection)
+        connection.close()
+
+    noOfMovedAmounts = 0
+    queryToCopyRows = "INSERT OR IGNORE INTO TARGET.AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) SELECT ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID FROM main.AMOUNTTRACKER WHERE "
+    for sourceShard, sourcePath in enumerate(paths):
+        connection = openConnection(sourcePath)
+        cur = connection.cursor()
+
+        # Groups the amounts of the shard which belong to another shard by that shard
+        amountIDsByShard = {}
+        for amountID, in cur.execute("SELECT ID FROM AMOUNTTRACKER WHERE TYPE = 'AMT'").fetchall():
+            targetShard = shardOf(amountID, noOfShards)
+            if targetShard != sourceShard:
+                amountIDsByShard.setdefault(targetShard, []).append(amountID)
+
+        for targetShard, amountIDs in amountIDsByShard.items():
+            cur.execute("ATTACH DATABASE ? AS TARGET", [paths[targetShard]])
+            for chunkStart in range(0, len(amountIDs), settings.DELETE_CHUNK_SIZE):
+                chunkOfAmountIDs = amountIDs[chunkStart:chunkStart + settings.DELETE_CHUNK_SIZE]
+                placeholders = ", ".join("?" * len(chunkOfAmountIDs))
+                with writeTransaction(connection):
+                    cur.execute(queryToCopyRows + "ID IN (" + placeholders + ")", chunkOfAmountIDs)
+                    cur.execute(queryToCopyRows + "AMT_ID IN (" + placeholders + ")", chunkOfAmountIDs)
+                    cur.execute("UPDATE TARGET.AMOUNTTOTALS SET VERSION = VERSION + 1 + (SELECT SOURCE.VERSION FROM main.AMOUNTTOTALS AS SOURCE WHERE SOURCE.AMT_ID = AMOUNTTOTALS.AMT_ID) " +
+                                "WHERE AMT_ID IN (" + placeholders + ")", chunkOfAmountIDs)
+                with writeTransaction(connection):
+                    cur.execute("DELETE FROM main.AMOUNTTRACKER WHERE AMT_ID IN (" + placeholders + ")", chunkOfAmountIDs)
+                    cur.execute("DELETE FROM main.AMOUNTTRACKER WHERE ID IN (" + placeholders + ")", chunkOfAmountIDs)
+                noOfMovedAmounts += len(chunkOfAmountIDs)
+            cur.execute("DETACH DATABASE TARGET")
+        connection.close()
+
+    for sourceShard in range(noOfShards, len(paths)):
+        print(paths[sourceShard] + " is no longer a shard, its amounts are moved and it can be removed")
+    print(str(noOfMovedAmounts) + " amounts moved, the DB is sharded over " + str(noOfShards) + " files")
+    return noOfMovedAmounts
+
+
+def main():
+    import settings
+
+    parser = argparse.ArgumentParser(description="Maintenance commands for the AMOUNTTRACKER DB")
+    parser.add_argument("--db", default=settings.DATABASE_PATH, help="Path to the SQLite DB")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("checkQueryPlans", help="Check that every query the endpoints issue uses an index")
+    checkAggregatesCommand = commands.add_parser(
+        "checkAggregates", help="Recompute the per amount totals and report any drift from AMOUNTTOTALS")
+    checkAggregatesCommand.add_argument("--repair", action="store_true", help="Overwrite the drifted totals")
+    commands.add_parser("rebuildRollups", help="Refill the daily spend rollups from the expenses")
+    commands.add_parser("rebuildSearchIndex", help="Rebuild the full text search index of the descriptions")
+    commands.add_parser("enableIncrementalVacuum", help="Turn on auto_vacuum=INCREMENTAL and VACUUM the DB, with the app stopped")
+    compactChangesCommand = commands.add_parser("compactChanges", help="Remove the change log entries older than the retention window")
+    compactChangesCommand.add_argument("--retention-s", type=int, default=settings.CHANGES_RETENTION_S, help="Seconds of changes to keep")
+    reshardCommand = commands.add_parser("reshard", help="Move the amounts to their shards for another no of shards, with the app stopped")
+    reshardCommand.add_argument("--shards", type=int, required=True, help="No of shards to shard the DB over")
+    reshardCommand.add_argument("--from-shards", type=int, default=1, help="No of shards the DB is sharded over now, 1 if its a single file")
+    arguments = parser.parse_args()
+
+    if arguments.command == "checkQueryPlans":
+        sys.exit(1 if checkQueryPlans(arguments.db) else 0)
+    if arguments.command == "checkAggregates":
+        sys.exit(1 if checkAggregates(arguments.db, arguments.repair) and not arguments.repair else 0)
+    if arguments.command == "rebuildRollups":
+        rebuildRollups(arguments.db)
+    if arguments.command == "rebuildSearchIndex":
+        rebuildSearchIndex(arguments.db)
+    if arguments.command == "enableIncrementalVacuum":
+        sys.exit(0 if enableIncrementalVacuum(arguments.db) else 1)
+    if arguments.command == "compactChanges":
+        compactChangeLog(arguments.db, arguments.retention_s)
+    if arguments.command == "reshard":
+        if arguments.shards < 1 or arguments.from_shards < 1:
+            parser.error("the no of shards must be at least 1")
+        reshard(arguments.db, arguments.shards, arguments.from_shards)
+
+
+if __name__ == "__main__":
+    main()
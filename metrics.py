@@ -0,0 +1,273 @@
+import bisect
+import contextvars
+import logging
+import sqlite3
+import threading
+import time
+import settings
+
+
+slowQueryLogger = logging.getLogger("amounttracker.slowqueries")
+
+
+# Request and query metrics, turned on with AMOUNTTRACKER_METRICS
+# MetricsMiddleware records the latency, status and in-flight count of every route
+# TimedConnection counts the queries of every request and the time spent in SQL, and logs the slow ones when AMOUNTTRACKER_SLOW_QUERY_MS is set
+# Neither is installed when turned off, so they cost nothing then
+
+
+latencyBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+queryCountBuckets = (0, 1, 2, 3, 5, 10, 20, 50, 100, 1000)
+
+
+# Prometheus histogram, the count of observations in each bucket and their sum
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    # Lines of the histogram in Prometheus text format, the bucket counts are cumulative
+    def render(self, name, labels):
+        lines = []
+        cumulativeCount = 0
+        for bucket, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulativeCount += count
+            lines.append(name + "_bucket{" + labels + ',le="' + str(bucket) + '"} ' + str(cumulativeCount))
+        lines.append(name + "_sum{" + labels + "} " + repr(float(self.sum)))
+        lines.append(name + "_count{" + labels + "} " + str(cumulativeCount))
+        return lines
+
+
+# SQL done by one request, kept in a context variable so the queries run on the threadpool are added to the request they belong to
+class RequestQueryStats:
+    __slots__ = ("queries", "sqlSeconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.sqlSeconds = 0.0
+
+
+requestQueryStats = contextvars.ContextVar("requestQueryStats", default=None)
+
+
+# All the recorded metrics, keyed by their labels
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.inFlight = {}
+        self.requestsTotal = {}
+        self.requestSeconds = {}
+        self.queriesPerRequest = {}
+        self.sqlSecondsPerRequest = {}
+        self.slowQueries = 0
+
+    def requestStarted(self, route):
+        with self.lock:
+            self.inFlight[route] = self.inFlight.get(route, 0) + 1
+
+    def requestFinished(self, route, method, statusCode, seconds, queryStats):
+        with self.lock:
+            self.inFlight[route] -= 1
+            self.requestsTotal[(route, method, statusCode)] = self.requestsTotal.get((route, method, statusCode), 0) + 1
+            self.requestSeconds.setdefault((route, method), Histogram(latencyBuckets)).observe(seconds)
+            self.queriesPerRequest.setdefault((route, method), Histogram(queryCountBuckets)).observe(queryStats.queries)
+            self.sqlSecondsPerRequest.setdefault((route, method), Histogram(latencyBuckets)).observe(queryStats.sqlSeconds)
+
+    def slowQueryLogged(self):
+        with self.lock:
+            self.slowQueries += 1
+
+    # Every metric in Prometheus text format, the response cache counters included
+    def render(self, cacheStats):
+        lines = []
+        with self.lock:
+            lines.append("# HELP amounttracker_http_requests_in_flight Requests being handled")
+            lines.append("# TYPE amounttracker_http_requests_in_flight gauge")
+            for route, count in sorted(self.inFlight.items()):
+                lines.append('amounttracker_http_requests_in_flight{route="' + route + '"} ' + str(count))
+
+            lines.append("# HELP amounttracker_http_requests_total Requests handled, by status code")
+            lines.append("# TYPE amounttracker_http_requests_total counter")
+            for (route, method, statusCode), count in sorted(self.requestsTotal.items()):
+                lines.append('amounttracker_http_requests_total{route="' + route + '",method="' + method + '",status="' + str(statusCode) + '"} ' + str(count))
+
+            for name, help, histograms in [
+                ("amounttracker_http_request_duration_seconds", "Request latency", self.requestSeconds),
+                ("amounttracker_sql_queries_per_request", "SQL statements run by a request", self.queriesPerRequest),
+                ("amounttracker_sql_seconds_per_request", "Time a request spent in SQL", self.sqlSecondsPerRequest),
+            ]:
+                lines.append("# HELP " + name + " " + help)
+                lines.append("# TYPE " + name + " histogram")
+                for (route, method), histogram in sorted(histograms.items()):
+                    lines.extend(histogram.render(name, 'route="' + route + '",method="' + method + '"'))
+
+            lines.append("# HELP amounttracker_slow_queries_total Queries slower than AMOUNTTRACKER_SLOW_QUERY_MS")
+            lines.append("# TYPE amounttracker_slow_queries_total counter")
+            lines.append("amounttracker_slow_queries_total " + str(self.slowQueries))
+
+        for key in ["hits", "misses", "evictions", "notModified"]:
+            lines.append("# TYPE amounttracker_response_cache_" + key + "_total counter")
+            lines.append("amounttracker_response_cache_" + key + "_total " + str(cacheStats[key]))
+        lines.append("# TYPE amounttracker_response_cache_bytes gauge")
+        lines.append("amounttracker_response_cache_bytes " + str(cacheStats["bytes"]))
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+# ASGI middleware which records every HTTP request
+# Requests are labelled by their route, requests to no route are labelled "unmatched", so the no of labels stays bounded
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+        self.routePaths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # The routes are read on the first request, once they are all added
+        if self.routePaths is None:
+            self.routePaths = {route.path for route in scope["app"].routes}
+        route = scope["path"] if scope["path"] in self.routePaths else "unmatched"
+        statusCode = 500
+
+        async def sendWithStatus(message):
+            nonlocal statusCode
+            if message["type"] == "http.response.start":
+                statusCode = message["status"]
+            await send(message)
+
+        queryStats = RequestQueryStats()
+        contextToken = requestQueryStats.set(queryStats)
+        metrics.requestStarted(route)
+        startTime = time.perf_counter()
+        try:
+            await self.app(scope, receive, sendWithStatus)
+        finally:
+            metrics.requestFinished(route, scope["method"], statusCode, time.perf_counter() - startTime, queryStats)
+            requestQueryStats.reset(contextToken)
+
+
+# Adds the time of a statement to the request it ran in, and logs it if its slow
+def recordQuery(connection, sql, parameters, seconds, explain):
+    queryStats = requestQueryStats.get()
+    if queryStats is not None:
+        queryStats.queries += 1
+        queryStats.sqlSeconds += seconds
+
+    if settings.SLOW_QUERY_MS > 0 and seconds * 1000 >= settings.SLOW_QUERY_MS:
+        metrics.slowQueryLogged()
+        queryPlan = []
+        if explain and sql.split(None, 1)[0].upper() in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH"):
+            try:
+                queryPlan = [row[3] for row in sqlite3.Cursor(connection).execute("EXPLAIN QUERY PLAN " + sql, parameters)]
+            except sqlite3.Error:
+                pass
+        slowQueryLogger.warning("%.1f ms: %s | parameters %r | plan %s", seconds * 1000, sql, parameters, " / ".join(queryPlan) or "-")
+
+
+# Cursor which times its statements, from the execute to the fetch of their rows
+# The time of a statement is recorded once its rows are fetched, by fetchone, fetchall or to the end, or when the next statement is run
+class TimedCursor(sqlite3.Cursor):
+
+    def recordPending(self):
+        pendingQuery = getattr(self, "pendingQuery", None)
+        if pendingQuery is not None:
+            self.pendingQuery = None
+            recordQuery(self.connection, pendingQuery[0], pendingQuery[1], pendingQuery[2], pendingQuery[3])
+
+    def execute(self, sql, parameters=()):
+        self.recordPending()
+        startTime = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.pendingQuery = [sql, parameters, time.perf_counter() - startTime, True]
+
+    def executemany(self, sql, seqOfParameters):
+        self.recordPending()
+        startTime = time.perf_counter()
+        try:
+            return super().executemany(sql, seqOfParameters)
+        finally:
+            self.pendingQuery = [sql, "(many)", time.perf_counter() - startTime, False]
+            self.recordPending()
+
+    # Fetches after the statement is recorded are added to the SQL time of the request only
+    def timeFetch(self, fetch, *arguments):
+        startTime = time.perf_counter()
+        rows = fetch(*arguments)
+        fetchSeconds = time.perf_counter() - startTime
+        pendingQuery = getattr(self, "pendingQuery", None)
+        if pendingQuery is not None:
+            pendingQuery[2] += fetchSeconds
+        else:
+            queryStats = requestQueryStats.get()
+            if queryStats is not None:
+                queryStats.sqlSeconds += fetchSeconds
+        return rows
+
+    def fetchone(self):
+        row = self.timeFetch(super().fetchone)
+        self.recordPending()
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self.timeFetch(super().fetchmany, self.arraysize if size is None else size)
+        if not rows:
+            self.recordPending()
+        return rows
+
+    def fetchall(self):
+        rows = self.timeFetch(super().fetchall)
+        self.recordPending()
+        return rows
+
+    def __next__(self):
+        try:
+            return self.timeFetch(super().__next__)
+        except StopIteration:
+            self.recordPending()
+            raise
+
+    def close(self):
+        self.recordPending()
+        super().close()
+
+    # Records a statement whose rows were not all fetched before the cursor was dropped
+    def __del__(self):
+        try:
+            self.recordPending()
+        except Exception:
+            pass
+
+
+# Connection whose cursors are TimedCursors, its commits are timed too
+class TimedConnection(sqlite3.Connection):
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seqOfParameters):
+        return self.cursor().executemany(sql, seqOfParameters)
+
+    def commit(self):
+        startTime = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            recordQuery(self, "COMMIT", (), time.perf_counter() - startTime, False)
@@ -0,0 +1,346 @@
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+# Every schema change is a migration, which is a function that gets a cursor and changes the schema
+# The schema version of a DB is kept in PRAGMA user_version, which is the number of migrations applied to it
+# Migrations are only ever appended to the migrations list at the bottom, an applied migration is never changed
+
+
+# Version 1
+# Rebuilds AMOUNTTRACKER with ID as the primary key and indexes the columns the endpoints filter on
+# A DB without the AMOUNTTRACKER table, i.e. a new one, gets the table created
+def addPrimaryKeyAndIndexes(cur):
+    queryToCreateTable = """CREATE TABLE AMOUNTTRACKER_NEW(
+ID VARCHAR(50) NOT NULL COLLATE NOCASE PRIMARY KEY,
+AMT_EXP_DESC TEXT NOT NULL COLLATE NOCASE,
+VALUE REAL NOT NULL COLLATE NOCASE,
+TYPE VARCHAR(10) NOT NULL COLLATE NOCASE,
+DATE INTEGER NOT NULL COLLATE NOCASE,
+AMT_ID VARCHAR(50) COLLATE NOCASE
+)"""
+    cur.execute(queryToCreateTable)
+
+    tableCheck = cur.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'AMOUNTTRACKER'").fetchone()
+    if tableCheck is not None:
+        cur.execute("INSERT INTO AMOUNTTRACKER_NEW (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) SELECT ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID FROM AMOUNTTRACKER")
+        cur.execute("DROP TABLE AMOUNTTRACKER")
+
+    cur.execute("ALTER TABLE AMOUNTTRACKER_NEW RENAME TO AMOUNTTRACKER")
+    cur.execute("CREATE INDEX AMOUNTTRACKER_AMT_ID_DATE ON AMOUNTTRACKER (AMT_ID, DATE)")
+    cur.execute("CREATE INDEX AMOUNTTRACKER_TYPE_DATE ON AMOUNTTRACKER (TYPE, DATE)")
+
+
+# Computes the totals of every amount from the expense rows, used to fill AMOUNTTOTALS
+queryToComputeAmountTotals = """SELECT AMOUNT.ID, COALESCE(SUM(EXPENSE.VALUE), 0), COUNT(EXPENSE.ID), MIN(EXPENSE.DATE), MAX(EXPENSE.DATE)
+FROM AMOUNTTRACKER AS AMOUNT LEFT JOIN AMOUNTTRACKER AS EXPENSE ON EXPENSE.AMT_ID = AMOUNT.ID AND EXPENSE.TYPE = 'EXP'
+WHERE AMOUNT.TYPE = 'AMT' GROUP BY AMOUNT.ID"""
+
+
+# Version 2
+# Adds AMOUNTTOTALS, which holds the spent total, the no of expenses and the first and last expense date of every amount
+# The triggers keep it up to date in the same transaction as every insert, update and delete on AMOUNTTRACKER
+# Min and max dates are recomputed with a lookup on the (AMT_ID, DATE) index when an expense is removed or moved
+def addAmountTotals(cur):
+    queryToCreateTable = """CREATE TABLE AMOUNTTOTALS(
+AMT_ID VARCHAR(50) NOT NULL COLLATE NOCASE PRIMARY KEY,
+SPENT REAL NOT NULL DEFAULT 0,
+EXPENSE_COUNT INTEGER NOT NULL DEFAULT 0,
+MIN_DATE INTEGER,
+MAX_DATE INTEGER
+)"""
+    cur.execute(queryToCreateTable)
+
+    cur.execute("""CREATE TRIGGER AMOUNTTOTALS_ADD_AMOUNT AFTER INSERT ON AMOUNTTRACKER WHEN NEW.TYPE = 'AMT'
+BEGIN
+INSERT INTO AMOUNTTOTALS (AMT_ID) VALUES (NEW.ID);
+END""")
+
+    cur.execute("""CREATE TRIGGER AMOUNTTOTALS_DELETE_AMOUNT AFTER DELETE ON AMOUNTTRACKER WHEN OLD.TYPE = 'AMT'
+BEGIN
+DELETE FROM AMOUNTTOTALS WHERE AMT_ID = OLD.ID;
+END""")
+
+    cur.execute("""CREATE TRIGGER AMOUNTTOTALS_ADD_EXPENSE AFTER INSERT ON AMOUNTTRACKER WHEN NEW.TYPE = 'EXP'
+BEGIN
+UPDATE AMOUNTTOTALS SET SPENT = SPENT + NEW.VALUE, EXPENSE_COUNT = EXPENSE_COUNT + 1,
+MIN_DATE = MIN(COALESCE(MIN_DATE, NEW.DATE), NEW.DATE), MAX_DATE = MAX(COALESCE(MAX_DATE, NEW.DATE), NEW.DATE)
+WHERE AMT_ID = NEW.AMT_ID;
+END""")
+
+    # When the last expense is removed the total is reset to 0, so no float rounding error is left behind
+    cur.execute("""CREATE TRIGGER AMOUNTTOTALS_DELETE_EXPENSE AFTER DELETE ON AMOUNTTRACKER WHEN OLD.TYPE = 'EXP'
+BEGIN
+UPDATE AMOUNTTOTALS SET SPENT = CASE WHEN EXPENSE_COUNT = 1 THEN 0 ELSE SPENT - OLD.VALUE END, EXPENSE_COUNT = EXPENSE_COUNT - 1,
+MIN_DATE = (SELECT MIN(DATE) FROM AMOUNTTRACKER WHERE AMT_ID = OLD.AMT_ID), MAX_DATE = (SELECT MAX(DATE) FROM AMOUNTTRACKER WHERE AMT_ID = OLD.AMT_ID)
+WHERE AMT_ID = OLD.AMT_ID;
+END""")
+
+    cur.execute("""CREATE TRIGGER AMOUNTTOTALS_UPDATE_EXPENSE AFTER UPDATE OF VALUE, DATE, AMT_ID ON AMOUNTTRACKER WHEN OLD.TYPE = 'EXP'
+BEGIN
+UPDATE AMOUNTTOTALS SET SPENT = CASE WHEN EXPENSE_COUNT = 1 THEN 0 ELSE SPENT - OLD.VALUE END, EXPENSE_COUNT = EXPENSE_COUNT - 1
+WHERE AMT_ID = OLD.AMT_ID;
+UPDATE AMOUNTTOTALS SET SPENT = SPENT + NEW.VALUE, EXPENSE_COUNT = EXPENSE_COUNT + 1
+WHERE AMT_ID = NEW.AMT_ID;
+UPDATE AMOUNTTOTALS SET MIN_DATE = (SELECT MIN(DATE) FROM AMOUNTTRACKER WHERE AMT_ID = AMOUNTTOTALS.AMT_ID),
+MAX_DATE = (SELECT MAX(DATE) FROM AMOUNTTRACKER WHERE AMT_ID = AMOUNTTOTALS.AMT_ID)
+WHERE AMT_ID IN (OLD.AMT_ID, NEW.AMT_ID);
+END""")
+
+    cur.execute("INSERT INTO AMOUNTTOTALS (AMT_ID, SPENT, EXPENSE_COUNT, MIN_DATE, MAX_DATE) " + queryToComputeAmountTotals)
+
+
+# Version 3
+# Extends the (TYPE, DATE) index with ID, so amounts can be paged in (DATE, ID) order straight from the index
+def addIDToTypeDateIndex(cur):
+    cur.execute("DROP INDEX AMOUNTTRACKER_TYPE_DATE")
+    cur.execute("CREATE INDEX AMOUNTTRACKER_TYPE_DATE_ID ON AMOUNTTRACKER (TYPE, DATE, ID)")
+
+
+# Version 4
+# Adds version counters, the VERSION of every amount in AMOUNTTOTALS and one global VERSION in DATAVERSION
+# Every insert, update and delete on AMOUNTTRACKER bumps the global version and the version of the amount the row belongs to
+# The GET endpoints build their ETags and response cache keys from these, so a version must never go back to a value it had before
+def addVersionCounters(cur):
+    cur.execute("ALTER TABLE AMOUNTTOTALS ADD COLUMN VERSION INTEGER NOT NULL DEFAULT 0")
+    cur.execute("CREATE TABLE DATAVERSION(ID INTEGER NOT NULL PRIMARY KEY CHECK (ID = 0), VERSION INTEGER NOT NULL)")
+    cur.execute("INSERT INTO DATAVERSION (ID, VERSION) VALUES (0, 0)")
+
+    # An amount row has its own ID as the amount, an expense row has AMT_ID
+    cur.execute("""CREATE TRIGGER VERSION_INSERT AFTER INSERT ON AMOUNTTRACKER
+BEGIN
+UPDATE AMOUNTTOTALS SET VERSION = VERSION + 1 WHERE AMT_ID = COALESCE(NEW.AMT_ID, NEW.ID);
+UPDATE DATAVERSION SET VERSION = VERSION + 1;
+END""")
+
+    cur.execute("""CREATE TRIGGER VERSION_UPDATE AFTER UPDATE ON AMOUNTTRACKER
+BEGIN
+UPDATE AMOUNTTOTALS SET VERSION = VERSION + 1 WHERE AMT_ID IN (COALESCE(OLD.AMT_ID, OLD.ID), COALESCE(NEW.AMT_ID, NEW.ID));
+UPDATE DATAVERSION SET VERSION = VERSION + 1;
+END""")
+
+    cur.execute("""CREATE TRIGGER VERSION_DELETE AFTER DELETE ON AMOUNTTRACKER
+BEGIN
+UPDATE AMOUNTTOTALS SET VERSION = VERSION + 1 WHERE AMT_ID = COALESCE(OLD.AMT_ID, OLD.ID);
+UPDATE DATAVERSION SET VERSION = VERSION + 1;
+END""")
+
+
+# Refills the spend rollups from the expense rows, used to fill them in the first place and by the rebuildRollups maintenance command
+def rebuildSpendRollups(cur):
+    cur.execute("DELETE FROM SPENDROLLUP")
+    cur.execute("DELETE FROM SPENDBYDESCRIPTION")
+    cur.execute("""INSERT INTO SPENDROLLUP (DAY, AMT_ID, DESCRIPTION, SPENT, EXPENSE_COUNT)
+SELECT DATE, AMT_ID, AMT_EXP_DESC, SUM(VALUE), COUNT(*) FROM AMOUNTTRACKER WHERE TYPE = 'EXP' GROUP BY DATE, AMT_ID, AMT_EXP_DESC""")
+    cur.execute("""INSERT INTO SPENDBYDESCRIPTION (DAY, DESCRIPTION, SPENT, EXPENSE_COUNT)
+SELECT DAY, DESCRIPTION, SUM(SPENT), SUM(EXPENSE_COUNT) FROM SPENDROLLUP GROUP BY DAY, DESCRIPTION""")
+
+
+# Version 5
+# Adds the daily spend rollups, which /analytics/spend is served from
+# SPENDROLLUP holds the spent total and no of expenses of every day, amount and description, SPENDBYDESCRIPTION the same for every day and description across all the amounts
+# An expense's DATE is the midnight of its day, so its the day of the rollups as is
+# The triggers keep them up to date in the same transaction as every insert, update and delete of an expense, a row whose count drops to 0 is removed
+def addSpendRollups(cur):
+    cur.execute("""CREATE TABLE SPENDROLLUP(
+DAY INTEGER NOT NULL,
+AMT_ID VARCHAR(50) NOT NULL COLLATE NOCASE,
+DESCRIPTION TEXT NOT NULL COLLATE NOCASE,
+SPENT REAL NOT NULL,
+EXPENSE_COUNT INTEGER NOT NULL,
+PRIMARY KEY (DAY, AMT_ID, DESCRIPTION)
+) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX SPENDROLLUP_AMT_ID_DAY ON SPENDROLLUP (AMT_ID, DAY)")
+    cur.execute("""CREATE TABLE SPENDBYDESCRIPTION(
+DAY INTEGER NOT NULL,
+DESCRIPTION TEXT NOT NULL COLLATE NOCASE,
+SPENT REAL NOT NULL,
+EXPENSE_COUNT INTEGER NOT NULL,
+PRIMARY KEY (DAY, DESCRIPTION)
+) WITHOUT ROWID""")
+
+    queryToAddNewExpense = """INSERT INTO SPENDROLLUP (DAY, AMT_ID, DESCRIPTION, SPENT, EXPENSE_COUNT) VALUES (NEW.DATE, NEW.AMT_ID, NEW.AMT_EXP_DESC, NEW.VALUE, 1)
+ON CONFLICT (DAY, AMT_ID, DESCRIPTION) DO UPDATE SET SPENT = SPENT + excluded.SPENT, EXPENSE_COUNT = EXPENSE_COUNT + 1;
+INSERT INTO SPENDBYDESCRIPTION (DAY, DESCRIPTION, SPENT, EXPENSE_COUNT) VALUES (NEW.DATE, NEW.AMT_EXP_DESC, NEW.VALUE, 1)
+ON CONFLICT (DAY, DESCRIPTION) DO UPDATE SET SPENT = SPENT + excluded.SPENT, EXPENSE_COUNT = EXPENSE_COUNT + 1;"""
+    queryToRemoveOldExpense = """UPDATE SPENDROLLUP SET SPENT = SPENT - OLD.VALUE, EXPENSE_COUNT = EXPENSE_COUNT - 1
+WHERE DAY = OLD.DATE AND AMT_ID = OLD.AMT_ID AND DESCRIPTION = OLD.AMT_EXP_DESC;
+DELETE FROM SPENDROLLUP WHERE DAY = OLD.DATE AND AMT_ID = OLD.AMT_ID AND DESCRIPTION = OLD.AMT_EXP_DESC AND EXPENSE_COUNT = 0;
+UPDATE SPENDBYDESCRIPTION SET SPENT = SPENT - OLD.VALUE, EXPENSE_COUNT = EXPENSE_COUNT - 1 WHERE DAY = OLD.DATE AND DESCRIPTION = OLD.AMT_EXP_DESC;
+DELETE FROM SPENDBYDESCRIPTION WHERE DAY = OLD.DATE AND DESCRIPTION = OLD.AMT_EXP_DESC AND EXPENSE_COUNT = 0;"""
+
+    cur.execute("CREATE TRIGGER SPENDROLLUP_ADD_EXPENSE AFTER INSERT ON AMOUNTTRACKER WHEN NEW.TYPE = 'EXP'\nBEGIN\n" + queryToAddNewExpense + "\nEND")
+    cur.execute("CREATE TRIGGER SPENDROLLUP_DELETE_EXPENSE AFTER DELETE ON AMOUNTTRACKER WHEN OLD.TYPE = 'EXP'\nBEGIN\n" + queryToRemoveOldExpense + "\nEND")
+    cur.execute("CREATE TRIGGER SPENDROLLUP_UPDATE_EXPENSE AFTER UPDATE OF VALUE, DATE, AMT_ID, AMT_EXP_DESC ON AMOUNTTRACKER WHEN OLD.TYPE = 'EXP'\nBEGIN\n" +
+                queryToRemoveOldExpense + "\n" + queryToAddNewExpense + "\nEND")
+
+    rebuildSpendRollups(cur)
+
+
+# Version 6
+# Adds AMOUNTSEARCH, an FTS5 index of the descriptions, which /search is served from
+# Its an external content table over the rowids of AMOUNTTRACKER, so the descriptions are not stored twice, and the triggers keep it in sync
+# The descriptions are stored sanitized, so the sanitized text is what is indexed
+# The prefix indexes make prefix queries of 2 and 3 characters, the most common while typing, as fast as whole words
+# A VACUUM can renumber the rowids of AMOUNTTRACKER, as ID is not an INTEGER PRIMARY KEY, so the index must be rebuilt after one
+def addDescriptionSearch(cur):
+    cur.execute("""CREATE VIRTUAL TABLE AMOUNTSEARCH USING fts5(AMT_EXP_DESC, content = 'AMOUNTTRACKER', content_rowid = 'rowid',
+tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""")
+
+    cur.execute("""CREATE TRIGGER AMOUNTSEARCH_INSERT AFTER INSERT ON AMOUNTTRACKER
+BEGIN
+INSERT INTO AMOUNTSEARCH (rowid, AMT_EXP_DESC) VALUES (NEW.rowid, NEW.AMT_EXP_DESC);
+END""")
+
+    cur.execute("""CREATE TRIGGER AMOUNTSEARCH_DELETE AFTER DELETE ON AMOUNTTRACKER
+BEGIN
+INSERT INTO AMOUNTSEARCH (AMOUNTSEARCH, rowid, AMT_EXP_DESC) VALUES ('delete', OLD.rowid, OLD.AMT_EXP_DESC);
+END""")
+
+    cur.execute("""CREATE TRIGGER AMOUNTSEARCH_UPDATE AFTER UPDATE OF AMT_EXP_DESC ON AMOUNTTRACKER
+BEGIN
+INSERT INTO AMOUNTSEARCH (AMOUNTSEARCH, rowid, AMT_EXP_DESC) VALUES ('delete', OLD.rowid, OLD.AMT_EXP_DESC);
+INSERT INTO AMOUNTSEARCH (rowid, AMT_EXP_DESC) VALUES (NEW.rowid, NEW.AMT_EXP_DESC);
+END""")
+
+    rebuildDescriptionSearch(cur)
+
+
+# Rebuilds the search index from the descriptions in AMOUNTTRACKER in one pass, used to fill it in the first place and by the rebuildSearchIndex maintenance command
+def rebuildDescriptionSearch(cur):
+    cur.execute("INSERT INTO AMOUNTSEARCH (AMOUNTSEARCH) VALUES ('rebuild')")
+
+
+# Version 7
+# Extends the (AMT_ID, DATE) index with ID, so the expenses of an amount can be paged in (DATE, ID) order straight from the index
+def addIDToAmountIDDateIndex(cur):
+    cur.execute("DROP INDEX AMOUNTTRACKER_AMT_ID_DATE")
+    cur.execute("CREATE INDEX AMOUNTTRACKER_AMT_ID_DATE_ID ON AMOUNTTRACKER (AMT_ID, DATE, ID)")
+
+
+# Version 8
+# Adds AMOUNTTRACKERARCHIVE, where /deleteBatch moves the deleted rows to when asked to archive them, with when they were archived
+# It has no triggers, so archived rows are not in any of the totals, rollups or the search index
+def addArchive(cur):
+    queryToCreateArchive = """CREATE TABLE AMOUNTTRACKERARCHIVE(
+ID VARCHAR(50) NOT NULL COLLATE NOCASE PRIMARY KEY,
+AMT_EXP_DESC TEXT NOT NULL COLLATE NOCASE,
+VALUE REAL NOT NULL COLLATE NOCASE,
+TYPE VARCHAR(10) NOT NULL COLLATE NOCASE,
+DATE INTEGER NOT NULL COLLATE NOCASE,
+AMT_ID VARCHAR(50) COLLATE NOCASE,
+ARCHIVED_AT INTEGER NOT NULL
+)"""
+    cur.execute(queryToCreateArchive)
+
+
+# Version 9
+# Adds AMOUNTCHANGES, the log of changed rows /changes is served from, with a SEQ which only goes up
+# The log is compact, it keeps only the latest change of each row, as a row changed again is logged again under a new SEQ and its older entry removed
+# A deleted row leaves a tombstone, DELETED = 1, with its type and amount, so clients know what to remove
+# A change to an expense also logs its amount, as the no of expenses and spent total the clients show with the amount change with it
+# Entries older than the retention window are compacted away, and CHANGES_COMPACTED_SEQ in DATAVERSION is the last SEQ compacted,
+# a client which has not seen the changes up to it has to reload
+# The rows already in the DB are not logged, SEQ starts after 1 and 1 is marked compacted, so clients reload once and then follow the log
+def addChangeLog(cur):
+    queryToCreateChangeLog = """CREATE TABLE AMOUNTCHANGES(
+SEQ INTEGER PRIMARY KEY AUTOINCREMENT,
+ID VARCHAR(50) NOT NULL COLLATE NOCASE UNIQUE,
+TYPE VARCHAR(10) NOT NULL COLLATE NOCASE,
+AMT_ID VARCHAR(50) COLLATE NOCASE,
+DELETED INTEGER NOT NULL,
+CHANGED_AT INTEGER NOT NULL
+)"""
+    cur.execute(queryToCreateChangeLog)
+    cur.execute("ALTER TABLE DATAVERSION ADD COLUMN CHANGES_COMPACTED_SEQ INTEGER NOT NULL DEFAULT 0")
+    if cur.execute("SELECT 1 FROM AMOUNTTRACKER LIMIT 1").fetchone() is not None:
+        cur.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('AMOUNTCHANGES', 1)")
+        cur.execute("UPDATE DATAVERSION SET CHANGES_COMPACTED_SEQ = 1")
+
+    queryToLogRow = """DELETE FROM AMOUNTCHANGES WHERE ID = {row}.ID;
+INSERT INTO AMOUNTCHANGES (ID, TYPE, AMT_ID, DELETED, CHANGED_AT) VALUES ({row}.ID, {row}.TYPE, {row}.AMT_ID, {deleted}, CAST(strftime('%s', 'now') AS INTEGER));"""
+    # The amount is only logged if its there, so the tombstone of a deleted amount is kept
+    queryToLogAmountOfExpense = """DELETE FROM AMOUNTCHANGES WHERE ID = (SELECT ID FROM AMOUNTTRACKER WHERE ID = {row}.AMT_ID AND TYPE = 'AMT');
+INSERT INTO AMOUNTCHANGES (ID, TYPE, AMT_ID, DELETED, CHANGED_AT) SELECT ID, TYPE, AMT_ID, 0, CAST(strftime('%s', 'now') AS INTEGER) FROM AMOUNTTRACKER WHERE ID = {row}.AMT_ID AND TYPE = 'AMT';"""
+
+    for event, row, deleted in [("INSERT", "NEW", 0), ("UPDATE", "NEW", 0), ("DELETE", "OLD", 1)]:
+        cur.execute("CREATE TRIGGER AMOUNTCHANGES_" + event + " AFTER " + event + " ON AMOUNTTRACKER\nBEGIN\n" +
+                    queryToLogRow.format(row=row, deleted=deleted) + "\nEND")
+        cur.execute("CREATE TRIGGER AMOUNTCHANGES_" + event + "_EXPENSE AFTER " + event + " ON AMOUNTTRACKER WHEN " + row + ".TYPE = 'EXP'\nBEGIN\n" +
+                    queryToLogAmountOfExpense.format(row=row) + "\nEND")
+
+
+# Rebuilds a table with the given REAL columns as INTEGER cents, converting their values, 12.5 to 1250
+# SQLite cannot change the type of a column, so the table is copied to one created from its own schema with the new types, which then replaces it
+# Rowids are copied as they are, as the search index refers to the rows of AMOUNTTRACKER by rowid, and the indexes of the table are created again
+# The triggers which refer to the table must be dropped before and created again after, as a table a trigger refers to cannot be dropped and renamed
+def rebuildWithCents(cur, tableName, centColumns):
+    queryToCreateTable = cur.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", [tableName]).fetchone()[0]
+    queriesToCreateIndexes = [row[0] for row in cur.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", [tableName])]
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(" + tableName + ")")]
+
+    queryToCreateTable = re.sub(r'^CREATE TABLE "?' + tableName + '"?', "CREATE TABLE " + tableName + "_NEW", queryToCreateTable)
+    for centColumn in centColumns:
+        queryToCreateTable = re.sub(r"\b" + centColumn + r" REAL\b", centColumn + " INTEGER", queryToCreateTable)
+    copiedColumns = ["CAST(ROUND(" + column + " * 100) AS INTEGER)" if column in centColumns else column for column in columns]
+    rowidColumn = [] if "WITHOUT ROWID" in queryToCreateTable.upper() else ["rowid"]
+
+    cur.execute(queryToCreateTable)
+    cur.execute("INSERT INTO " + tableName + "_NEW (" + ", ".join(rowidColumn + columns) + ") SELECT " + ", ".join(rowidColumn + copiedColumns) + " FROM " + tableName)
+    cur.execute("DROP TABLE " + tableName)
+    cur.execute("ALTER TABLE " + tableName + "_NEW RENAME TO " + tableName)
+    for queryToCreateIndex in queriesToCreateIndexes:
+        cur.execute(queryToCreateIndex)
+
+
+# Version 10
+# Stores the values as integer cents, VALUE of the amounts and expenses and the SPENT totals, so the budget checks and totals are exact and summed up by SQLite
+# The API still takes and returns the values as numbers with decimals, they are converted to and from cents at the endpoints
+# Every table with a value is rebuilt with INTEGER columns, with all the triggers dropped while they are and created again as they were
+# The spent totals and rollups are recomputed from the converted expenses, so they hold no float drift, and every version is bumped,
+# as the totals the endpoints return change by the drift removed
+def convertValuesToCents(cur):
+    queriesToCreateTriggers = cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for triggerName, _ in queriesToCreateTriggers:
+        cur.execute("DROP TRIGGER " + triggerName)
+
+    for tableName, centColumns in [("AMOUNTTRACKER", ["VALUE"]), ("AMOUNTTRACKERARCHIVE", ["VALUE"]), ("AMOUNTTOTALS", ["SPENT"]),
+                                   ("SPENDROLLUP", ["SPENT"]), ("SPENDBYDESCRIPTION", ["SPENT"])]:
+        rebuildWithCents(cur, tableName, centColumns)
+
+    cur.execute("UPDATE AMOUNTTOTALS SET SPENT = COALESCE((SELECT SUM(VALUE) FROM AMOUNTTRACKER WHERE AMT_ID = AMOUNTTOTALS.AMT_ID), 0), VERSION = VERSION + 1")
+    rebuildSpendRollups(cur)
+    cur.execute("UPDATE DATAVERSION SET VERSION = VERSION + 1")
+
+    for _, queryToCreateTrigger in queriesToCreateTriggers:
+        cur.execute(queryToCreateTrigger)
+
+
+migrations = [addPrimaryKeyAndIndexes, addAmountTotals, addIDToTypeDateIndex, addVersionCounters, addSpendRollups, addDescriptionSearch,
+              addIDToAmountIDDateIndex, addArchive, addChangeLog, convertValuesToCents]
+
+
+# Brings the DB up to the latest schema version, in place
+# Each migration runs in its own transaction together with the version bump, so a failed migration leaves the DB at the previous version
+# BEGIN IMMEDIATE takes the write lock before the version is read, so when several workers start together only one of them migrates
+def runMigrations(connection):
+    cur = connection.cursor()
+    for version in range(len(migrations)):
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            currentVersion = cur.execute("PRAGMA user_version").fetchone()[0]
+            if currentVersion > version:
+                connection.rollback()
+                continue
+
+            logger.info("Migrating the DB to version %d", version + 1)
+            migrations[version](cur)
+            cur.execute("PRAGMA user_version = " + str(version + 1))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
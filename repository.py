@@ -0,0 +1,1120 @@
+import bisect
+import heapq
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from fastapi import status
+import settings
+import shards
+from database import openConnection, readTransaction, writeTransaction
+from datecodec import civilFromDays, utcOffsetSeconds
+from helpers import generateID, convertDateToEpoch, convertEpochToDate, convertCentsToValue, decodeCursor
+from shards import shardOf, shardConnection, shardSnapshots, fanOutSnapshots, findShard, dateIDOrder, mergeShardRows, sumShardRows
+from writer import runWrite
+
+
+logger = logging.getLogger(__name__)
+# Writes of the memory repository dropped after failing MEMORY_FLUSH_MAX_ATTEMPTS times, each with its SQL function and arguments, to apply by hand
+droppedWriteLogger = logging.getLogger("amounttracker.droppedwrites")
+
+
+# Storage of the amounts and expenses behind the endpoints, picked with AMOUNTTRACKER_REPOSITORY
+# SQLiteRepository reads and writes the DB on every request, MemoryRepository serves them from a copy of the DB kept in memory
+# and writes them back to the DB behind the requests
+# Both take the same arguments and return the same rows, values in cents and dates as epochs, the endpoints format them
+# Their writes return the result of each write with its statusCode, like the results of the batch endpoints
+# The rollups, the search index and the change log are kept by the triggers of the DB, so both read those from the DB
+
+
+# Builds the WHERE clauses and ORDER BY of a query over the amounts, aliased as AMOUNT
+# The amounts are ordered by (DATE, ID), which the (TYPE, DATE, ID) index gives without sorting
+# The optional date range and the (DATE, ID) of the last row of the previous page narrow the range read from the index
+# Returns the list of WHERE clauses, their values and the ORDER BY
+def amountRangeClauses(sort, dateFrom, dateTo, cursor):
+    whereClauses = ["AMOUNT.TYPE = 'AMT'"]
+    values = []
+    if dateFrom is not None:
+        whereClauses.append("AMOUNT.DATE >= ?")
+        values.append(convertDateToEpoch(dateFrom))
+    if dateTo is not None:
+        whereClauses.append("AMOUNT.DATE <= ?")
+        values.append(convertDateToEpoch(dateTo))
+    if cursor is not None:
+        whereClauses.append("(AMOUNT.DATE, AMOUNT.ID) " + (">" if sort == "asc" else "<") + " (?, ?)")
+        values.extend(decodeCursor(cursor))
+    orderBy = " ORDER BY AMOUNT.DATE ASC, AMOUNT.ID ASC" if sort == "asc" else " ORDER BY AMOUNT.DATE DESC, AMOUNT.ID DESC"
+    return whereClauses, values, orderBy
+
+
+# Reads the version of the data of one shard
+def readShardVersion(connection):
+    return connection.execute("SELECT VERSION FROM DATAVERSION WHERE ID = 0").fetchone()[0]
+
+
+# Global version of the data from the versions of the shards, which every write bumps
+# When sharded its the versions of all the shards, joined with dots, so a write to any shard changes it
+def joinShardVersions(shardVersions):
+    return shardVersions[0] if len(shardVersions) == 1 else ".".join(str(shardVersion) for shardVersion in shardVersions)
+
+
+# SQL expression of the bucket of an expense, for each bucket of the chart
+# Dates are bucketed with SQLite's date functions on the date shifted to the UTC offset the dates are in, weeks start on Monday
+chartBucketExpressions = {
+    "day": "date(DATE + ?, 'unixepoch')",
+    "week": "date(DATE + ?, 'unixepoch', 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m', DATE + ?, 'unixepoch')",
+    "description": "AMT_EXP_DESC",
+}
+
+# SQL expression of the period of a rollup DAY, for each granularity of the spend
+# Days are grouped by DAY as is, the longer periods with SQLite's date functions on the day shifted to the UTC offset the dates are in, weeks start on Monday
+spendPeriodExpressions = {
+    "day": "DAY",
+    "week": "date(DAY + ?, 'unixepoch', 'weekday 0', '-6 days')",
+    "month": "strftime('%Y-%m', DAY + ?, 'unixepoch')",
+    "year": "strftime('%Y', DAY + ?, 'unixepoch')",
+}
+
+
+# Results of the writes, the same for both repositories
+
+def amountNotFound(amountID):
+    return {"statusCode": status.HTTP_404_NOT_FOUND, "status": "No Amount with the ID " + amountID + " exists. Please recheck"}
+
+
+def expenseNotFound(expenseID):
+    return {"statusCode": status.HTTP_404_NOT_FOUND, "status": "No Expense with the ID " + expenseID + " exists. Please recheck"}
+
+
+# Checks an expense to be added against its amount, the expense can not be dated before the amount or take the spent total over the amount
+# Returns the rejection, or None if the expense can be added
+def checkNewExpense(amountID, amountDate, amountValue, summedUpAmount, expenseValue, expenseDate, inputDate):
+    if amountDate > expenseDate:
+        return {"statusCode": status.HTTP_403_FORBIDDEN, "amountID": amountID, "status": "Expense date of " +
+                inputDate + " cannot be earlier than amount date of " + convertEpochToDate(amountDate)}
+    if summedUpAmount + expenseValue > amountValue:
+        return {"statusCode": status.HTTP_403_FORBIDDEN, "amountID": amountID,
+                "status": "Can only add expense of " + str(convertCentsToValue(amountValue - summedUpAmount))}
+    return None
+
+
+# Checks the update of an amount, it can not be updated to less than is spent, or dated after its earliest expense
+# Returns the rejection, or None if the amount can be updated
+def checkAmountUpdate(amountValue, amountDate, summedUpAmount, earliestExpenseDate):
+    if summedUpAmount > amountValue:
+        return {"statusCode": status.HTTP_403_FORBIDDEN, "status": "Total expense for this amount is " + str(convertCentsToValue(summedUpAmount)) +
+                ". Cannot update the amount to anything below."}
+    if earliestExpenseDate is not None and amountDate > earliestExpenseDate:
+        return {"statusCode": status.HTTP_403_FORBIDDEN, "status": "Date cannot be updated as there is an expense which is older than the provided date."}
+    return None
+
+
+# Checks the update of an expense against its amount, summedUpAmount being the spent total without the expense
+# Returns the rejection, or None if the expense can be updated
+def checkExpenseUpdate(expenseValue, expenseDate, amountValue, amountDate, summedUpAmount):
+    if summedUpAmount + expenseValue > amountValue:
+        return {"statusCode": status.HTTP_403_FORBIDDEN, "status": "Can only update expense to " + str(convertCentsToValue(amountValue - summedUpAmount))}
+    if expenseDate < amountDate:
+        return {"statusCode": status.HTTP_403_FORBIDDEN, "status": "Date cannot be updated as provided date is older than amount date."}
+    return None
+
+
+# The SQL of the writes, run by SQLiteRepository in the requests and by MemoryRepository when it writes back
+
+# Inserts amounts, each as (ID, description, value, date)
+def insertAmountRows(cur, valuesToAddAmounts):
+    queryToAddAnAmount = "INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE) Values (?, ?, ?, 'AMT', ?)"
+    cur.executemany(queryToAddAnAmount, valuesToAddAmounts)
+
+
+# Inserts expenses, each as (ID, description, value, date, amount ID)
+def insertExpenseRows(cur, valuesToAddExpenses):
+    queryToAddAnExpense = "INSERT INTO AMOUNTTRACKER (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID) Values (?, ?, ?, 'EXP', ?, ?)"
+    cur.executemany(queryToAddAnExpense, valuesToAddExpenses)
+
+
+def updateAmountRow(cur, amountID, description, value, date):
+    queryToUpdateAnAmount = "UPDATE AMOUNTTRACKER SET AMT_EXP_DESC = ?, VALUE = ?, DATE = ? WHERE ID = ?"
+    cur.execute(queryToUpdateAnAmount, (description, value, date, amountID))
+
+
+def updateExpenseRow(cur, expenseID, description, value, date):
+    queryToUpdateAnExpense = "UPDATE AMOUNTTRACKER SET AMT_EXP_DESC = ?, VALUE = ?, DATE = ? WHERE ID = ?"
+    cur.execute(queryToUpdateAnExpense, (description, value, date, expenseID))
+
+
+# Deletes an amount and its expenses, by the AMT_ID and ID indexes, one at a time
+def deleteAmountRows(cur, amountID):
+    cur.execute("DELETE FROM AMOUNTTRACKER WHERE AMT_ID = ?", [amountID])
+    cur.execute("DELETE FROM AMOUNTTRACKER WHERE ID = ?", [amountID])
+
+
+def deleteExpenseRow(cur, expenseID):
+    cur.execute("DELETE FROM AMOUNTTRACKER WHERE ID = ?", [expenseID])
+
+
+def deleteAmountExpenseRows(cur, amountID):
+    cur.execute("DELETE FROM AMOUNTTRACKER WHERE AMT_ID = ?", [amountID])
+
+
+# Deletes the rows with the given IDs, an amount together with all its expenses
+# With archive, the rows are first copied to AMOUNTTRACKERARCHIVE, stamped with archivedAt
+# The expenses and the rows are deleted by the AMT_ID and ID indexes, one at a time
+# The unary + on TYPE stops SQLite from counting the amounts by the TYPE index, which would read every amount, instead of looking up the IDs
+# Returns the no of amounts and expenses deleted
+def deleteRows(cur, IDs, archive, archivedAt):
+    placeholders = ", ".join("?" * len(IDs))
+    noOfAmounts = cur.execute("SELECT COUNT(*) FROM AMOUNTTRACKER WHERE ID IN (" + placeholders + ") AND +TYPE = 'AMT'", IDs).fetchone()[0]
+    noOfRows = 0
+    for whereClause in ["AMT_ID IN (" + placeholders + ")", "ID IN (" + placeholders + ")"]:
+        if archive:
+            queryToArchiveRows = "INSERT INTO AMOUNTTRACKERARCHIVE (ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID, ARCHIVED_AT) " + \
+                "SELECT ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID, ? FROM AMOUNTTRACKER WHERE " + whereClause
+            cur.execute(queryToArchiveRows, [archivedAt] + IDs)
+        noOfRows += cur.execute("DELETE FROM AMOUNTTRACKER WHERE " + whereClause, IDs).rowcount
+    return noOfAmounts, noOfRows - noOfAmounts
+
+
+# Reads of one amount and its expenses from its shard, all in one read transaction
+class SQLiteAmountReader:
+
+    def __init__(self, cur, amountID):
+        self.cur = cur
+        self.amountID = amountID
+
+    # Gets the version, value, spent total and no of expenses of the amount, from AMOUNTTOTALS, or None if there is no amount by the ID
+    def totals(self):
+        queryToGetTotalDetails = "SELECT AMOUNTTOTALS.VERSION, AMOUNT.VALUE, AMOUNTTOTALS.SPENT, AMOUNTTOTALS.EXPENSE_COUNT FROM AMOUNTTOTALS " + \
+            "JOIN AMOUNTTRACKER AS AMOUNT ON AMOUNT.ID = AMOUNTTOTALS.AMT_ID WHERE AMOUNTTOTALS.AMT_ID = ?"
+        return self.cur.execute(queryToGetTotalDetails, [self.amountID]).fetchone()
+
+    # Gets the ID, Description, Value and Date of the expenses, in (DATE, ID) order from the (AMT_ID, DATE, ID) index
+    # The (DATE, ID) of the last row of the previous page narrows the range read from the index
+    def expenses(self, sort, cursor, limit):
+        queryToGetAmtDetails = "SELECT ID, AMT_EXP_DESC, VALUE, DATE FROM AMOUNTTRACKER WHERE AMT_ID = ?"
+        valuesToGetAmtDetails = [self.amountID]
+        if cursor is not None:
+            queryToGetAmtDetails += " AND (DATE, ID) " + (">" if sort == "asc" else "<") + " (?, ?)"
+            valuesToGetAmtDetails.extend(decodeCursor(cursor))
+        queryToGetAmtDetails += " ORDER BY DATE ASC, ID ASC" if sort == "asc" else " ORDER BY DATE DESC, ID DESC"
+        if limit is not None:
+            queryToGetAmtDetails += " LIMIT ?"
+            valuesToGetAmtDetails.append(limit)
+        return self.cur.execute(queryToGetAmtDetails, valuesToGetAmtDetails).fetchall()
+
+    # Gets the description, value, spent total and version of the amount, or None if there is no amount by the ID
+    def details(self):
+        queryToGetAmtDetails = "SELECT AMOUNT.AMT_EXP_DESC, AMOUNT.VALUE, AMOUNTTOTALS.SPENT, AMOUNTTOTALS.VERSION FROM AMOUNTTRACKER AS AMOUNT " + \
+            "JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = AMOUNT.ID WHERE AMOUNT.ID = ? AND AMOUNT.TYPE = 'AMT'"
+        return self.cur.execute(queryToGetAmtDetails, [self.amountID]).fetchone()
+
+    # Gets the slices of the chart of the amount, largest first, each as its key, date, value and no of expenses
+    # Without a bucket every expense is a slice, keyed by its description and with its date, else the expenses are summed up by bucket in SQL, without a date
+    # Slices of the same value are in (DATE, ID) or key order, so the same slices are kept whichever repository reads them
+    def chartSlices(self, bucket):
+        if bucket is None:
+            queryToGetSlices = "SELECT AMT_EXP_DESC, DATE, VALUE, 1 FROM AMOUNTTRACKER WHERE AMT_ID = ? ORDER BY VALUE DESC, DATE, ID"
+            return self.cur.execute(queryToGetSlices, [self.amountID]).fetchall()
+        queryToGetSlices = "SELECT " + chartBucketExpressions[bucket] + ", NULL, SUM(VALUE), COUNT(*) FROM AMOUNTTRACKER WHERE AMT_ID = ? GROUP BY 1 ORDER BY 3 DESC, 1"
+        valuesToGetSlices = [self.amountID] if bucket == "description" else [utcOffsetSeconds, self.amountID]
+        return self.cur.execute(queryToGetSlices, valuesToGetSlices).fetchall()
+
+
+# Reads across the amounts and expenses from one snapshot of every shard, so the version and the rows it tags are read together
+class SQLiteAmountsReader:
+
+    def __init__(self, snapshotConnections):
+        self.snapshotConnections = snapshotConnections
+
+    def dataVersion(self):
+        return joinShardVersions(fanOutSnapshots(self.snapshotConnections, readShardVersion))
+
+    # Gets the amounts, optionally only those in the date range, after the cursor and with the status, in (DATE, ID) order, at most limit of them
+    # Each as its ID, Description, Value, Date, no of expenses and remaining amount, from AMOUNTTOTALS, so its one query for all the amounts
+    # The remaining amount of a spent amount is exactly 0, as the values are in cents
+    def listAmounts(self, sort, dateFrom, dateTo, cursor, limit, amountStatus=None):
+        queryToGetRemainingAmount = "(AMOUNT.VALUE - AMOUNTTOTALS.SPENT)"
+        whereClauses, valuesToGetAmtDetails, orderBy = amountRangeClauses(sort, dateFrom, dateTo, cursor)
+        if amountStatus is not None:
+            whereClauses.append(queryToGetRemainingAmount + (" = 0" if amountStatus == "finished" else " != 0"))
+        queryToGetAmtDetails = "SELECT AMOUNT.ID, AMOUNT.AMT_EXP_DESC, AMOUNT.VALUE, AMOUNT.DATE, AMOUNTTOTALS.EXPENSE_COUNT, " + queryToGetRemainingAmount + \
+            " FROM AMOUNTTRACKER AS AMOUNT JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = AMOUNT.ID WHERE " + " AND ".join(whereClauses) + orderBy
+        if limit is not None:
+            queryToGetAmtDetails += " LIMIT ?"
+            valuesToGetAmtDetails.append(limit)
+
+        # The query runs on every shard, each returns its own first rows, which are merged in (DATE, ID) order
+        return mergeShardRows(fanOutSnapshots(self.snapshotConnections, lambda connection: connection.execute(queryToGetAmtDetails, valuesToGetAmtDetails).fetchall()),
+                              key=lambda row: dateIDOrder(row[3], row[0]), reverse=sort == "desc", limit=limit)
+
+    # Gets the spend of every period of the granularity, in period order, and with top, that many descriptions with the most spent, most first
+    # Each as its period or description, spent total and no of expenses, optionally only in the date range and of the amounts with the given IDs
+    # Its read from the daily rollups, SPENDBYDESCRIPTION by description across all the amounts and SPENDROLLUP by amount and description
+    # so it reads one row per day and description, or per day, amount and description when the amounts are filtered
+    def spend(self, granularity, dateFrom, dateTo, amountIDs, top):
+
+        # Builds the WHERE clauses of the date range and the amounts
+        whereClauses = []
+        valuesToFilter = []
+        if dateFrom is not None:
+            whereClauses.append("DAY >= ?")
+            valuesToFilter.append(convertDateToEpoch(dateFrom))
+        if dateTo is not None:
+            whereClauses.append("DAY <= ?")
+            valuesToFilter.append(convertDateToEpoch(dateTo))
+        if amountIDs:
+            whereClauses.append("AMT_ID IN (" + ", ".join("?" * len(amountIDs)) + ")")
+            valuesToFilter.extend(amountIDs)
+        queryToFilter = " WHERE " + " AND ".join(whereClauses) if whereClauses else ""
+        rollup = "SPENDROLLUP" if amountIDs else "SPENDBYDESCRIPTION"
+
+        # Sums up the days of each period
+        queryToGetSpend = "SELECT " + spendPeriodExpressions[granularity] + ", SUM(SPENT), SUM(EXPENSE_COUNT) FROM " + rollup + queryToFilter + " GROUP BY 1 ORDER BY 1"
+        valuesToGetSpend = ([] if granularity == "day" else [utcOffsetSeconds]) + valuesToFilter
+
+        # The descriptions with the most spent in the range
+        # When sharded, every shard returns all its descriptions in the range, as the top ones across the shards can be any of them
+        queryToGetTopDescriptions = "SELECT DESCRIPTION, SUM(SPENT), SUM(EXPENSE_COUNT) FROM " + rollup + queryToFilter + " GROUP BY DESCRIPTION ORDER BY 2 DESC LIMIT ?"
+        valuesToGetTopDescriptions = valuesToFilter + [top if len(self.snapshotConnections) == 1 else -1]
+
+        def readSpend(connection):
+            cur = connection.cursor()
+            spendRows = cur.execute(queryToGetSpend, valuesToGetSpend).fetchall()
+            topDescriptionRows = cur.execute(queryToGetTopDescriptions, valuesToGetTopDescriptions).fetchall() if top is not None else []
+            return spendRows, topDescriptionRows
+
+        # The spend of each period and description is summed up across the shards
+        shardSpend = fanOutSnapshots(self.snapshotConnections, readSpend)
+        spendRows = sumShardRows([spendRows for spendRows, _ in shardSpend])
+        topDescriptionRows = sorted(sumShardRows([topDescriptionRows for _, topDescriptionRows in shardSpend], foldKey=lambda DESCRIPTION: DESCRIPTION.encode().lower()),
+                                    key=lambda row: row[1], reverse=True)[:top]
+        return spendRows, topDescriptionRows
+
+    # Gets the amounts and expenses whose descriptions match the full text query, optionally only of the type, amount or expense, in the date range and after the cursor
+    # Each as its ID, Type, amount ID, Description, Value, Date and bm25 score, lower is better, in (score, ID) order, at most limit of them
+    # Its read from the AMOUNTSEARCH full text index, so only the matching rows are read
+    def search(self, searchQuery, searchType, dateFrom, dateTo, cursor, limit):
+
+        # Builds the WHERE clauses of the type, the date range and the cursor, the (score, ID) of the last result of the previous page
+        whereClauses = []
+        valuesToSearch = [searchQuery]
+        if searchType is not None:
+            whereClauses.append("ENTRY.TYPE = ?")
+            valuesToSearch.append("AMT" if searchType == "amount" else "EXP")
+        if dateFrom is not None:
+            whereClauses.append("ENTRY.DATE >= ?")
+            valuesToSearch.append(convertDateToEpoch(dateFrom))
+        if dateTo is not None:
+            whereClauses.append("ENTRY.DATE <= ?")
+            valuesToSearch.append(convertDateToEpoch(dateTo))
+        if cursor is not None:
+            whereClauses.append("(MATCHES.SCORE, ENTRY.ID) > (?, ?)")
+            valuesToSearch.extend(decodeCursor(cursor, (float, str)))
+
+        # Query to get the matching rows with their bm25 score, then their details by rowid
+        queryToSearch = "SELECT ENTRY.ID, ENTRY.TYPE, ENTRY.AMT_ID, ENTRY.AMT_EXP_DESC, ENTRY.VALUE, ENTRY.DATE, MATCHES.SCORE " + \
+            "FROM (SELECT rowid AS ENTRY_ROWID, bm25(AMOUNTSEARCH) AS SCORE FROM AMOUNTSEARCH WHERE AMOUNTSEARCH MATCH ?) AS MATCHES " + \
+            "JOIN AMOUNTTRACKER AS ENTRY ON ENTRY.rowid = MATCHES.ENTRY_ROWID" + \
+            ("" if len(whereClauses) == 0 else " WHERE " + " AND ".join(whereClauses)) + " ORDER BY MATCHES.SCORE, ENTRY.ID LIMIT ?"
+        valuesToSearch.append(limit)
+
+        # The search runs on every shard, each returns its own best matches, which are merged in (score, ID) order
+        # The scores are computed by each shard from its own rows, so across the shards the ranking is close to, but not exactly, that of one DB
+        return mergeShardRows(fanOutSnapshots(self.snapshotConnections, lambda connection: connection.execute(queryToSearch, valuesToSearch).fetchall()),
+                              key=lambda row: (row[6], row[0].encode().lower()), limit=limit)
+
+    # Gets the last compacted and the last logged sequence no of every shard, and its changes after the since of the shard, at most limit of them,
+    # or None if they are not all still in the log
+    # Each change as its sequence no, time, ID, Type, amount ID and deleted flag, with the row as it is now, its Description, Value, Date,
+    # and for an amount its no of expenses. A deleted row is not in AMOUNTTRACKER, so its columns are None
+    # The changes are read in the same snapshot as the sequence nos, so a change is returned with the row as it was when it was logged or later
+    def changes(self, sinceSeqs, limit):
+        queryToGetChanges = "SELECT CHANGE.SEQ, CHANGE.CHANGED_AT, CHANGE.ID, CHANGE.TYPE, CHANGE.AMT_ID, CHANGE.DELETED, ENTRY.AMT_EXP_DESC, ENTRY.VALUE, ENTRY.DATE, " + \
+            "AMOUNTTOTALS.EXPENSE_COUNT FROM AMOUNTCHANGES AS CHANGE LEFT JOIN AMOUNTTRACKER AS ENTRY ON ENTRY.ID = CHANGE.ID " + \
+            "LEFT JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = ENTRY.ID WHERE CHANGE.SEQ > ? ORDER BY CHANGE.SEQ LIMIT ?"
+
+        def readChanges(connection, sinceSeq):
+            compactedSeq = connection.execute("SELECT CHANGES_COMPACTED_SEQ FROM DATAVERSION WHERE ID = 0").fetchone()[0]
+            latestSeqCheck = connection.execute("SELECT seq FROM sqlite_sequence WHERE name = 'AMOUNTCHANGES'").fetchone()
+            latestSeq = 0 if latestSeqCheck is None else latestSeqCheck[0]
+            if not compactedSeq <= sinceSeq <= latestSeq:
+                return compactedSeq, latestSeq, None
+            return compactedSeq, latestSeq, connection.execute(queryToGetChanges, [sinceSeq, limit]).fetchall()
+
+        return fanOutSnapshots(self.snapshotConnections, readChanges, sinceSeqs)
+
+
+# Reads the amounts in the date range, each followed by its expenses, in (DATE, ID) order, a batch of rows at a time
+# Each row as its ID, Description, Value, Type, Date and amount ID
+# The export reads from its own connection to each shard, in one read transaction, so it sees a consistent snapshot of each shard however long it takes
+# Rows are read with fetchmany, a batch at a time, so the memory used stays the same whatever the size of the DB
+# The amounts of the shards are merged in (DATE, ID) order as they are read, and the expenses of an amount are read from its shard
+def readExportRows(dateFrom, dateTo):
+    connections = [shardPool.openUnpooledConnection() for shardPool in shards.shardPools]
+    try:
+        # Reads the amounts of a shard a batch at a time, each with the shard its on
+        def readShardAmounts(amountCursor, shard):
+            while True:
+                amountRows = amountCursor.fetchmany(settings.EXPORT_BATCH_SIZE)
+                if len(amountRows) == 0:
+                    return
+                for amountRow in amountRows:
+                    yield amountRow, shard
+
+        whereClauses, values, orderBy = amountRangeClauses("asc", dateFrom, dateTo, None)
+        queryToGetAmounts = "SELECT AMOUNT.ID, AMOUNT.AMT_EXP_DESC, AMOUNT.VALUE, AMOUNT.TYPE, AMOUNT.DATE, AMOUNT.AMT_ID FROM AMOUNTTRACKER AS AMOUNT WHERE " + " AND ".join(whereClauses) + orderBy
+        queryToGetExpenses = "SELECT ID, AMT_EXP_DESC, VALUE, TYPE, DATE, AMT_ID FROM AMOUNTTRACKER WHERE AMT_ID = ? ORDER BY DATE, ID"
+        shardAmounts = []
+        expenseCursors = []
+        for shard, connection in enumerate(connections):
+            connection.execute("BEGIN")
+            amountCursor = connection.cursor()
+            amountCursor.execute(queryToGetAmounts, values)
+            shardAmounts.append(readShardAmounts(amountCursor, shard))
+            expenseCursors.append(connection.cursor())
+
+        for amountRow, shard in heapq.merge(*shardAmounts, key=lambda shardAmount: dateIDOrder(shardAmount[0][4], shardAmount[0][0])):
+            yield [amountRow]
+            expenseCursor = expenseCursors[shard]
+            expenseCursor.execute(queryToGetExpenses, [amountRow[0]])
+            while True:
+                expenseRows = expenseCursor.fetchmany(settings.EXPORT_BATCH_SIZE)
+                if len(expenseRows) == 0:
+                    break
+                yield expenseRows
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+# Repository which reads and writes the DB on every request
+# An amount and its expenses are on the shard of the amount, the writes run on the request's connection or by the write pipeline of the shard
+class SQLiteRepository:
+
+    def start(self, paths):
+        pass
+
+    def stop(self):
+        pass
+
+    # Reads the version of the data and the amounts from one snapshot of every shard
+    @contextmanager
+    def readAmounts(self, connection):
+        with shardSnapshots(connection) as snapshotConnections:
+            yield SQLiteAmountsReader(snapshotConnections)
+
+    # Reads the spend, the search results and the changes from one snapshot of every shard
+    def readDB(self, connection):
+        return self.readAmounts(connection)
+
+    # Reads the export of the amounts in the date range, a batch of rows at a time
+    def exportRows(self, dateFrom, dateTo):
+        return readExportRows(dateFrom, dateTo)
+
+    # Reads an amount and its expenses from one snapshot of its shard
+    @contextmanager
+    def readAmount(self, connection, amountID):
+        with shardConnection(connection, shardOf(amountID)) as amountConnection, readTransaction(amountConnection):
+            yield SQLiteAmountReader(amountConnection.cursor(), amountID)
+
+    # Adds amounts, each as (ID, description, value, date), the amounts of each shard in one write
+    def addAmounts(self, connection, valuesToAddAmounts):
+        valuesToAddAmountsByShard = {}
+        for valuesToAddAnAmount in valuesToAddAmounts:
+            valuesToAddAmountsByShard.setdefault(shardOf(valuesToAddAnAmount[0]), []).append(valuesToAddAnAmount)
+
+        for shard, valuesToAddShardAmounts in valuesToAddAmountsByShard.items():
+            with shardConnection(connection, shard) as amountConnection:
+                runWrite(amountConnection, lambda connection: insertAmountRows(connection.cursor(), valuesToAddShardAmounts), shard)
+
+    # Adds expenses, grouped by their amount ID, each as (itemIndex, description, value, date, the date as sent)
+    # Each expense is checked against its amount and the expenses accepted before it, and its result is put in results at its itemIndex
+    # The expenses of each shard are checked and added in one write, so no other request can add to the amounts in between
+    # Returns the no of expenses added
+    def addExpenses(self, connection, expensesByAmount, results):
+
+        def insertExpenses(connection, shardExpensesByAmount):
+            cur = connection.cursor()
+            valuesToAddExpenses = []
+
+            for amountID, amountExpenses in shardExpensesByAmount.items():
+
+                # Gets the date, value and spent total of the amount, if there is no amount by that ID all its expenses get a 404
+                queryToCheckAmount = "SELECT AMOUNT.DATE, AMOUNT.VALUE, AMOUNTTOTALS.SPENT FROM AMOUNTTRACKER AS AMOUNT JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = AMOUNT.ID WHERE AMOUNT.ID = ? AND AMOUNT.TYPE = 'AMT'"
+                amountCheck = cur.execute(queryToCheckAmount, [amountID]).fetchone()
+                if amountCheck is None:
+                    for itemIndex, *_ in amountExpenses:
+                        results[itemIndex] = dict(amountNotFound(amountID), amountID=amountID)
+                    continue
+
+                amountDate, amountValue, summedUpAmount = amountCheck
+                for itemIndex, sanitizedDescription, expenseValue, expenseDate, inputDate in amountExpenses:
+                    rejection = checkNewExpense(amountID, amountDate, amountValue, summedUpAmount, expenseValue, expenseDate, inputDate)
+                    if rejection is not None:
+                        results[itemIndex] = rejection
+                        continue
+                    summedUpAmount += expenseValue
+                    generatedIDForExpense = generateID()
+                    valuesToAddExpenses.append((generatedIDForExpense, sanitizedDescription, expenseValue, expenseDate, amountID))
+                    results[itemIndex] = {"statusCode": status.HTTP_200_OK, "expenseID": generatedIDForExpense, "amountID": amountID,
+                                          "status": "Expense of " + str(convertCentsToValue(expenseValue)) + " added."}
+
+            # Inserts all the accepted expenses in one go
+            insertExpenseRows(cur, valuesToAddExpenses)
+            return len(valuesToAddExpenses)
+
+        expensesByShard = {}
+        for amountID, amountExpenses in expensesByAmount.items():
+            expensesByShard.setdefault(shardOf(amountID), {})[amountID] = amountExpenses
+        noOfAddedExpenses = 0
+        for shard, shardExpensesByAmount in expensesByShard.items():
+            with shardConnection(connection, shard) as amountConnection:
+                noOfAddedExpenses += runWrite(amountConnection, lambda connection: insertExpenses(connection, shardExpensesByAmount), shard)
+        return noOfAddedExpenses
+
+    # Updates an amount, the checks and the update are one write, so no other request can add to the amount in between
+    def updateAmount(self, connection, amountID, description, value, date):
+
+        def applyAmountUpdate(connection):
+            cur = connection.cursor()
+
+            # Gets the spent total and the earliest expense date of the amount from AMOUNTTOTALS, there are none if there is no amount by the ID
+            queryToCheckAmountUsage = "SELECT AMOUNTTOTALS.SPENT, AMOUNTTOTALS.MIN_DATE FROM AMOUNTTRACKER AS AMOUNT JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = AMOUNT.ID " + \
+                "WHERE AMOUNT.ID = ? AND AMOUNT.TYPE = 'AMT'"
+            amountCheck = cur.execute(queryToCheckAmountUsage, [amountID]).fetchone()
+            if amountCheck is None:
+                return amountNotFound(amountID)
+
+            rejection = checkAmountUpdate(value, date, amountCheck[0], amountCheck[1])
+            if rejection is not None:
+                return rejection
+
+            updateAmountRow(cur, amountID, description, value, date)
+            return {"statusCode": status.HTTP_200_OK, "amountID": amountID, "status": "Amount updated."}
+
+        shard = shardOf(amountID)
+        with shardConnection(connection, shard) as amountConnection:
+            return runWrite(amountConnection, applyAmountUpdate, shard)
+
+    # Updates an expense, the checks and the update are one write, so no other request can add to its amount in between
+    def updateExpense(self, connection, expenseID, description, value, date):
+
+        def applyExpenseUpdate(connection):
+            cur = connection.cursor()
+
+            # Gets the expense with the value, date and spent total of its amount, there are none if there is no expense by the ID
+            queryToCheckExpense = "SELECT EXPENSE.VALUE, AMOUNT.VALUE, AMOUNT.DATE, AMOUNTTOTALS.SPENT FROM AMOUNTTRACKER AS EXPENSE " + \
+                "JOIN AMOUNTTRACKER AS AMOUNT ON AMOUNT.ID = EXPENSE.AMT_ID JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = EXPENSE.AMT_ID WHERE EXPENSE.ID = ? AND EXPENSE.TYPE = 'EXP'"
+            expenseCheck = cur.execute(queryToCheckExpense, [expenseID]).fetchone()
+            if expenseCheck is None:
+                return expenseNotFound(expenseID)
+
+            # The spent total of the amount without the current value of the expense
+            currentValue, amountValue, amountDate, summedUpAmount = expenseCheck
+            rejection = checkExpenseUpdate(value, date, amountValue, amountDate, summedUpAmount - currentValue)
+            if rejection is not None:
+                return rejection
+
+            updateExpenseRow(cur, expenseID, description, value, date)
+            return {"statusCode": status.HTTP_200_OK, "amountID": expenseID, "status": "Expense updated."}
+
+        # The write runs on the shard the expense is on
+        shard = findShard(connection, expenseID)
+        with shardConnection(connection, shard) as amountConnection:
+            return runWrite(amountConnection, applyExpenseUpdate, shard)
+
+    # Deletes an amount and all its expenses, the check and the delete are one write
+    def deleteAmount(self, connection, amountID):
+
+        def applyAmountDelete(connection):
+            cur = connection.cursor()
+            if cur.execute("SELECT 1 FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'", [amountID]).fetchone() is None:
+                return amountNotFound(amountID)
+            deleteAmountRows(cur, amountID)
+            return {"statusCode": status.HTTP_200_OK, "status": "Amount with the ID, " + amountID + " and all its expenses are deleted."}
+
+        shard = shardOf(amountID)
+        with shardConnection(connection, shard) as amountConnection:
+            return runWrite(amountConnection, applyAmountDelete, shard)
+
+    # Deletes an expense, the check and the delete are one write
+    def deleteExpense(self, connection, expenseID):
+
+        def applyExpenseDelete(connection):
+            cur = connection.cursor()
+            if cur.execute("SELECT 1 FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'EXP'", [expenseID]).fetchone() is None:
+                return expenseNotFound(expenseID)
+            deleteExpenseRow(cur, expenseID)
+            return {"statusCode": status.HTTP_200_OK, "status": "Expense with the ID, " + expenseID + " is deleted."}
+
+        shard = findShard(connection, expenseID)
+        with shardConnection(connection, shard) as amountConnection:
+            return runWrite(amountConnection, applyExpenseDelete, shard)
+
+    # Deletes all the expenses of an amount, the check and the delete are one write
+    def deleteAmountExpenses(self, connection, amountID):
+
+        def applyAmountExpensesDelete(connection):
+            cur = connection.cursor()
+            if cur.execute("SELECT 1 FROM AMOUNTTRACKER WHERE ID = ? AND TYPE = 'AMT'", [amountID]).fetchone() is None:
+                return amountNotFound(amountID)
+            deleteAmountExpenseRows(cur, amountID)
+            return {"statusCode": status.HTTP_200_OK, "status": "All expenses for the Amount with the ID, " + amountID + " are deleted."}
+
+        shard = shardOf(amountID)
+        with shardConnection(connection, shard) as amountConnection:
+            return runWrite(amountConnection, applyAmountExpensesDelete, shard)
+
+    # Deletes the amounts, each with all its expenses, and expenses with the given IDs
+    # The IDs can be of expenses, whose shard is not known from their ID, so every shard deletes the IDs it has, each in one write
+    # Returns the no of amounts and expenses deleted and the IDs which were found, lowercased
+    def deleteIDs(self, connection, IDs, archive, archivedAt):
+
+        def deleteShardIDs(connection):
+            cur = connection.cursor()
+            foundIDs = {row[0].lower() for row in cur.execute("SELECT ID FROM AMOUNTTRACKER WHERE ID IN (" + ", ".join("?" * len(IDs)) + ")", IDs)}
+            return deleteRows(cur, IDs, archive, archivedAt) + (foundIDs,)
+
+        noOfDeletedAmounts = 0
+        noOfDeletedExpenses = 0
+        foundIDs = set()
+        for shard in range(len(shards.shardPools)):
+            with shardConnection(connection, shard) as deleteConnection:
+                noOfAmounts, noOfExpenses, shardFoundIDs = runWrite(deleteConnection, deleteShardIDs, shard)
+            noOfDeletedAmounts += noOfAmounts
+            noOfDeletedExpenses += noOfExpenses
+            foundIDs |= shardFoundIDs
+        return noOfDeletedAmounts, noOfDeletedExpenses, foundIDs
+
+    # Deletes the amounts dated in the range, each with all its expenses
+    # The amounts are read from the (TYPE, DATE, ID) index, DELETE_CHUNK_SIZE at a time, each chunk deleted in its own write, so the write lock is never held for long
+    # Returns the no of amounts and expenses deleted
+    def deleteAmountsInRange(self, connection, dateFrom, dateTo, archive, archivedAt):
+        whereClauses, valuesToGetAmounts, orderBy = amountRangeClauses("asc", dateFrom, dateTo, None)
+        queryToGetAmounts = "SELECT AMOUNT.ID FROM AMOUNTTRACKER AS AMOUNT WHERE " + " AND ".join(whereClauses) + orderBy + " LIMIT ?"
+
+        # Deletes the next chunk of amounts in the range, the chunks before are already deleted
+        def deleteChunkOfAmounts(connection):
+            cur = connection.cursor()
+            amountIDs = [row[0] for row in cur.execute(queryToGetAmounts, valuesToGetAmounts + [settings.DELETE_CHUNK_SIZE])]
+            if len(amountIDs) == 0:
+                return 0, 0
+            return deleteRows(cur, amountIDs, archive, archivedAt)
+
+        noOfDeletedAmounts = 0
+        noOfDeletedExpenses = 0
+        for shard in range(len(shards.shardPools)):
+            with shardConnection(connection, shard) as deleteConnection:
+                while True:
+                    noOfAmounts, noOfExpenses = runWrite(deleteConnection, deleteChunkOfAmounts, shard)
+                    noOfDeletedAmounts += noOfAmounts
+                    noOfDeletedExpenses += noOfExpenses
+                    if noOfAmounts < settings.DELETE_CHUNK_SIZE:
+                        break
+        return noOfDeletedAmounts, noOfDeletedExpenses
+
+
+# Key of an ID in the dicts of MemoryRepository, lowercased like SQLite's NOCASE, so an ID is found whatever its case, as in the DB
+def foldID(ID):
+    return ID.encode().lower()
+
+
+# An amount held in memory, with its totals kept up to date as its expenses change
+# expenseKeys are the (DATE, ID) sort keys of its expenses, kept sorted, so its expenses are read in order and its earliest expense is the first
+class AmountRecord:
+    __slots__ = ("ID", "description", "value", "date", "version", "spent", "expenseKeys")
+
+    def __init__(self, ID, description, value, date, version):
+        self.ID = ID
+        self.description = description
+        self.value = value
+        self.date = date
+        self.version = version
+        self.spent = 0
+        self.expenseKeys = []
+
+
+# An expense held in memory, amountID is the ID of its amount as it was sent, as in the DB
+class ExpenseRecord:
+    __slots__ = ("ID", "amountID", "description", "value", "date")
+
+    def __init__(self, ID, amountID, description, value, date):
+        self.ID = ID
+        self.amountID = amountID
+        self.description = description
+        self.value = value
+        self.date = date
+
+
+# Positions of the sorted (DATE, ID) keys in the date range, both epochs, and after the cursor, a decoded (DATE, ID), in sort order
+def keyPositions(sortedKeys, sort, dateFrom, dateTo, cursor):
+    low = 0 if dateFrom is None else bisect.bisect_left(sortedKeys, (dateFrom,))
+    high = len(sortedKeys) if dateTo is None else bisect.bisect_left(sortedKeys, (dateTo + 1,))
+    if cursor is not None:
+        if sort == "asc":
+            low = max(low, bisect.bisect_right(sortedKeys, dateIDOrder(*cursor)))
+        else:
+            high = min(high, bisect.bisect_left(sortedKeys, dateIDOrder(*cursor)))
+    return range(low, high) if sort == "asc" else range(high - 1, low - 1, -1)
+
+
+# Day no of an epoch, counted from 01-Jan-1970 at the UTC offset the dates are in
+def dayOfEpoch(epoch):
+    return (epoch + utcOffsetSeconds) // 86400
+
+
+# Formats a day no as YYYY-MM-DD, as SQLite's date functions return it
+def formatDay(day):
+    return "%04d-%02d-%02d" % civilFromDays(day)
+
+
+# Key of the bucket of an expense held in memory, for each bucket of the chart, the same keys chartBucketExpressions gives in SQL
+# 01-Jan-1970 was a Thursday, so a day is (day + 3) % 7 days after the Monday its week starts on
+memoryChartBuckets = {
+    "day": lambda expense: formatDay(dayOfEpoch(expense.date)),
+    "week": lambda expense: formatDay(dayOfEpoch(expense.date) - (dayOfEpoch(expense.date) + 3) % 7),
+    "month": lambda expense: formatDay(dayOfEpoch(expense.date))[:7],
+    "description": lambda expense: expense.description,
+}
+
+
+# Reads of one amount and its expenses from memory, while MemoryRepository's lock is held
+class MemoryAmountReader:
+
+    def __init__(self, repository, amount):
+        self.repository = repository
+        self.amount = amount
+
+    def totals(self):
+        if self.amount is None:
+            return None
+        return self.amount.version, self.amount.value, self.amount.spent, len(self.amount.expenseKeys)
+
+    def expenses(self, sort, cursor, limit):
+        positions = keyPositions(self.amount.expenseKeys, sort, None, None, None if cursor is None else decodeCursor(cursor))
+        expenseRows = []
+        for position in positions[:limit]:
+            expense = self.repository.expenses[self.amount.expenseKeys[position][1]]
+            expenseRows.append((expense.ID, expense.description, expense.value, expense.date))
+        return expenseRows
+
+    def details(self):
+        if self.amount is None:
+            return None
+        return self.amount.description, self.amount.value, self.amount.spent, self.amount.version
+
+    # The expenses are read in (DATE, ID) order, which the sort by value keeps for the expenses of the same value
+    # For a bucket they are summed up by its key, keys which differ only in case as one, under the first of them, as GROUP BY does with NOCASE
+    def chartSlices(self, bucket):
+        amountExpenses = [self.repository.expenses[expenseKey[1]] for expenseKey in self.amount.expenseKeys]
+        if bucket is None:
+            return sorted([(expense.description, expense.date, expense.value, 1) for expense in amountExpenses], key=lambda row: row[2], reverse=True)
+
+        bucketKey = memoryChartBuckets[bucket]
+        summedSlices = {}
+        for expense in amountExpenses:
+            key = bucketKey(expense)
+            summedSlice = summedSlices.setdefault(key.encode().lower(), [key, None, 0, 0])
+            summedSlice[2] += expense.value
+            summedSlice[3] += 1
+        return sorted([tuple(summedSlice) for summedSlice in summedSlices.values()], key=lambda row: (-row[2], row[0].encode().lower()))
+
+
+# Reads across the amounts from memory, while MemoryRepository's lock is held
+class MemoryAmountsReader:
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def dataVersion(self):
+        return self.repository.version
+
+    def listAmounts(self, sort, dateFrom, dateTo, cursor, limit, amountStatus=None):
+        dateFrom = None if dateFrom is None else convertDateToEpoch(dateFrom)
+        dateTo = None if dateTo is None else convertDateToEpoch(dateTo)
+        cursor = None if cursor is None else decodeCursor(cursor)
+        amountKeys = self.repository.amountKeys
+        amountRows = []
+        for position in keyPositions(amountKeys, sort, dateFrom, dateTo, cursor):
+            amount = self.repository.amounts[amountKeys[position][1]]
+            remainingAmount = amount.value - amount.spent
+            if amountStatus is not None and (remainingAmount == 0) != (amountStatus == "finished"):
+                continue
+            amountRows.append((amount.ID, amount.description, amount.value, amount.date, len(amount.expenseKeys), remainingAmount))
+            if len(amountRows) == limit:
+                break
+        return amountRows
+
+
+# Repository which keeps every amount and expense in memory, loaded from the DB when the app starts
+# The amounts and the expenses are in dicts keyed by their ID, the amounts also in a list of their (DATE, ID) keys kept sorted,
+# so the lists and pages are read in order without sorting, and every amount keeps its spent total and its expenses' keys up to date
+# The checks and reads take one lock and never touch the DB, the writes are queued and written back to the DB, write-behind,
+# every flushIntervalSeconds by a background thread, and when the app shuts down
+# The spend, the search results, the changes and the export are read from the DB, after writing back what is pending
+# Writes not yet written back are lost if the process dies, and the app must be the only process writing to the DB, as the DB is not read again
+# The versions start from those in the DB and go up by one for every row written, never more than the triggers bump them in the DB,
+# so the ETags of the data written back are never reused after a restart
+class MemoryRepository:
+
+    def __init__(self, flushIntervalSeconds):
+        self.flushIntervalSeconds = flushIntervalSeconds
+        self.lock = threading.Lock()
+        self.amounts = {}
+        self.expenses = {}
+        self.amountKeys = []
+        self.version = 0
+        # Writes not yet written back, each as (shard, function of the SQL, its arguments, no of times it failed on its own), in the order they were made
+        self.pendingWrites = []
+        self.noOfDroppedWrites = 0
+        # Connection to each shard the writes are written back on, only one flush at a time uses them
+        self.flushConnections = []
+        self.flushLock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="MemoryRepositoryFlush", daemon=True)
+
+    # Loads every shard of the DB, each from one snapshot, and starts writing back
+    def start(self, paths):
+        for path in paths:
+            connection = openConnection(path)
+            with readTransaction(connection):
+                queryToGetAmounts = "SELECT AMOUNT.ID, AMOUNT.AMT_EXP_DESC, AMOUNT.VALUE, AMOUNT.DATE, AMOUNTTOTALS.VERSION FROM AMOUNTTRACKER AS AMOUNT " + \
+                    "JOIN AMOUNTTOTALS ON AMOUNTTOTALS.AMT_ID = AMOUNT.ID WHERE AMOUNT.TYPE = 'AMT'"
+                for ID, AMT_EXP_DESC, VALUE, DATE, VERSION in connection.execute(queryToGetAmounts):
+                    self.amounts[foldID(ID)] = AmountRecord(ID, AMT_EXP_DESC, VALUE, DATE, VERSION)
+                    self.amountKeys.append(dateIDOrder(DATE, ID))
+
+                queryToGetExpenses = "SELECT ID, AMT_ID, AMT_EXP_DESC, VALUE, DATE FROM AMOUNTTRACKER WHERE TYPE = 'EXP'"
+                for ID, AMT_ID, AMT_EXP_DESC, VALUE, DATE in connection.execute(queryToGetExpenses):
+                    amount = self.amounts.get(foldID(AMT_ID))
+                    if amount is None:
+                        continue
+                    self.expenses[foldID(ID)] = ExpenseRecord(ID, AMT_ID, AMT_EXP_DESC, VALUE, DATE)
+                    amount.spent += VALUE
+                    amount.expenseKeys.append(dateIDOrder(DATE, ID))
+
+                self.version += connection.execute("SELECT VERSION FROM DATAVERSION WHERE ID = 0").fetchone()[0]
+            self.flushConnections.append(connection)
+
+        self.amountKeys.sort()
+        for amount in self.amounts.values():
+            amount.expenseKeys.sort()
+        self.thread.start()
+
+    # Stops writing back in the background and writes back what is left, there is no later flush to retry them, so the writes which fail are dropped
+    def stop(self):
+        if self.thread.is_alive():
+            self.stopping.set()
+            self.thread.join()
+        self.flush(lastFlush=True)
+        if self.noOfDroppedWrites > 0:
+            logger.error("%d writes were dropped instead of written back to the DB, they are in the amounttracker.droppedwrites log", self.noOfDroppedWrites)
+        for connection in self.flushConnections:
+            connection.close()
+
+    def run(self):
+        while not self.stopping.wait(self.flushIntervalSeconds):
+            try:
+                noOfWrites = self.flush()
+                if noOfWrites > 0:
+                    logger.debug("Wrote back %d writes", noOfWrites)
+            except Exception:
+                logger.exception("Writing back to the DB failed")
+
+    # Queues a write to be written back to the shard, write is one of the functions of the SQL, called with a cursor and the arguments
+    def persist(self, shard, write, *arguments):
+        self.pendingWrites.append((shard, write, arguments, 0))
+
+    # Writes back the queued writes, those of each shard in one transaction, in the order they were made
+    # If the transaction of a shard fails, its writes are written back one at a time, so only the writes which fail on their own are held back
+    # Also called before reading the DB, so the reads see every write made before them
+    # Returns the no of writes written back
+    def flush(self, lastFlush=False):
+        with self.flushLock:
+            with self.lock:
+                pendingWrites = self.pendingWrites
+                self.pendingWrites = []
+            if len(pendingWrites) == 0:
+                return 0
+
+            writesByShard = {}
+            for pendingWrite in pendingWrites:
+                writesByShard.setdefault(pendingWrite[0], []).append(pendingWrite)
+
+            noOfWrittenWrites = 0
+            retriedWrites = []
+            for shard, shardWrites in writesByShard.items():
+                connection = self.flushConnections[shard]
+                try:
+                    with writeTransaction(connection):
+                        cur = connection.cursor()
+                        for _, write, arguments, _ in shardWrites:
+                            write(cur, *arguments)
+                    noOfWrittenWrites += len(shardWrites)
+                except Exception:
+                    logger.warning("Writing back %d writes to shard %d failed, writing them back one at a time", len(shardWrites), shard, exc_info=True)
+                    noOfShardWrittenWrites, shardRetriedWrites = self.flushOneByOne(connection, shardWrites, lastFlush)
+                    noOfWrittenWrites += noOfShardWrittenWrites
+                    retriedWrites.extend(shardRetriedWrites)
+
+            if retriedWrites:
+                with self.lock:
+                    self.pendingWrites[:0] = retriedWrites
+            return noOfWrittenWrites
+
+    # Writes back the writes of a shard one at a time, each in its own transaction
+    # A write which fails is retried on the next flush, together with the writes after it, so the writes of the shard stay in order
+    # Once it has failed MEMORY_FLUSH_MAX_ATTEMPTS times, or on the last flush, its dropped, logged with its arguments to the dropped writes log, and the writes after it carry on
+    # Failures because the DB is busy are not counted, as they pass, those are retried on the next flush however often they fail
+    # Returns the no of writes written back and the writes to retry
+    def flushOneByOne(self, connection, shardWrites, lastFlush):
+        noOfWrittenWrites = 0
+        for position, (shard, write, arguments, noOfFailures) in enumerate(shardWrites):
+            try:
+                with writeTransaction(connection):
+                    write(connection.cursor(), *arguments)
+            except Exception as error:
+                if getattr(error, "sqlite_errorcode", None) not in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED):
+                    noOfFailures += 1
+                if not lastFlush and noOfFailures < settings.MEMORY_FLUSH_MAX_ATTEMPTS:
+                    logger.warning("Writing back %s to shard %d failed, it and the %d writes after it are retried on the next flush",
+                                   write.__name__, shard, len(shardWrites) - position - 1, exc_info=True)
+                    return noOfWrittenWrites, [(shard, write, arguments, noOfFailures)] + shardWrites[position + 1:]
+                droppedWriteLogger.error("Dropped %s%r on shard %d: %s", write.__name__, arguments, shard, error)
+                self.noOfDroppedWrites += 1
+                continue
+            noOfWrittenWrites += 1
+        return noOfWrittenWrites, []
+
+    @contextmanager
+    def readAmounts(self, connection):
+        with self.lock:
+            yield MemoryAmountsReader(self)
+
+    @contextmanager
+    def readAmount(self, connection, amountID):
+        with self.lock:
+            yield MemoryAmountReader(self, self.amounts.get(foldID(amountID)))
+
+    # The rollups, the search index and the change log are only in the DB, so the writes not yet written back are written back first
+    @contextmanager
+    def readDB(self, connection):
+        self.flush()
+        with shardSnapshots(connection) as snapshotConnections:
+            yield SQLiteAmountsReader(snapshotConnections)
+
+    # The export reads the DB too, so it writes back first when its read starts
+    def exportRows(self, dateFrom, dateTo):
+        self.flush()
+        yield from readExportRows(dateFrom, dateTo)
+
+    # Adds an expense to its amount, and its value and key to the amount's totals
+    def insertExpense(self, amount, expense):
+        self.expenses[foldID(expense.ID)] = expense
+        bisect.insort(amount.expenseKeys, dateIDOrder(expense.date, expense.ID))
+        amount.spent += expense.value
+        amount.version += 1
+        self.version += 1
+
+    # Removes an expense from its amount, and its value and key from the amount's totals
+    def removeExpense(self, amount, expense):
+        del self.expenses[foldID(expense.ID)]
+        expenseKey = dateIDOrder(expense.date, expense.ID)
+        del amount.expenseKeys[bisect.bisect_left(amount.expenseKeys, expenseKey)]
+        amount.spent -= expense.value
+        amount.version += 1
+        self.version += 1
+
+    # Removes an amount and all its expenses
+    def removeAmount(self, amount):
+        for expenseKey in amount.expenseKeys:
+            del self.expenses[expenseKey[1]]
+        del self.amounts[foldID(amount.ID)]
+        del self.amountKeys[bisect.bisect_left(self.amountKeys, dateIDOrder(amount.date, amount.ID))]
+        self.version += 1 + len(amount.expenseKeys)
+
+    def addAmounts(self, connection, valuesToAddAmounts):
+        valuesToAddAmountsByShard = {}
+        with self.lock:
+            for ID, description, value, date in valuesToAddAmounts:
+                self.amounts[foldID(ID)] = AmountRecord(ID, description, value, date, 0)
+                bisect.insort(self.amountKeys, dateIDOrder(date, ID))
+                self.version += 1
+                valuesToAddAmountsByShard.setdefault(shardOf(ID), []).append((ID, description, value, date))
+            for shard, valuesToAddShardAmounts in valuesToAddAmountsByShard.items():
+                self.persist(shard, insertAmountRows, valuesToAddShardAmounts)
+
+    def addExpenses(self, connection, expensesByAmount, results):
+        valuesToAddExpensesByShard = {}
+        noOfAddedExpenses = 0
+        with self.lock:
+            for amountID, amountExpenses in expensesByAmount.items():
+                amount = self.amounts.get(foldID(amountID))
+                if amount is None:
+                    for itemIndex, *_ in amountExpenses:
+                        results[itemIndex] = dict(amountNotFound(amountID), amountID=amountID)
+                    continue
+
+                for itemIndex, sanitizedDescription, expenseValue, expenseDate, inputDate in amountExpenses:
+                    rejection = checkNewExpense(amountID, amount.date, amount.value, amount.spent, expenseValue, expenseDate, inputDate)
+                    if rejection is not None:
+                        results[itemIndex] = rejection
+                        continue
+                    generatedIDForExpense = generateID()
+                    self.insertExpense(amount, ExpenseRecord(generatedIDForExpense, amountID, sanitizedDescription, expenseValue, expenseDate))
+                    valuesToAddExpensesByShard.setdefault(shardOf(amountID), []).append(
+                        (generatedIDForExpense, sanitizedDescription, expenseValue, expenseDate, amountID))
+                    noOfAddedExpenses += 1
+                    results[itemIndex] = {"statusCode": status.HTTP_200_OK, "expenseID": generatedIDForExpense, "amountID": amountID,
+                                          "status": "Expense of " + str(convertCentsToValue(expenseValue)) + " added."}
+
+            for shard, valuesToAddShardExpenses in valuesToAddExpensesByShard.items():
+                self.persist(shard, insertExpenseRows, valuesToAddShardExpenses)
+        return noOfAddedExpenses
+
+    def updateAmount(self, connection, amountID, description, value, date):
+        with self.lock:
+            amount = self.amounts.get(foldID(amountID))
+            if amount is None:
+                return amountNotFound(amountID)
+
+            rejection = checkAmountUpdate(value, date, amount.spent, amount.expenseKeys[0][0] if amount.expenseKeys else None)
+            if rejection is not None:
+                return rejection
+
+            if date != amount.date:
+                del self.amountKeys[bisect.bisect_left(self.amountKeys, dateIDOrder(amount.date, amount.ID))]
+                bisect.insort(self.amountKeys, dateIDOrder(date, amount.ID))
+            amount.description = description
+            amount.value = value
+            amount.date = date
+            amount.version += 1
+            self.version += 1
+            self.persist(shardOf(amountID), updateAmountRow, amountID, description, value, date)
+            return {"statusCode": status.HTTP_200_OK, "amountID": amountID, "status": "Amount updated."}
+
+    def updateExpense(self, connection, expenseID, description, value, date):
+        with self.lock:
+            expense = self.expenses.get(foldID(expenseID))
+            if expense is None:
+                return expenseNotFound(expenseID)
+            amount = self.amounts[foldID(expense.amountID)]
+
+            rejection = checkExpenseUpdate(value, date, amount.value, amount.date, amount.spent - expense.value)
+            if rejection is not None:
+                return rejection
+
+            if date != expense.date:
+                del amount.expenseKeys[bisect.bisect_left(amount.expenseKeys, dateIDOrder(expense.date, expense.ID))]
+                bisect.insort(amount.expenseKeys, dateIDOrder(date, expense.ID))
+            amount.spent += value - expense.value
+            expense.description = description
+            expense.value = value
+            expense.date = date
+            amount.version += 1
+            self.version += 1
+            self.persist(shardOf(expense.amountID), updateExpenseRow, expenseID, description, value, date)
+            return {"statusCode": status.HTTP_200_OK, "amountID": expenseID, "status": "Expense updated."}
+
+    def deleteAmount(self, connection, amountID):
+        with self.lock:
+            amount = self.amounts.get(foldID(amountID))
+            if amount is None:
+                return amountNotFound(amountID)
+            self.removeAmount(amount)
+            self.persist(shardOf(amountID), deleteAmountRows, amountID)
+            return {"statusCode": status.HTTP_200_OK, "status": "Amount with the ID, " + amountID + " and all its expenses are deleted."}
+
+    def deleteExpense(self, connection, expenseID):
+        with self.lock:
+            expense = self.expenses.get(foldID(expenseID))
+            if expense is None:
+                return expenseNotFound(expenseID)
+            self.removeExpense(self.amounts[foldID(expense.amountID)], expense)
+            self.persist(shardOf(expense.amountID), deleteExpenseRow, expenseID)
+            return {"statusCode": status.HTTP_200_OK, "status": "Expense with the ID, " + expenseID + " is deleted."}
+
+    def deleteAmountExpenses(self, connection, amountID):
+        with self.lock:
+            amount = self.amounts.get(foldID(amountID))
+            if amount is None:
+                return amountNotFound(amountID)
+            for expenseKey in list(amount.expenseKeys):
+                self.removeExpense(amount, self.expenses[expenseKey[1]])
+            self.persist(shardOf(amountID), deleteAmountExpenseRows, amountID)
+            return {"statusCode": status.HTTP_200_OK, "status": "All expenses for the Amount with the ID, " + amountID + " are deleted."}
+
+    # Removes the amounts, each with all its expenses, and expenses with the given IDs, under the lock
+    # The IDs are all looked up before any is removed, so an expense sent with its amount is found, as in the DB
+    # The rows are deleted from the DB with the same SQL as the SQLite repository, on the shard each of them is on, so they are archived the same way
+    # Returns the no of amounts and expenses deleted and the IDs which were found, lowercased
+    def removeIDs(self, IDs, archive, archivedAt):
+        foundIDs = set()
+        for ID in IDs:
+            row = self.amounts.get(foldID(ID)) or self.expenses.get(foldID(ID))
+            if row is not None:
+                foundIDs.add(row.ID.lower())
+
+        noOfDeletedAmounts = 0
+        noOfDeletedExpenses = 0
+        IDsByShard = {}
+        for ID in IDs:
+            amount = self.amounts.get(foldID(ID))
+            expense = self.expenses.get(foldID(ID))
+            if amount is not None:
+                noOfDeletedAmounts += 1
+                noOfDeletedExpenses += len(amount.expenseKeys)
+                self.removeAmount(amount)
+                IDsByShard.setdefault(shardOf(ID), []).append(ID)
+            elif expense is not None:
+                noOfDeletedExpenses += 1
+                self.removeExpense(self.amounts[foldID(expense.amountID)], expense)
+                IDsByShard.setdefault(shardOf(expense.amountID), []).append(ID)
+        for shard, shardIDs in IDsByShard.items():
+            self.persist(shard, deleteRows, shardIDs, archive, archivedAt)
+        return noOfDeletedAmounts, noOfDeletedExpenses, foundIDs
+
+    def deleteIDs(self, connection, IDs, archive, archivedAt):
+        with self.lock:
+            return self.removeIDs(IDs, archive, archivedAt)
+
+    # The amounts in the range are removed DELETE_CHUNK_SIZE at a time, so no write back deletes more IDs than a chunk of the SQLite repository
+    def deleteAmountsInRange(self, connection, dateFrom, dateTo, archive, archivedAt):
+        dateFrom = None if dateFrom is None else convertDateToEpoch(dateFrom)
+        dateTo = None if dateTo is None else convertDateToEpoch(dateTo)
+        noOfDeletedAmounts = 0
+        noOfDeletedExpenses = 0
+        with self.lock:
+            amountIDs = [self.amounts[self.amountKeys[position][1]].ID for position in keyPositions(self.amountKeys, "asc", dateFrom, dateTo, None)]
+            for chunkStart in range(0, len(amountIDs), settings.DELETE_CHUNK_SIZE):
+                noOfAmounts, noOfExpenses, _ = self.removeIDs(amountIDs[chunkStart:chunkStart + settings.DELETE_CHUNK_SIZE], archive, archivedAt)
+                noOfDeletedAmounts += noOfAmounts
+                noOfDeletedExpenses += noOfExpenses
+        return noOfDeletedAmounts, noOfDeletedExpenses
+
+
+# Repository the endpoints use, the SQLite one until the app starts
+backend = SQLiteRepository()
+
+
+# Sets up the repository picked with AMOUNTTRACKER_REPOSITORY over the shards of the DB, the memory repository loads them into memory
+# The memory repository must write back, as the endpoints read from the DB would otherwise never see its writes
+def startRepository(paths):
+    global backend
+    if settings.REPOSITORY == "memory":
+        if settings.MEMORY_FLUSH_INTERVAL_S <= 0:
+            raise ValueError(str(settings.MEMORY_FLUSH_INTERVAL_S) + " is not a flush interval, AMOUNTTRACKER_MEMORY_FLUSH_INTERVAL_S must be more than 0 with the memory repository")
+        backend = MemoryRepository(settings.MEMORY_FLUSH_INTERVAL_S)
+    elif settings.REPOSITORY == "sqlite":
+        backend = SQLiteRepository()
+    else:
+        raise ValueError(settings.REPOSITORY + " is not a repository, AMOUNTTRACKER_REPOSITORY must be sqlite or memory")
+    backend.start(paths)
+
+
+# Stops the repository, the memory repository writes back its pending writes first
+def stopRepository():
+    global backend
+    backend.stop()
+    backend = SQLiteRepository()
@@ -0,0 +1,79 @@
+import os
+
+
+# All the tunables of the app, read once from environment variables at startup
+
+# Path to the SQLite DB file
+DATABASE_PATH = os.environ.get("AMOUNTTRACKER_DB", "AMOUNTTRACKER.db")
+
+# How long, in milliseconds, a connection waits for the write lock before failing with "database is locked"
+BUSY_TIMEOUT_MS = int(os.environ.get("AMOUNTTRACKER_BUSY_TIMEOUT_MS", "5000"))
+
+# Number of prepared statements each connection keeps compiled
+STATEMENT_CACHE_SIZE = int(os.environ.get(
+    "AMOUNTTRACKER_STATEMENT_CACHE_SIZE", "256"))
+
+# Maximum number of open connections, matches the default size of the threadpool FastAPI runs the handlers in
+POOL_SIZE = int(os.environ.get("AMOUNTTRACKER_POOL_SIZE", "40"))
+
+# Page size used by the paged endpoints when a cursor is sent without a limit, and the largest limit they accept
+DEFAULT_PAGE_SIZE = int(os.environ.get("AMOUNTTRACKER_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.environ.get("AMOUNTTRACKER_MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched from the DB at a time by /export, which bounds the memory an export uses
+EXPORT_BATCH_SIZE = int(os.environ.get("AMOUNTTRACKER_EXPORT_BATCH_SIZE", "1000"))
+
+# Largest no of items accepted by /addAmountsBatch and /addExpensesBatch in one request
+MAX_BATCH_SIZE = int(os.environ.get("AMOUNTTRACKER_MAX_BATCH_SIZE", "10000"))
+
+# With the write pipeline on, all the writes are applied by one writer thread in batches, one commit per batch
+# A batch is at most WRITE_BATCH_SIZE writes, the writer waits at most WRITE_LINGER_MS for more writes to join a batch
+WRITE_PIPELINE = os.environ.get("AMOUNTTRACKER_WRITE_PIPELINE", "0") == "1"
+WRITE_BATCH_SIZE = int(os.environ.get("AMOUNTTRACKER_WRITE_BATCH_SIZE", "64"))
+WRITE_LINGER_MS = float(os.environ.get("AMOUNTTRACKER_WRITE_LINGER_MS", "1"))
+
+# Largest total size, in bytes, of the serialized GET responses kept in the in-process response cache, 0 turns the cache off
+RESPONSE_CACHE_BYTES = int(os.environ.get("AMOUNTTRACKER_RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# UTC offset, as +HH:MM or -HH:MM, of the timezone the dates are in, a date is stored as the epoch of its midnight in this timezone
+# Defaults to IST, the timezone the dates in the shipped AMOUNTTRACKER.db were saved in
+UTC_OFFSET = os.environ.get("AMOUNTTRACKER_UTC_OFFSET", "+05:30")
+
+# No of epochs whose DD-MMM-YYYY form is memoized
+DATE_CACHE_SIZE = int(os.environ.get("AMOUNTTRACKER_DATE_CACHE_SIZE", "4096"))
+
+# No of slices /getAmountExpensesChart shows by default before summing up the rest as "Other", and the largest no it accepts
+CHART_TOP_N = int(os.environ.get("AMOUNTTRACKER_CHART_TOP_N", "20"))
+MAX_CHART_TOP_N = int(os.environ.get("AMOUNTTRACKER_MAX_CHART_TOP_N", "200"))
+
+# With metrics on, every request's latency, status and SQL queries are recorded and served at /metrics in Prometheus text format
+METRICS = os.environ.get("AMOUNTTRACKER_METRICS", "0") == "1"
+
+# Queries which take longer than this, in milliseconds, are logged with their parameters and query plan, 0 turns the log off
+SLOW_QUERY_MS = float(os.environ.get("AMOUNTTRACKER_SLOW_QUERY_MS", "0"))
+
+# Largest no of amounts or IDs /deleteBatch deletes in one transaction, so the write lock is only held for a short time
+DELETE_CHUNK_SIZE = int(os.environ.get("AMOUNTTRACKER_DELETE_CHUNK_SIZE", "500"))
+
+# With auto_vacuum=INCREMENTAL on the DB, every VACUUM_INTERVAL_S seconds a background thread gives the free pages back to the filesystem
+# VACUUM_PAGES pages at a time, so it never holds the write lock for long, 0 turns it off
+VACUUM_INTERVAL_S = float(os.environ.get("AMOUNTTRACKER_VACUUM_INTERVAL_S", "60"))
+VACUUM_PAGES = int(os.environ.get("AMOUNTTRACKER_VACUUM_PAGES", "256"))
+
+# No of SQLite files the DB is hash sharded over by amount ID, 1 keeps everything in DATABASE_PATH
+# The first shard is DATABASE_PATH itself, the others are files next to it, e.g. AMOUNTTRACKER.shard1.db
+SHARDS = int(os.environ.get("AMOUNTTRACKER_SHARDS", "1"))
+
+# Every insert, update and delete is logged for /changes, entries older than CHANGES_RETENTION_S seconds are compacted away
+# every CHANGES_COMPACT_INTERVAL_S seconds by a background thread, 0 turns the compaction off
+CHANGES_RETENTION_S = int(os.environ.get("AMOUNTTRACKER_CHANGES_RETENTION_S", str(7 * 24 * 3600)))
+CHANGES_COMPACT_INTERVAL_S = float(os.environ.get("AMOUNTTRACKER_CHANGES_COMPACT_INTERVAL_S", "3600"))
+
+# Storage the endpoints read and write the amounts and expenses through, sqlite reads and writes the DB on every request
+# memory serves them from a copy of the DB loaded into memory at startup, its writes are written back to the DB every MEMORY_FLUSH_INTERVAL_S seconds
+# and when the app shuts down, the interval must be more than 0. The memory repository is for one worker process which is the only writer of the DB
+REPOSITORY = os.environ.get("AMOUNTTRACKER_REPOSITORY", "sqlite")
+MEMORY_FLUSH_INTERVAL_S = float(os.environ.get("AMOUNTTRACKER_MEMORY_FLUSH_INTERVAL_S", "1"))
+# Times a write which fails on its own is tried before its dropped and logged to the amounttracker.droppedwrites log, so one bad write cannot hold up the writes after it
+# Failures because the DB is busy are not counted, as they pass
+MEMORY_FLUSH_MAX_ATTEMPTS = int(os.environ.get("AMOUNTTRACKER_MEMORY_FLUSH_MAX_ATTEMPTS", "3"))
@@ -0,0 +1,149 @@
+import contextvars
+import heapq
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+import settings
+from database import pool, ConnectionPool, readTransaction
+
+
+# Hash sharding of the DB over several SQLite files, turned on with AMOUNTTRACKER_SHARDS
+# An amount and all its expenses are in one shard, picked by a hash of the amount ID, and each shard has its own write lock,
+# so writes to amounts on different shards run in parallel
+# Reads of one amount go to its shard, reads across the amounts fan out to every shard in parallel and their rows are merged
+# With one shard, the default, everything runs on the request's own connection, as without sharding
+
+
+# Pools of the shards, the first one is the pool of DATABASE_PATH
+shardPools = [pool]
+
+# Threads the reads across the shards run on
+fanOutExecutor = ThreadPoolExecutor(max_workers=settings.POOL_SIZE, thread_name_prefix="ShardFanOut")
+
+
+# Paths of the shard files of the DB at path, the first shard is the DB file itself
+def shardPaths(path, noOfShards):
+    root, extension = os.path.splitext(path)
+    return [path] + [root + ".shard" + str(shard) + extension for shard in range(1, noOfShards)]
+
+
+# Shard of an amount, and so of all its expenses, by the CRC32 of its ID
+# IDs are compared case insensitively, so the ID is lowercased the way SQLite's NOCASE does, ASCII only
+def shardOf(amountID, noOfShards=None):
+    return zlib.crc32(amountID.encode().lower()) % (noOfShards or len(shardPools))
+
+
+# Sets up a pool for each of the shards of the DB pool points to
+# The shard pools open their connections like pool does, with its connection class and hooks
+def configureShards(noOfShards):
+    global shardPools
+    closeShards()
+    shardPools = [pool]
+    for shardPath in shardPaths(pool.path, noOfShards)[1:]:
+        shardPool = ConnectionPool(shardPath, pool.maxSize)
+        shardPool.connectionFactory = pool.connectionFactory
+        shardPool.connectionHooks = pool.connectionHooks
+        shardPools.append(shardPool)
+
+
+# Closes the connections of every shard
+def closeShards():
+    for shardPool in shardPools:
+        shardPool.closeAll()
+
+
+# Gives a connection to a shard, the request's own connection for the first shard, else one checked out from the shard's pool
+@contextmanager
+def shardConnection(connection, shard):
+    if shard == 0:
+        yield connection
+        return
+    shardPool = shardPools[shard]
+    checkedOutConnection = shardPool.checkOut()
+    try:
+        yield checkedOutConnection
+    finally:
+        shardPool.checkIn(checkedOutConnection)
+
+
+# Runs a read, a function which gets a connection, on every shard in parallel
+# With shardArguments, the read gets the argument of its shard too, e.g. a position in the shard's own sequence
+# The reads run in the context of the request, so their queries are counted in its metrics
+# Returns the result of each shard, in shard order
+def fanOut(connection, read, shardArguments=None):
+    def readShard(shard):
+        with shardConnection(connection, shard) as checkedOutConnection:
+            return read(checkedOutConnection) if shardArguments is None else read(checkedOutConnection, shardArguments[shard])
+
+    if len(shardPools) == 1:
+        return [readShard(0)]
+
+    futures = [fanOutExecutor.submit(contextvars.copy_context().run, readShard, shard) for shard in range(len(shardPools))]
+    return [future.result() for future in futures]
+
+
+# Gives a connection to every shard, each in a read transaction, so several reads across the shards all see one snapshot of each shard
+# Used where a response is tagged with the version of every shard, so the versions and the data they tag are read together
+# Yields the connections, in shard order
+@contextmanager
+def shardSnapshots(connection):
+    with ExitStack() as stack:
+        snapshotConnections = []
+        for shard in range(len(shardPools)):
+            snapshotConnection = stack.enter_context(shardConnection(connection, shard))
+            stack.enter_context(readTransaction(snapshotConnection))
+            snapshotConnections.append(snapshotConnection)
+        yield snapshotConnections
+
+
+# Runs a read on each of the connections of shardSnapshots in parallel, like fanOut, with the argument of its shard if there are shardArguments
+# Returns the result of each shard, in shard order
+def fanOutSnapshots(snapshotConnections, read, shardArguments=None):
+    def readShard(shard):
+        return read(snapshotConnections[shard]) if shardArguments is None else read(snapshotConnections[shard], shardArguments[shard])
+
+    if len(snapshotConnections) == 1:
+        return [readShard(0)]
+
+    futures = [fanOutExecutor.submit(contextvars.copy_context().run, readShard, shard) for shard in range(len(snapshotConnections))]
+    return [future.result() for future in futures]
+
+
+# Finds the shard a row is on by its ID, which is needed for the expenses, as their shard is the shard of their amount
+# Returns the first shard if its on none of them, so the usual checks of the endpoint return the 404
+def findShard(connection, ID):
+    if len(shardPools) == 1:
+        return 0
+    rowChecks = fanOut(connection, lambda checkedOutConnection: checkedOutConnection.execute("SELECT 1 FROM AMOUNTTRACKER WHERE ID = ?", [ID]).fetchone())
+    for shard, rowCheck in enumerate(rowChecks):
+        if rowCheck is not None:
+            return shard
+    return 0
+
+
+# Sort key of a row by (DATE, ID), the order SQLite gives with ID compared with NOCASE
+def dateIDOrder(DATE, ID):
+    return DATE, ID.encode().lower()
+
+
+# Merges the rows of the shards, each already sorted by the key, into one sorted list of at most limit rows
+def mergeShardRows(shardRows, key, reverse=False, limit=None):
+    if len(shardRows) == 1:
+        return shardRows[0][:limit]
+    mergedRows = heapq.merge(*shardRows, key=key, reverse=reverse)
+    return [row for _, row in zip(range(limit), mergedRows)] if limit is not None else list(mergedRows)
+
+
+# Sums up the (key, total, count) rows of the shards by their key, keys equal after foldKey are summed up as one, under the first of them
+# Returns the rows sorted by key
+def sumShardRows(shardRows, foldKey=lambda key: key):
+    if len(shardRows) == 1:
+        return shardRows[0]
+    summedRows = {}
+    for rows in shardRows:
+        for key, total, count in rows:
+            summedRow = summedRows.setdefault(foldKey(key), [key, 0, 0])
+            summedRow[1] += total
+            summedRow[2] += count
+    return sorted((tuple(summedRow) for summedRow in summedRows.values()), key=lambda row: foldKey(row[0]))
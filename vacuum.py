@@ -0,0 +1,83 @@
+import logging
+import threading
+import settings
+from database import openConnection
+
+
+logger = logging.getLogger(__name__)
+
+# Pause between two steps of the incremental vacuum
+stepPauseSeconds = 0.05
+
+
+# Gives the free pages of the DB back to the filesystem, a few at a time, so the file shrinks after deletes
+# Only DBs with auto_vacuum=INCREMENTAL keep the bookkeeping this needs, see the enableIncrementalVacuum maintenance command, on other DBs it does nothing
+# Every interval the free pages are vacuumed VACUUM_PAGES at a time, each step its own short write, so writers are never held up for long
+# The WAL is then checkpointed, without waiting for readers, as the file only shrinks once the vacuumed pages are written back to it
+class IncrementalVacuum:
+
+    def __init__(self, path, intervalSeconds, pagesPerStep):
+        self.path = path
+        self.intervalSeconds = intervalSeconds
+        self.pagesPerStep = pagesPerStep
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="IncrementalVacuum", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Stops the thread, after the step its on
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        connection = openConnection(self.path)
+        while not self.stopping.wait(self.intervalSeconds):
+            try:
+                self.vacuumFreePages(connection)
+            except Exception:
+                logger.exception("Incremental vacuum failed")
+        connection.close()
+
+    # Vacuums the free pages in steps until there are none left or the thread is stopped
+    # Returns the no of pages given back
+    def vacuumFreePages(self, connection):
+        cur = connection.cursor()
+        if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+
+        noOfVacuumedPages = 0
+        noOfFreePages = cur.execute("PRAGMA freelist_count").fetchone()[0]
+        while noOfFreePages > 0 and not self.stopping.is_set():
+            # incremental_vacuum gives back one page per step of the statement and returns no rows, so execute would only step it once
+            # and leave its write transaction open, executescript runs it to the end
+            connection.executescript("PRAGMA incremental_vacuum(" + str(self.pagesPerStep) + ")")
+            noOfVacuumedPages += min(noOfFreePages, self.pagesPerStep)
+            # Pauses between the steps, so a writer waiting on its busy timeout gets the lock before the next step
+            self.stopping.wait(stepPauseSeconds)
+            noOfFreePages = cur.execute("PRAGMA freelist_count").fetchone()[0]
+
+        if noOfVacuumedPages > 0:
+            cur.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+            logger.info("Incremental vacuum gave back %d pages", noOfVacuumedPages)
+        return noOfVacuumedPages
+
+
+# Incremental vacuum of each shard of the DB
+vacuums = []
+
+
+# Starts the incremental vacuum of each shard, if its turned on
+def startVacuum(paths):
+    if settings.VACUUM_INTERVAL_S > 0:
+        for path in paths:
+            vacuum = IncrementalVacuum(path, settings.VACUUM_INTERVAL_S, settings.VACUUM_PAGES)
+            vacuum.start()
+            vacuums.append(vacuum)
+
+
+# Stops the incremental vacuums, if they are running
+def stopVacuum():
+    while vacuums:
+        vacuums.pop().stop()
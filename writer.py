@@ -0,0 +1,114 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import settings
+from database import openConnection, writeTransaction
+
+
+logger = logging.getLogger(__name__)
+
+
+# Single writer for the DB, used when AMOUNTTRACKER_WRITE_PIPELINE is on
+# Write operations from every request are queued to one thread, which owns the only writing connection
+# The thread applies the queued operations in batches, each batch in one transaction, i.e. one commit for many writes
+# Each operation runs in its own savepoint, so one failing operation is rolled back without failing the rest of its batch
+# The future of an operation is resolved with its result once its batch is committed
+class WritePipeline:
+
+    def __init__(self, path, maxBatchSize, lingerSeconds):
+        self.path = path
+        self.maxBatchSize = maxBatchSize
+        self.lingerSeconds = lingerSeconds
+        self.pendingOperations = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="WritePipeline", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Applies the operations already queued and stops the thread
+    def stop(self):
+        self.pendingOperations.put(None)
+        self.thread.join()
+
+    # Queues an operation, a function which gets the writer connection and returns the result of the write
+    # Returns a future of the result
+    def submit(self, operation):
+        future = Future()
+        self.pendingOperations.put((operation, future))
+        return future
+
+    def run(self):
+        connection = openConnection(self.path)
+        stopping = False
+        while not stopping:
+            batch = [self.pendingOperations.get()]
+            if batch[0] is None:
+                break
+
+            # Collects more operations until the batch is full or the linger time has passed
+            lingerDeadline = time.perf_counter() + self.lingerSeconds
+            while len(batch) < self.maxBatchSize:
+                try:
+                    nextOperation = self.pendingOperations.get(timeout=max(0, lingerDeadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if nextOperation is None:
+                    stopping = True
+                    break
+                batch.append(nextOperation)
+
+            self.applyBatch(connection, batch)
+        connection.close()
+
+    def applyBatch(self, connection, batch):
+        cur = connection.cursor()
+        outcomes = []
+        try:
+            with writeTransaction(connection):
+                for operation, future in batch:
+                    cur.execute("SAVEPOINT OPERATION")
+                    try:
+                        outcomes.append((future, operation(connection), None))
+                    except Exception as error:
+                        cur.execute("ROLLBACK TO OPERATION")
+                        outcomes.append((future, None, error))
+                    cur.execute("RELEASE OPERATION")
+        except Exception as error:
+            logger.exception("Write batch of %d operations failed", len(batch))
+            outcomes = [(future, None, error) for _, future in batch]
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+# Write pipeline of each shard of the DB
+pipelines = []
+
+
+# Starts a write pipeline for each shard, if its turned on
+def startPipeline(paths):
+    if settings.WRITE_PIPELINE:
+        for path in paths:
+            pipeline = WritePipeline(path, settings.WRITE_BATCH_SIZE, settings.WRITE_LINGER_MS / 1000)
+            pipeline.start()
+            pipelines.append(pipeline)
+
+
+# Stops the write pipelines, if they are running, once the queued writes are applied
+def stopPipeline():
+    while pipelines:
+        pipelines.pop().stop()
+
+
+# Runs a write operation, a function which gets a connection, in a write transaction and returns its result
+# With the write pipeline on the operation is handed to the writer thread of the shard, else it runs on the given connection to the shard
+def runWrite(connection, operation, shard=0):
+    if pipelines:
+        return pipelines[shard].submit(operation).result()
+    with writeTransaction(connection):
+        return operation(connection)